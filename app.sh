@@ -6,8 +6,13 @@ VIRTUALENV_BASE="${VIRTUALENV_BASE:-/virtualenv}"
 case "$1" in
     deploy)
         ./manage.py collectstatic --no-input
+        ./manage.py generate_schema  # Pre-generate the OpenAPI schema
         ./manage.py migrate --no-input  # Migrate database
-        ./manage.py loaddata auth_fixture # Load our fixture
+        # Load our fixture into a fresh database, without resetting the demo data
+        # (and the apps' keys) on every deploy
+        if [ "$(./manage.py shell -c 'from auth_demo.models import User; print(User.objects.exists())')" = False ]; then
+            ./manage.py loaddata auth_fixture
+        fi
         ;;
 
     test)
@@ -8,3 +8,8 @@ class AuthDemoConfig(AppConfig):
 
     default_auto_field = "django.db.models.BigAutoField"
     name = "auth_demo"
+
+    def ready(self):
+        """Connect the app's signal receivers and register its schema extensions."""
+        # pylint: disable=import-outside-toplevel,unused-import
+        from auth_demo import schema, signals  # noqa: F401
@@ -0,0 +1,73 @@
+"""
+The project's ASGI handler.
+
+Django 3.2 iterates over a streaming response on the event loop, so one that
+reads from the database as it goes, like the exports, fails with
+`SynchronousOnlyOperation`. The handler here fetches each part of a streaming
+response with `sync_to_async` instead, a chunk's worth at a time.
+"""
+
+import django
+from asgiref.sync import sync_to_async
+from django.core.handlers import asgi
+
+
+def _read_chunk(parts, size):
+    """Join parts of a streaming response until there are `size` bytes, or it ends."""
+    chunk = []
+    length = 0
+    for part in parts:
+        chunk.append(part)
+        if (length := length + len(part)) >= size:
+            break
+
+    return b"".join(chunk)
+
+
+class ASGIHandler(asgi.ASGIHandler):
+    """Django's ASGI handler, streaming responses' content from off the event loop."""
+
+    async def send_response(self, response, send):
+        """Encode and send a response out over ASGI."""
+        if not response.streaming:
+            await super().send_response(response, send)
+            return
+
+        response_headers = [
+            (
+                header.encode("ascii") if isinstance(header, str) else header,
+                value.encode("latin1") if isinstance(value, str) else value,
+            )
+            for header, value in response.items()
+        ]
+        response_headers.extend(
+            (b"Set-Cookie", cookie.output(header="").encode("ascii").strip())
+            for cookie in response.cookies.values()
+        )
+        await send(
+            {
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": response_headers,
+            }
+        )
+
+        # Read the content in the thread that ran the view, which holds any cursor
+        # it's read from. An export yields a part per row, so gather a chunk's
+        # worth of them per hop rather than queueing a hop for every row.
+        parts = iter(response)
+        read_chunk = sync_to_async(_read_chunk, thread_sensitive=True)
+        while chunk := await read_chunk(parts, self.chunk_size):
+            for body, _ in self.chunk_bytes(chunk):
+                await send(
+                    {"type": "http.response.body", "body": body, "more_body": True}
+                )
+
+        await send({"type": "http.response.body"})
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+
+def get_asgi_application():
+    """Set up Django and return the project's ASGI application."""
+    django.setup(set_prefix=False)
+    return ASGIHandler()
@@ -0,0 +1,67 @@
+"""
+An async request path for the API's viewsets.
+
+Under ASGI, Django 3.2 runs every synchronous view in one shared thread, so a
+blocking ORM call in one request holds up every other request in the process. The
+views here are coroutines instead. Each runs authentication, permissions, the
+handler and rendering in a single `sync_to_async` hop on the thread pool, leaving
+the event loop free to serve other requests in the meantime.
+"""
+
+import functools
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework import routers
+
+
+def async_view(view):
+    """Turn a synchronous view into a coroutine that runs it off the event loop."""
+
+    def run_view(request, *args, **kwargs):
+        # Connections belong to the pool thread, so tidy them up here rather than
+        # relying on the request signals, which fire in another thread.
+        close_old_connections()
+        try:
+            response = view(request, *args, **kwargs)
+
+            # Render while we're here, instead of in another hop to Django's thread.
+            if callable(getattr(response, "render", None)):
+                response.render()
+
+            return response
+        finally:
+            close_old_connections()
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        return await sync_to_async(run_view, thread_sensitive=False)(
+            request, *args, **kwargs
+        )
+
+    return wrapper
+
+
+class AsyncRouter(routers.SimpleRouter):
+    """
+    A router that serves list and create through `async_view`.
+
+    Only takes effect when `AUTH_DEMO_ASYNC_VIEWS` is on, which it is when the
+    project is served through `linktreetest.asgi`. Other actions, such as the
+    streaming export, stay synchronous; `auth_demo.asgi.ASGIHandler` reads the
+    export's content off the event loop.
+    """
+
+    async_actions = {"list", "create"}
+
+    def get_urls(self):
+        """Return the URLs, with the list/create views wrapped when running async."""
+        urls = super().get_urls()
+
+        if settings.AUTH_DEMO_ASYNC_VIEWS:
+            for url in urls:
+                if self.async_actions & set(url.callback.actions.values()):
+                    url.callback = async_view(url.callback)
+
+        return urls
@@ -1,21 +1,179 @@
-"""Custom authenticator class for third-party apps to use."""
+"""Custom authenticator classes."""
 
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
 from rest_framework import authentication, exceptions
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import aware_utcnow
+
+from auth_demo.instrumentation import get_metrics
+from auth_demo.registry import app_registry
+from auth_demo.snapshots import load_snapshot, user_version_name
+from auth_demo.versioning import get_version
 
-from auth_demo.models import ThirdPartyApp
+# Changed whenever the cached `UserSnapshot` changes shape.
+JWT_KEY_PREFIX = "auth_demo:jwt:2:"
 
 
 class ThirdPartyAppAuthentication(authentication.BaseAuthentication):
-    """Authentication backend for third-party apps."""
+    """
+    Authentication backend for third-party apps.
+
+    Apps authenticate with their API key in the `X-External-App-Key` header, which
+    is checked against the in-memory app registry. Naming the app in the
+    `X-External-App` header is only accepted if
+    `AUTH_DEMO_APP_NAME_AUTHENTICATION` is on.
+    """
 
     def authenticate(self, request):
         """Authenticate the request."""
+        if api_key := request.META.get("HTTP_X_EXTERNAL_APP_KEY"):
+            if (app := app_registry.get_by_key(api_key)) is None:
+                raise exceptions.AuthenticationFailed("Invalid API key.")
+
+            return (None, app)
+
         if not (app_name := request.META.get("HTTP_X_EXTERNAL_APP")):
             return None
 
-        try:
-            app = ThirdPartyApp.objects.get(app_name=app_name)
-        except ThirdPartyApp.DoesNotExist:
-            raise exceptions.AuthenticationFailed("App doesn't exist.") from None
+        if not settings.AUTH_DEMO_APP_NAME_AUTHENTICATION:
+            raise exceptions.AuthenticationFailed("An API key is required.")
+
+        if (app := app_registry.get(app_name)) is None:
+            raise exceptions.AuthenticationFailed("App doesn't exist.")
 
         return (None, app)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that remembers the tokens it has already verified.
+
+    Once a token has been verified, its claims and a snapshot of its user are
+    cached against a digest of the token until the token expires. Seeing the same
+    token again skips both verifying its signature and loading the user. Entries
+    are tied to the user's version, which is bumped whenever the user is saved or
+    deleted (see `auth_demo.signals`), so a changed user is loaded afresh.
+
+    `request.user` is a `UserSnapshot` rather than a `User`.
+    """
+
+    def authenticate(self, request):
+        """Authenticate the request, from the cache if we've seen the token before."""
+        if (header := self.get_header(request)) is None:
+            return None
+
+        if (raw_token := self.get_raw_token(header)) is None:
+            return None
+
+        key = JWT_KEY_PREFIX + hashlib.sha256(raw_token).hexdigest()
+
+        if (cached := cache.get(key)) is not None:
+            user_version, token_class, claims, user = cached
+            if get_version(user_version_name(user.id)).token == user_version:
+                return user, self.get_cached_token(token_class, raw_token, claims)
+
+        validated_token = self.get_validated_token(raw_token)
+        user_version = get_version(user_version_name(self.get_user_id(validated_token)))
+        user = self.get_user(validated_token)
+
+        if (timeout := validated_token["exp"] - time.time()) > 0:
+            cache.set(
+                key,
+                (
+                    user_version.token,
+                    type(validated_token),
+                    validated_token.payload,
+                    user,
+                ),
+                timeout,
+            )
+
+        return user, validated_token
+
+    @staticmethod
+    def get_cached_token(token_class, raw_token, claims):
+        """Rebuild a token we've already verified, without verifying it again."""
+        # Skip `__init__`, which would decode and verify the token.
+        token = token_class.__new__(token_class)
+        token.token = raw_token
+        token.current_time = aware_utcnow()
+        token.payload = claims
+        return token
+
+    @staticmethod
+    def get_user_id(validated_token):
+        """Return the ID of the user a token was issued to."""
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(
+                _("Token contained no recognizable user identification")
+            ) from None
+
+    def get_user(self, validated_token):
+        """Load a snapshot of the user a token was issued to."""
+        if (user := load_snapshot(self.get_user_id(validated_token))) is None:
+            raise exceptions.AuthenticationFailed(
+                _("User not found"), code="user_not_found"
+            )
+
+        return user
+
+
+class DispatchingAuthentication(authentication.BaseAuthentication):
+    """
+    Authenticate each request with the one backend its headers call for.
+
+    A request with an `Authorization` header is authenticated with a JWT, one with
+    an app's headers as a third-party app, and one with a session cookie from the
+    session. Only the chosen backend runs, so a session user doesn't pay
+    for the JWT and app checks, and a failed app lookup doesn't stop anything
+    else. The chosen backend is recorded in the request's metrics.
+    """
+
+    def __init__(self):
+        """Set up the backends."""
+        self.jwt = CachedJWTAuthentication()
+        self.backends = {
+            "jwt": self.jwt,
+            "app": ThirdPartyAppAuthentication(),
+            "session": authentication.SessionAuthentication(),
+        }
+
+    @staticmethod
+    def select_backend(request):
+        """Return the name of the backend to use, or `None` if there isn't one."""
+        if "HTTP_AUTHORIZATION" in request.META:
+            return "jwt"
+
+        if (
+            "HTTP_X_EXTERNAL_APP_KEY" in request.META
+            or "HTTP_X_EXTERNAL_APP" in request.META
+        ):
+            return "app"
+
+        if settings.SESSION_COOKIE_NAME in request.COOKIES:
+            return "session"
+
+        return None
+
+    def authenticate(self, request):
+        """Authenticate the request with its backend."""
+        if (name := self.select_backend(request)) is None:
+            return None
+
+        if (metrics := get_metrics(request)) is not None:
+            metrics.authenticator = name
+
+        return self.backends[name].authenticate(request)
+
+    def authenticate_header(self, request):
+        """Ask unauthenticated clients for a JWT, so they get a 401."""
+        return self.jwt.authenticate_header(request)
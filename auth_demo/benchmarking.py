@@ -0,0 +1,370 @@
+"""
+Seeding and running the API benchmarks.
+
+The benchmarks run in-process against whichever database is configured, so they
+can be pointed at SQLite or a local Postgres. Everything they seed is prefixed
+with `BENCHMARK_PREFIX` so it can be found, and cleared, again.
+"""
+
+import functools
+import platform
+import random
+import statistics
+import subprocess
+import time
+
+import django
+from django.conf import settings
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from auth_demo.entitlements import rebuild_entitlements
+from auth_demo.factories import (
+    AdvertisementFactory,
+    MessageFactory,
+    ThirdPartyAppFactory,
+    UserFactory,
+)
+from auth_demo.hierarchy import ParentLink, rebuild_closure
+from auth_demo.models import (
+    Advertisement,
+    Message,
+    Subscription,
+    ThirdPartyApp,
+    ThirdPartyAppActionPermission,
+    User,
+)
+from auth_demo.registry import app_registry
+from auth_demo.subscribers import subscriber_index
+from auth_demo.throttling import get_backend
+from auth_demo.versioning import bump_table_versions
+
+BENCHMARK_PREFIX = "bench-"
+
+# The callers we benchmark, and the endpoints and actions they call.
+CALLERS = ("jwt", "session", "app")
+ENDPOINTS = {"message": Message, "advertisement": Advertisement}
+ACTIONS = ("list", "create")
+
+
+def _log(stdout, message):
+    """Write a progress message, if there's anywhere to write it."""
+    if stdout is not None:
+        stdout.write(message)
+
+
+def _bulk_create(model, objects, batch_size):
+    """Insert a lot of objects, a batch at a time."""
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) == batch_size:
+            model.objects.bulk_create(batch)
+            batch = []
+
+    model.objects.bulk_create(batch)
+
+
+def get_api_key(app_name):
+    """Return the API key for one of the benchmark apps."""
+    # Only ever used for benchmark data, so it doesn't need to be a secret.
+    return f"{app_name}-key"
+
+
+def clear_data():
+    """Delete everything the benchmarks have seeded."""
+    User.objects.filter(username__startswith=BENCHMARK_PREFIX).delete()
+    ThirdPartyApp.objects.filter(app_name__startswith=BENCHMARK_PREFIX).delete()
+    rebuild_closure()
+    app_registry.clear()
+    subscriber_index.clear()
+
+
+def seed_data(  # pylint: disable=too-many-arguments,too-many-locals
+    *,
+    users=1000,
+    parents=3,
+    apps=20,
+    subscriptions=5,
+    messages=100000,
+    adverts=10000,
+    batch_size=5000,
+    seed=0,
+    stdout=None,
+):
+    """
+    Seed a dataset for the benchmarks to run against.
+
+    Every user gets `parents` random parents and `subscriptions` random
+    subscriptions, and every app can list and create messages and adverts. The
+    messages and adverts are spread randomly across the users. Half of the users
+    are paid subscribers. The same `seed` always produces the same dataset.
+    """
+    rng = random.Random(seed)
+
+    _log(stdout, f"Creating {users} users...")
+    _bulk_create(
+        User,
+        (
+            UserFactory.build(
+                username=f"{BENCHMARK_PREFIX}user-{index}",
+                paid_subscriber=index % 2 == 0,
+            )
+            for index in range(users)
+        ),
+        batch_size,
+    )
+    user_ids = list(
+        User.objects.filter(username__startswith=BENCHMARK_PREFIX)
+        .order_by("id")
+        .values_list("id", flat=True)
+    )
+
+    _log(stdout, f"Linking each user to {parents} parents...")
+    # `parents` is symmetrical, so each link is stored in both directions.
+    links = set()
+    for user_id in user_ids:
+        for parent_id in rng.sample(user_ids, min(parents, len(user_ids))):
+            if parent_id != user_id:
+                links.update(((user_id, parent_id), (parent_id, user_id)))
+    _bulk_create(
+        ParentLink,
+        (ParentLink(from_user_id=child, to_user_id=parent) for child, parent in links),
+        batch_size,
+    )
+    rebuild_closure()
+
+    _log(stdout, f"Creating {apps} apps...")
+    _bulk_create(
+        ThirdPartyApp,
+        (
+            ThirdPartyAppFactory.build(
+                app_name=(app_name := f"{BENCHMARK_PREFIX}app-{index}"),
+                api_key=get_api_key(app_name),
+            )
+            for index in range(apps)
+        ),
+        batch_size,
+    )
+    app_ids = list(
+        ThirdPartyApp.objects.filter(app_name__startswith=BENCHMARK_PREFIX)
+        .order_by("id")
+        .values_list("id", flat=True)
+    )
+    _bulk_create(
+        ThirdPartyAppActionPermission,
+        (
+            ThirdPartyAppActionPermission(
+                app_id=app_id, action=action, url_name=f"{endpoint}-list"
+            )
+            for app_id in app_ids
+            for action in ACTIONS
+            for endpoint in ENDPOINTS
+        ),
+        batch_size,
+    )
+
+    _log(stdout, f"Subscribing each user to {subscriptions} apps...")
+    _bulk_create(
+        Subscription,
+        (
+            Subscription(user_id=user_id, app_id=app_id)
+            for user_id in user_ids
+            for app_id in rng.sample(app_ids, min(subscriptions, len(app_ids)))
+        ),
+        batch_size,
+    )
+
+    for model, factory, count in (
+        (Message, MessageFactory, messages),
+        (Advertisement, AdvertisementFactory, adverts),
+    ):
+        _log(stdout, f"Creating {count} {model._meta.verbose_name_plural}...")
+        _bulk_create(
+            model,
+            (factory.build(user=User(pk=rng.choice(user_ids))) for _ in range(count)),
+            batch_size,
+        )
+
+        # Bulk inserts don't send signals, so invalidate any cached lists here.
+        bump_table_versions(model, user_ids)
+
+    # Nothing above sent any signals, so work out the entitlements in one go.
+    _log(stdout, "Rebuilding advert entitlements...")
+    rebuild_entitlements()
+    app_registry.clear()
+    subscriber_index.clear()
+
+
+def _percentile(values, percent):
+    """Return the given percentile of some sorted values."""
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def _summarise(timings, queries, errors, elapsed):
+    """Summarise the timings and query counts from a scenario."""
+    timings = sorted(timings)
+    return {
+        "requests": len(timings),
+        "errors": errors,
+        "rps": len(timings) / elapsed,
+        "latency_ms": {
+            "p50": _percentile(timings, 50) * 1000,
+            "p90": _percentile(timings, 90) * 1000,
+            "p99": _percentile(timings, 99) * 1000,
+            "mean": statistics.mean(timings) * 1000,
+            "max": timings[-1] * 1000,
+        },
+        "queries": {"mean": statistics.mean(queries), "max": max(queries)},
+    }
+
+
+def _get_actors():
+    """
+    Pick the users and app the benchmarks act as.
+
+    Returns a paid subscriber to create objects for, a user that can act on their
+    behalf (one of their parents, if they have any) and an app they're subscribed
+    to.
+    """
+    users = User.objects.filter(
+        username__startswith=BENCHMARK_PREFIX,
+        paid_subscriber=True,
+        subscriptions__isnull=False,
+    ).order_by("id")
+    if (target := users.filter(parents__isnull=False).first() or users.first()) is None:
+        return None
+
+    actor = target.parents.order_by("id").first() or target
+    app = ThirdPartyApp.objects.filter(subscriptions__user=target).order_by("id")[0]
+    return target, actor, app
+
+
+def _get_client(caller, actor, app):
+    """Return an API client that makes requests as the given kind of caller."""
+    client = APIClient()
+
+    if caller == "jwt":
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(actor)}")
+    elif caller == "session":
+        client.force_login(actor)
+    else:
+        client.credentials(HTTP_X_EXTERNAL_APP_KEY=get_api_key(app.app_name))
+
+    return client
+
+
+def _measure(send, expected_status, requests, warmup):
+    """Time some requests, and count the queries they make."""
+    for _ in range(warmup):
+        send()
+
+    timings, queries, errors = [], [], 0
+    started = time.perf_counter()
+    for _ in range(requests):
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = send()
+            timings.append(time.perf_counter() - start)
+
+        queries.append(len(captured))
+        errors += response.status_code != expected_status
+
+    return _summarise(timings, queries, errors, time.perf_counter() - started)
+
+
+def _run_scenario(client, scenario, target, requests, warmup):
+    """Make the scenario's requests, and return a summary of how they went."""
+    url = reverse(f"{scenario['endpoint']}-list")
+    if scenario["action"] == "list":
+        send, expected_status = functools.partial(client.get, url), 200
+    else:
+        data = {"user": target.username, scenario["endpoint"]: "Benchmarking"}
+        send = functools.partial(client.post, url, data, format="json")
+        expected_status = 201
+
+    return _measure(send, expected_status, requests, warmup)
+
+
+def _get_commit():
+    """Return the commit being benchmarked, if we're in a git checkout."""
+    try:
+        return subprocess.run(
+            ("git", "rev-parse", "HEAD"),
+            capture_output=True,
+            check=True,
+            cwd=settings.BASE_DIR,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(requests=200, warmup=20, callers=CALLERS, list_cache=True):
+    """
+    Benchmark the list and create endpoints, and return the results.
+
+    Each scenario's requests are made one after another through the full
+    middleware stack. Objects created by the benchmarks are rolled back afterwards,
+    so runs against the same dataset can be compared.
+    """
+    if (actors := _get_actors()) is None:
+        return None
+
+    target, actor, app = actors
+    scenarios = [
+        {"caller": caller, "action": action, "endpoint": endpoint}
+        for caller in callers
+        for action in ACTIONS
+        for endpoint in ENDPOINTS
+    ]
+    results = []
+    # Each scenario's requests come from one caller, so give the benchmarks their
+    # own buckets, big enough to hold all of them. The throttles are still checked,
+    # so their cost is still measured.
+    overrides = {
+        "ALLOWED_HOSTS": [*settings.ALLOWED_HOSTS, "testserver"],
+        "AUTH_DEMO_THROTTLE_BACKEND": "auth_demo.throttling.LocalTokenBucketBackend",
+        "AUTH_DEMO_THROTTLE_LOCATION": "benchmarks",
+        "AUTH_DEMO_APP_THROTTLE_BURST": requests + warmup,
+        "AUTH_DEMO_USER_THROTTLE_BURST": requests + warmup,
+    }
+    if not list_cache:
+        overrides["AUTH_DEMO_LIST_CACHE_TIMEOUT"] = 0
+
+    with override_settings(**overrides):
+        for scenario in scenarios:
+            client = _get_client(scenario["caller"], actor, app)
+            get_backend().clear()
+
+            with transaction.atomic():
+                summary = _run_scenario(client, scenario, target, requests, warmup)
+                transaction.set_rollback(True)
+
+            results.append({**scenario, **summary})
+
+    return {
+        "commit": _get_commit(),
+        "timestamp": timezone.now().isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "list_cache": list_cache,
+        },
+        "dataset": {
+            "users": User.objects.count(),
+            "apps": ThirdPartyApp.objects.count(),
+            "subscriptions": Subscription.objects.count(),
+            "messages": Message.objects.count(),
+            "advertisements": Advertisement.objects.count(),
+        },
+        "requests": requests,
+        "scenarios": results,
+    }
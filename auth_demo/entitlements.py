@@ -0,0 +1,122 @@
+"""
+Maintenance and checking of advert entitlements.
+
+Creating an advert for a user needs them to be a paid subscriber, or staff for
+their own adverts, as well as the app or user making the request to be allowed to
+act for them. `AdvertEntitlement` holds a row for each combination that's
+allowed, rebuilt for a user whenever anything it depends on changes, so checking
+one is a single indexed lookup.
+
+Each user's entitlements are also cached, against the user's version, which the
+signal receivers bump along with every update (see `auth_demo.signals`).
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Q
+
+from auth_demo.hierarchy import get_delegation_depth
+from auth_demo.models import AdvertEntitlement, Subscription, User, UserClosure
+from auth_demo.snapshots import user_version_name
+from auth_demo.versioning import bump_version, get_version
+
+KEY_PREFIX = "auth_demo:entitlements:"
+ENTITLEMENTS_VERSION = "entitlements"
+
+
+def _entitlement_rows(user_ids):
+    """Build the entitlement rows for the given users."""
+    entitled = User.objects.filter(
+        Q(is_staff=True) | Q(paid_subscriber=True), pk__in=user_ids
+    ).values_list("id", "paid_subscriber")
+
+    rows = []
+    paid = []
+    for user_id, paid_subscriber in entitled:
+        rows.append(AdvertEntitlement(user_id=user_id))
+        if paid_subscriber:
+            paid.append(user_id)
+
+    if not paid:
+        return rows
+
+    rows.extend(
+        AdvertEntitlement(user_id=user_id, app_id=app_id)
+        for user_id, app_id in Subscription.objects.filter(user__in=paid).values_list(
+            "user_id", "app_id"
+        )
+    )
+    rows.extend(
+        AdvertEntitlement(user_id=user_id, actor_id=actor_id)
+        for user_id, actor_id in UserClosure.objects.filter(
+            descendant__in=paid, depth__lte=get_delegation_depth()
+        ).values_list("descendant_id", "ancestor_id")
+    )
+    return rows
+
+
+def update_entitlements(user_ids):
+    """Recalculate the entitlements of the given users."""
+    if not (user_ids := set(user_ids)):
+        return
+
+    with transaction.atomic():
+        AdvertEntitlement.objects.filter(user__in=user_ids).delete()
+        AdvertEntitlement.objects.bulk_create(_entitlement_rows(user_ids))
+
+
+def rebuild_entitlements(batch_size=1000):
+    """Rebuild every entitlement from the users, subscriptions and closure."""
+    user_ids = (
+        User.objects.filter(Q(is_staff=True) | Q(paid_subscriber=True))
+        .order_by("id")
+        .values_list("id", flat=True)
+    )
+
+    with transaction.atomic():
+        AdvertEntitlement.objects.all().delete()
+
+        batch = []
+        for user_id in user_ids.iterator():
+            batch.append(user_id)
+            if len(batch) == batch_size:
+                AdvertEntitlement.objects.bulk_create(_entitlement_rows(batch))
+                batch = []
+
+        AdvertEntitlement.objects.bulk_create(_entitlement_rows(batch))
+
+    bump_version(ENTITLEMENTS_VERSION)
+    transaction.on_commit(lambda: bump_version(ENTITLEMENTS_VERSION))
+
+
+def _get_entitlements(user_id):
+    """Return the `(app_id, actor_id)` pairs a user has entitlements for."""
+    key = (
+        f"{KEY_PREFIX}{get_version(ENTITLEMENTS_VERSION).token}:"
+        f"{get_version(user_version_name(user_id)).token}:{user_id}"
+    )
+
+    if (entitlements := cache.get(key)) is None:
+        # Always read from the primary, as a replica that's behind would leave
+        # out of date entitlements in the cache until the user next changes.
+        entitlements = frozenset(
+            AdvertEntitlement.objects.using(DEFAULT_DB_ALIAS)
+            .filter(user_id=user_id)
+            .values_list("app_id", "actor_id")
+        )
+        cache.set(key, entitlements, settings.AUTH_DEMO_ENTITLEMENT_CACHE_TIMEOUT)
+
+    return entitlements
+
+
+def can_create_adverts(user, *, app=None, actor=None):
+    """
+    Check if adverts can be created for `user`.
+
+    Without an `app` or `actor`, checks if the user can create their own adverts.
+    Otherwise checks if the app, or the other user, can create them for them.
+    """
+    app_id = None if app is None else app.pk
+    actor_id = None if actor is None else actor.pk
+    return (app_id, actor_id) in _get_entitlements(user.pk)
@@ -0,0 +1,36 @@
+"""Lightweight row encoders for streaming exports."""
+
+import csv
+import json
+
+
+class Echo:
+    """A file-like object that hands back whatever is written to it."""
+
+    def write(self, value):
+        """Return the value rather than storing it."""
+        return value
+
+
+def encode_ndjson(columns, rows):
+    """Encode the rows as newline-delimited JSON objects."""
+    encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+    for row in rows:
+        yield encoder.encode(dict(zip(columns, row))) + "\n"
+
+
+def encode_csv(columns, rows):
+    """Encode the rows as CSV, with a header row."""
+    writer = csv.writer(Echo())
+
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+# Maps each export format to its content type and encoder.
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", encode_ndjson),
+    "csv": ("text/csv", encode_csv),
+}
@@ -43,7 +43,21 @@ class AdvertisementFactory(DjangoModelFactory):
 class ThirdPartyAppFactory(DjangoModelFactory):
     """A factory to build a third party app for testing."""
 
-    app_name = factory.Faker("word")
+    # App names are unique, which random words aren't.
+    app_name = factory.Sequence(lambda n: f"app-{n}")
+
+    @factory.post_generation
+    # pylint: disable-next=no-self-argument,method-hidden
+    def api_key(obj, create, extracted, **_kwargs):
+        """Give the app an API key, and keep it on the app for tests to use."""
+        if extracted:
+            obj.api_key = extracted
+            obj.api_key_digest = obj.digest_api_key(extracted)
+        else:
+            obj.api_key = obj.rotate_api_key()
+
+        if create:
+            obj.save(update_fields=["api_key_digest"])
 
     class Meta:
         """Meta options."""
@@ -0,0 +1,161 @@
+"""
+Maintenance of the user closure table.
+
+`UserClosure` holds a row for every user that can act on behalf of another, up to
+`AUTH_DEMO_DELEGATION_DEPTH` parent links away, so that checking delegated access
+is a single indexed lookup rather than a walk of `User.parents`.
+"""
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import Q
+
+from auth_demo.models import User, UserClosure
+
+# Rows link a child (`from_user`) to one of its parents (`to_user`). The relation
+# is symmetrical, so each link is stored in both directions.
+ParentLink = User.parents.through
+
+
+def get_delegation_depth():
+    """
+    Return `AUTH_DEMO_DELEGATION_DEPTH`, checking the closure can support it.
+
+    `User.parents` is symmetrical, so a link doesn't record which end is the
+    parent. A walk of more than one link would go up to a parent and back down to
+    its other children, letting siblings act for each other.
+    """
+    if (depth := settings.AUTH_DEMO_DELEGATION_DEPTH) not in (0, 1):
+        raise ImproperlyConfigured(
+            "AUTH_DEMO_DELEGATION_DEPTH must be 0 or 1, as User.parents doesn't "
+            "record which way round each link goes."
+        )
+
+    return depth
+
+
+def _links_of(user_ids):
+    """
+    Return the `(user, linked user)` ID pairs for the given users' links.
+
+    Links are read in both directions: a symmetrical `add()` sends `post_add`
+    before it inserts the mirrored rows, so they may not be there yet.
+    """
+    user_ids = set(user_ids)
+    links = ParentLink.objects.filter(
+        Q(from_user__in=user_ids) | Q(to_user__in=user_ids)
+    ).values_list("from_user_id", "to_user_id")
+
+    for from_id, to_id in links:
+        if from_id in user_ids:
+            yield from_id, to_id
+        if to_id in user_ids:
+            yield to_id, from_id
+
+
+def _parents_of(user_ids):
+    """Map each of the given users to the IDs of their direct parents."""
+    parents = {}
+    for child_id, parent_id in _links_of(user_ids):
+        parents.setdefault(child_id, set()).add(parent_id)
+
+    return parents
+
+
+def _children_of(user_ids):
+    """Return the IDs of every direct child of the given users."""
+    return {child_id for _, child_id in _links_of(user_ids)}
+
+
+def _closure_rows(descendant_ids, depth):
+    """Build the closure rows for the given users, walking up to `depth` links."""
+    rows = {}
+    # For each descendant, the ancestors found at the previous level.
+    frontier = {user_id: {user_id} for user_id in descendant_ids}
+
+    for level in range(1, depth + 1):
+        parents = _parents_of(set().union(*frontier.values()))
+        next_frontier = {}
+
+        for descendant_id, user_ids in frontier.items():
+            for user_id in user_ids:
+                for parent_id in parents.get(user_id, ()):
+                    key = (descendant_id, parent_id)
+                    if parent_id == descendant_id or key in rows:
+                        continue
+
+                    rows[key] = level
+                    next_frontier.setdefault(descendant_id, set()).add(parent_id)
+
+        if not (frontier := next_frontier):
+            break
+
+    return [
+        UserClosure(descendant_id=descendant_id, ancestor_id=ancestor_id, depth=level)
+        for (descendant_id, ancestor_id), level in rows.items()
+    ]
+
+
+def update_closure(user_ids):
+    """
+    Recalculate the closure rows affected by a change to the given users' links.
+
+    `user_ids` should include both ends of every parent link that was added or
+    removed. Only users close enough to one of them to be affected are rebuilt,
+    and their IDs are returned.
+    """
+    depth = get_delegation_depth()
+    affected = set(user_ids)
+
+    # Users whose ancestors went through one of the changed users before...
+    affected.update(
+        UserClosure.objects.filter(ancestor__in=user_ids).values_list(
+            "descendant_id", flat=True
+        )
+    )
+
+    # ...and those that do now.
+    seen = frontier = set(user_ids)
+    for _ in range(depth - 1):
+        if not (frontier := _children_of(frontier) - seen):
+            break
+        seen = seen | frontier
+    affected.update(seen)
+
+    with transaction.atomic():
+        UserClosure.objects.filter(descendant__in=affected).delete()
+        UserClosure.objects.bulk_create(_closure_rows(affected, depth))
+
+    return affected
+
+
+def rebuild_closure(batch_size=1000):
+    """Rebuild the whole closure table from `User.parents`."""
+    depth = get_delegation_depth()
+    user_ids = (
+        ParentLink.objects.order_by("from_user_id")
+        .values_list("from_user_id", flat=True)
+        .distinct()
+    )
+
+    with transaction.atomic():
+        UserClosure.objects.all().delete()
+
+        batch = []
+        for user_id in user_ids.iterator():
+            batch.append(user_id)
+            if len(batch) == batch_size:
+                UserClosure.objects.bulk_create(_closure_rows(batch, depth))
+                batch = []
+
+        UserClosure.objects.bulk_create(_closure_rows(batch, depth))
+
+
+def is_delegate(ancestor, descendant):
+    """Check if `ancestor` can act on behalf of `descendant`."""
+    return UserClosure.objects.filter(
+        ancestor_id=ancestor.pk,
+        descendant_id=descendant.pk,
+        depth__lte=get_delegation_depth(),
+    ).exists()
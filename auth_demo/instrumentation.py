@@ -0,0 +1,304 @@
+"""
+Per-request timing and query instrumentation.
+
+A sample of requests, `AUTH_DEMO_INSTRUMENTATION_SAMPLE_RATE` of them, get a
+`RequestMetrics` attached by `instrumentation_middleware`. It counts and times
+every query through `connection.execute_wrapper`, and the API views time their
+authentication, permission checks, serialisation and rendering with `measure`.
+
+The results go back to the client in a `Server-Timing` header and into per-view
+histograms. Each process keeps its own histograms and publishes them to Django's
+cache every so often, so `get_stats` can merge them across every worker.
+"""
+
+import asyncio
+import bisect
+import os
+import random
+import socket
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.utils.decorators import sync_and_async_middleware
+
+KEY_PREFIX = "auth_demo:metrics:"
+
+# How often each process publishes its histograms, and how long they're kept for
+# once it stops, in seconds.
+FLUSH_INTERVAL = 10
+PROCESS_TIMEOUT = 3600
+
+# Upper bounds of the histogram buckets, in milliseconds or in queries.
+TIME_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# The timed parts of a request, in the order they happen.
+PHASES = ("authentication", "permissions", "serialisation", "rendering")
+
+
+class RequestMetrics:
+    """The queries made by a request, and how long each part of it took."""
+
+    def __init__(self):
+        """Start with nothing recorded."""
+        self.queries = 0
+        self.db_time = 0.0
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        # The name of the backend that authenticated the request, if any did.
+        self.authenticator = None
+
+    def __call__(self, execute, sql, params, many, context):
+        """Count and time a query, as a database execute wrapper."""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - start
+
+    @contextmanager
+    def measure(self, phase):
+        """Add the time spent in the block to one of the request's phases."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[phase] += time.perf_counter() - start
+
+    def server_timing(self, total):
+        """Build a `Server-Timing` header value for the request."""
+        descriptions = {"db": f"{self.queries} queries"}
+        if self.authenticator is not None:
+            descriptions["authentication"] = self.authenticator
+
+        durations = {"db": self.db_time, **self.phases, "total": total}
+        return ", ".join(
+            f'{name};desc="{descriptions[name]}";dur={duration * 1000:.2f}'
+            if name in descriptions
+            else f"{name};dur={duration * 1000:.2f}"
+            for name, duration in durations.items()
+        )
+
+
+def get_metrics(request):
+    """Return the metrics being recorded for a request, or `None` if it's unsampled."""
+    return getattr(getattr(request, "_request", request), "metrics", None)
+
+
+@contextmanager
+def measure(request, phase):
+    """Time a phase of the request, if it's being sampled."""
+    if (metrics := get_metrics(request)) is None:
+        yield
+        return
+
+    with metrics.measure(phase):
+        yield
+
+
+@contextmanager
+def recording_queries(request):
+    """Count and time the queries made on this thread for a sampled request."""
+    metrics = get_metrics(request)
+    if metrics is None or metrics in connection.execute_wrappers:
+        yield
+        return
+
+    with connection.execute_wrapper(metrics):
+        yield
+
+
+class Histogram:
+    """A count of values falling into each of a fixed set of buckets."""
+
+    def __init__(self, buckets):
+        """Start with empty buckets."""
+        self.buckets = buckets
+        # The last count is for values above the largest bucket.
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        """Add a value to the histogram."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def as_dict(self):
+        """Return the histogram as plain data."""
+        return {
+            "buckets": list(self.buckets),
+            "counts": list(self.counts),
+            "count": self.count,
+            "sum": self.sum,
+        }
+
+
+def _merge(total, histogram):
+    """Add a histogram, as plain data, to a running total."""
+    if total is None:
+        return {**histogram, "counts": list(histogram["counts"])}
+
+    total["counts"] = [a + b for a, b in zip(total["counts"], histogram["counts"])]
+    total["count"] += histogram["count"]
+    total["sum"] += histogram["sum"]
+    return total
+
+
+class _ProcessHistograms:
+    """The histograms recorded by this process, published to the cache."""
+
+    def __init__(self):
+        """Start with no histograms."""
+        self.lock = threading.Lock()
+        self.views = {}
+        self.last_flush = 0.0
+        self.process_id = f"{socket.gethostname()}:{os.getpid()}"
+
+    def record(self, view_name, metrics, total):
+        """Add a request's metrics to its view's histograms."""
+        values = {
+            "total": (TIME_BUCKETS, total * 1000),
+            "db": (TIME_BUCKETS, metrics.db_time * 1000),
+            "queries": (QUERY_BUCKETS, metrics.queries),
+        }
+        values.update(
+            (phase, (TIME_BUCKETS, duration * 1000))
+            for phase, duration in metrics.phases.items()
+        )
+
+        with self.lock:
+            view = self.views.setdefault(
+                view_name, {"histograms": {}, "authenticators": Counter()}
+            )
+            for name, (buckets, value) in values.items():
+                view["histograms"].setdefault(name, Histogram(buckets)).observe(value)
+            view["authenticators"][metrics.authenticator or "none"] += 1
+
+        if time.monotonic() - self.last_flush > FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """Publish this process's histograms to the cache."""
+        with self.lock:
+            self.last_flush = time.monotonic()
+            snapshot = {
+                view_name: {
+                    "histograms": {
+                        name: histogram.as_dict()
+                        for name, histogram in view["histograms"].items()
+                    },
+                    "authenticators": dict(view["authenticators"]),
+                }
+                for view_name, view in self.views.items()
+            }
+
+        cache.set(KEY_PREFIX + self.process_id, snapshot, PROCESS_TIMEOUT)
+
+        # Keep track of which processes have published anything. Two processes
+        # racing here might drop one of them, but only until its next flush.
+        processes = cache.get(KEY_PREFIX + "processes", {})
+        processes[self.process_id] = time.time()
+        cache.set(
+            KEY_PREFIX + "processes",
+            {
+                process_id: seen
+                for process_id, seen in processes.items()
+                if seen > time.time() - PROCESS_TIMEOUT
+            },
+            None,
+        )
+
+    def clear(self):
+        """Forget this process's histograms."""
+        with self.lock:
+            self.views = {}
+            self.last_flush = 0.0
+
+
+_histograms = _ProcessHistograms()
+
+
+def get_stats():
+    """
+    Return every view's metrics, merged across all processes.
+
+    Each view has its histograms, and a count of the requests each authentication
+    backend handled.
+    """
+    _histograms.flush()
+
+    process_ids = cache.get(KEY_PREFIX + "processes", {})
+    snapshots = cache.get_many([KEY_PREFIX + process_id for process_id in process_ids])
+
+    stats = {}
+    for snapshot in snapshots.values():
+        for view_name, view in snapshot.items():
+            histograms, authenticators = stats.setdefault(
+                view_name, {"histograms": {}, "authenticators": {}}
+            ).values()
+            for name, histogram in view["histograms"].items():
+                histograms[name] = _merge(histograms.get(name), histogram)
+            for name, count in view["authenticators"].items():
+                authenticators[name] = authenticators.get(name, 0) + count
+
+    return stats
+
+
+def clear_stats():
+    """Forget the histograms recorded by this process."""
+    _histograms.clear()
+    cache.delete(KEY_PREFIX + _histograms.process_id)
+
+
+def _finish(request, response, metrics, start):
+    """Add the `Server-Timing` header and record the request's metrics."""
+    total = time.perf_counter() - start
+    response["Server-Timing"] = metrics.server_timing(total)
+
+    if (match := request.resolver_match) is not None:
+        _histograms.record(f"{request.method} {match.view_name}", metrics, total)
+
+
+def _is_sampled():
+    """Decide whether to instrument a request."""
+    return random.random() < settings.AUTH_DEMO_INSTRUMENTATION_SAMPLE_RATE
+
+
+@sync_and_async_middleware
+def instrumentation_middleware(get_response):
+    """Instrument a sample of requests."""
+    if asyncio.iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            if not _is_sampled():
+                return await get_response(request)
+
+            # Views run on other threads here, so the API views record their own
+            # queries.
+            request.metrics = metrics = RequestMetrics()
+            start = time.perf_counter()
+            response = await get_response(request)
+            _finish(request, response, metrics, start)
+            return response
+
+    else:
+
+        def middleware(request):
+            if not _is_sampled():
+                return get_response(request)
+
+            request.metrics = metrics = RequestMetrics()
+            start = time.perf_counter()
+            with recording_queries(request):
+                response = get_response(request)
+            _finish(request, response, metrics, start)
+            return response
+
+    return middleware
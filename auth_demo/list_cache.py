@@ -0,0 +1,50 @@
+"""A cache of serialised list pages, invalidated along with the tables' versions."""
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+KEY_PREFIX = "auth_demo:list-cache:"
+
+
+def _page_key(version, url):
+    """Return the cache key for the page at `url` as of `version`."""
+    # Pages cached against an older version are never looked up again, they just
+    # expire.
+    return f"{KEY_PREFIX}page:{version.token}:{hashlib.md5(url.encode()).hexdigest()}"
+
+
+def _counter_key(model, counter):
+    """Return the cache key for one of a model's hit/miss counters."""
+    return f"{KEY_PREFIX}{counter}:{model._meta.label_lower}"
+
+
+def _increment(key):
+    """Increment a counter, starting it if it doesn't exist yet."""
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def get_page(model, version, url):
+    """Return the cached data for a page, or `None` if it isn't cached."""
+    data = cache.get(_page_key(version, url))
+    _increment(_counter_key(model, "misses" if data is None else "hits"))
+    return data
+
+
+def set_page(version, url, data):
+    """Cache the data for a page."""
+    cache.set(_page_key(version, url), data, settings.AUTH_DEMO_LIST_CACHE_TIMEOUT)
+
+
+def get_stats(model):
+    """Return the number of cache hits and misses for a model's list pages."""
+    counters = ("hits", "misses")
+    values = cache.get_many([_counter_key(model, counter) for counter in counters])
+    return {
+        counter: values.get(_counter_key(model, counter), 0) for counter in counters
+    }
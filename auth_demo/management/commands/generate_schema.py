@@ -0,0 +1,19 @@
+"""Pre-generate the OpenAPI schema as a static file."""
+
+from django.core.management.base import BaseCommand
+
+from auth_demo.static_schema import write_schema
+
+
+class Command(BaseCommand):
+    """Write the OpenAPI schema into the static files, and compress it."""
+
+    help = (
+        "Generate the OpenAPI schema into STATIC_ROOT, so the Swagger UI can load it "
+        "as a static file. Run it after collectstatic on each deploy."
+    )
+
+    def handle(self, *args, **options):
+        """Write the schema."""
+        for path in write_schema():
+            self.stdout.write(f"Wrote {path}.")
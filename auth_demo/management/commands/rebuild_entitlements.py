@@ -0,0 +1,22 @@
+"""Rebuild the advert entitlements table."""
+
+from django.core.management.base import BaseCommand
+
+from auth_demo.entitlements import rebuild_entitlements
+from auth_demo.models import AdvertEntitlement
+
+
+class Command(BaseCommand):
+    """Rebuild every user's advert entitlements."""
+
+    help = (
+        "Rebuild the table of who can create adverts for each user, from the users, "
+        "their subscriptions and the user closure table."
+    )
+
+    def handle(self, *args, **options):
+        """Rebuild the table."""
+        rebuild_entitlements()
+        self.stdout.write(
+            f"Rebuilt {AdvertEntitlement.objects.count()} entitlement rows."
+        )
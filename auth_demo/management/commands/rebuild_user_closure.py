@@ -0,0 +1,17 @@
+"""Rebuild the user closure table."""
+
+from django.core.management.base import BaseCommand
+
+from auth_demo.hierarchy import rebuild_closure
+from auth_demo.models import UserClosure
+
+
+class Command(BaseCommand):
+    """Rebuild the user closure table from every user's parents."""
+
+    help = "Rebuild the table of users that can act on behalf of other users."
+
+    def handle(self, *args, **options):
+        """Rebuild the table."""
+        rebuild_closure()
+        self.stdout.write(f"Rebuilt {UserClosure.objects.count()} closure rows.")
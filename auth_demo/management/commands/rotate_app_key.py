@@ -0,0 +1,29 @@
+"""Give a third-party app a new API key."""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from auth_demo.models import ThirdPartyApp
+
+
+class Command(BaseCommand):
+    """Give a third-party app a new API key, and print it."""
+
+    help = (
+        "Give a third-party app a new API key. Its old key stops working straight "
+        "away, and the new one is only shown once."
+    )
+
+    def add_arguments(self, parser):
+        """Add the app's name as an argument."""
+        parser.add_argument("app_name")
+
+    def handle(self, *args, **options):
+        """Rotate the app's key."""
+        try:
+            app = ThirdPartyApp.objects.get(app_name=options["app_name"])
+        except ThirdPartyApp.DoesNotExist:
+            raise CommandError(f"There's no app named {options['app_name']}.") from None
+
+        api_key = app.rotate_api_key()
+        app.save(update_fields=["api_key_digest"])
+        self.stdout.write(api_key)
@@ -0,0 +1,60 @@
+"""Benchmark the API's hot paths."""
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from auth_demo.benchmarking import CALLERS, run_benchmarks
+
+
+class Command(BaseCommand):
+    """Benchmark listing and creating messages and adverts, and print the results."""
+
+    help = (
+        "Measure latency, throughput and query counts for the list and create "
+        "endpoints, as JWT users, session users and third-party apps. Run "
+        "`seed_benchmark_data` first."
+    )
+
+    def add_arguments(self, parser):
+        """Add the benchmark options as arguments."""
+        parser.add_argument(
+            "--requests", type=int, default=200, help="Requests per scenario."
+        )
+        parser.add_argument(
+            "--warmup",
+            type=int,
+            default=20,
+            help="Requests to make before measuring each scenario.",
+        )
+        parser.add_argument(
+            "--caller",
+            action="append",
+            choices=CALLERS,
+            dest="callers",
+            help="Only benchmark this kind of caller. Can be given more than once.",
+        )
+        parser.add_argument(
+            "--no-list-cache",
+            action="store_false",
+            dest="list_cache",
+            help="Turn off the cache of list pages.",
+        )
+        parser.add_argument("--output", help="Write the results to this file.")
+
+    def handle(self, *args, **options):
+        """Run the benchmarks and write out the results as JSON."""
+        results = run_benchmarks(
+            requests=options["requests"],
+            warmup=options["warmup"],
+            callers=options["callers"] or CALLERS,
+            list_cache=options["list_cache"],
+        )
+        if results is None:
+            raise CommandError("There's no benchmark data, run seed_benchmark_data.")
+
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as output:
+                json.dump(results, output, indent=2)
+        else:
+            self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,55 @@
+"""Seed a dataset for the API benchmarks."""
+
+from django.core.management.base import BaseCommand
+
+from auth_demo.benchmarking import clear_data, seed_data
+
+
+class Command(BaseCommand):
+    """Seed users, apps, subscriptions, messages and adverts to benchmark against."""
+
+    help = "Seed a dataset for the API benchmarks to run against."
+
+    def add_arguments(self, parser):
+        """Add the size of the dataset as arguments."""
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument(
+            "--parents", type=int, default=3, help="Parents to give each user."
+        )
+        parser.add_argument("--apps", type=int, default=20)
+        parser.add_argument(
+            "--subscriptions",
+            type=int,
+            default=5,
+            help="Apps to subscribe each user to.",
+        )
+        parser.add_argument("--messages", type=int, default=100000)
+        parser.add_argument("--adverts", type=int, default=10000)
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--seed", type=int, default=0, help="Seed for the random number generator."
+        )
+        parser.add_argument(
+            "--clear",
+            action="store_true",
+            help="Delete any previously seeded data first.",
+        )
+
+    def handle(self, *args, **options):
+        """Seed the dataset."""
+        if options["clear"]:
+            self.stdout.write("Clearing previously seeded data...")
+            clear_data()
+
+        seed_data(
+            users=options["users"],
+            parents=options["parents"],
+            apps=options["apps"],
+            subscriptions=options["subscriptions"],
+            messages=options["messages"],
+            adverts=options["adverts"],
+            batch_size=options["batch_size"],
+            seed=options["seed"],
+            stdout=self.stdout,
+        )
+        self.stdout.write("Seeded the benchmark data.")
@@ -0,0 +1,47 @@
+"""Custom middleware."""
+
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise, able to run in an async middleware chain.
+
+    Django adapts everything beneath a sync-only middleware to run synchronously,
+    which under ASGI would put every request back into a single thread.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        """Switch to async mode if the rest of the chain is async."""
+        # pylint: disable=redefined-outer-name
+        super().__init__(get_response, settings)
+
+        if asyncio.iscoroutinefunction(self.get_response):
+            # pylint: disable=protected-access
+            # Mark ourselves as a coroutine function, the same way Django's
+            # MiddlewareMixin does.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        """Serve a static file or pass the request on."""
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        """Serve a static file or pass the request on, asynchronously."""
+        response = await sync_to_async(self.process_request, thread_sensitive=False)(
+            request
+        )
+        if response is None:
+            response = await self.get_response(request)
+
+        return response
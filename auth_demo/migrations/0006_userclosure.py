@@ -0,0 +1,66 @@
+# Generated by Django 3.2 on 2026-10-18 13:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_closure(apps, schema_editor):
+    """Seed the closure table with every direct parent link."""
+    User = apps.get_model("auth_demo", "User")
+    UserClosure = apps.get_model("auth_demo", "UserClosure")
+
+    UserClosure.objects.bulk_create(
+        UserClosure(descendant_id=child_id, ancestor_id=parent_id, depth=1)
+        for child_id, parent_id in User.parents.through.objects.values_list(
+            "from_user_id", "to_user_id"
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth_demo", "0005_rename_url_thirdpartyappactionpermission_url_name"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserClosure",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("depth", models.PositiveSmallIntegerField()),
+                (
+                    "ancestor",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "descendant",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="userclosure",
+            constraint=models.UniqueConstraint(
+                fields=("ancestor", "descendant"), name="unique_user_closure"
+            ),
+        ),
+        migrations.RunPython(populate_closure, migrations.RunPython.noop),
+    ]
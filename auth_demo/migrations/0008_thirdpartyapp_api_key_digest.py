@@ -0,0 +1,20 @@
+# Generated by Django 3.2 on 2026-10-18 14:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth_demo", "0007_user_id_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="thirdpartyapp",
+            name="api_key_digest",
+            field=models.CharField(
+                blank=True, editable=False, max_length=64, null=True, unique=True
+            ),
+        ),
+    ]
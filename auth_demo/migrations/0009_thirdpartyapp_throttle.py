@@ -0,0 +1,27 @@
+# Generated by Django 3.2 on 2026-10-18 14:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth_demo", "0008_thirdpartyapp_api_key_digest"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="thirdpartyapp",
+            name="throttle_burst",
+            field=models.PositiveIntegerField(
+                blank=True, help_text="Requests that can be made at once.", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="thirdpartyapp",
+            name="throttle_rate",
+            field=models.PositiveIntegerField(
+                blank=True, help_text="Requests per minute.", null=True
+            ),
+        ),
+    ]
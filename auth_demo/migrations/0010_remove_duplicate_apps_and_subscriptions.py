@@ -0,0 +1,48 @@
+# Generated by Django 3.2 on 2026-10-18 14:12
+
+from django.db import migrations
+from django.db.models import Min
+
+
+def _first_ids(model, fields):
+    """Return the lowest ID among the rows sharing each combination of `fields`."""
+    return list(
+        model.objects.values(*fields)
+        .annotate(first_id=Min("id"))
+        .values_list("first_id", flat=True)
+    )
+
+
+def remove_duplicates(apps, schema_editor):
+    """Make app names, permissions and subscriptions unique."""
+    ThirdPartyApp = apps.get_model("auth_demo", "ThirdPartyApp")
+    ThirdPartyAppActionPermission = apps.get_model(
+        "auth_demo", "ThirdPartyAppActionPermission"
+    )
+    Subscription = apps.get_model("auth_demo", "Subscription")
+
+    # Apps sharing a name may have different keys, permissions and subscribers, so
+    # rename them rather than merging them.
+    first_apps = _first_ids(ThirdPartyApp, ("app_name",))
+    for app in ThirdPartyApp.objects.exclude(id__in=first_apps):
+        app.app_name = f"{app.app_name[:180]} ({app.pk})"
+        app.save(update_fields=["app_name"])
+
+    # Duplicate permissions and subscriptions don't mean anything, just drop them.
+    ThirdPartyAppActionPermission.objects.exclude(
+        id__in=_first_ids(ThirdPartyAppActionPermission, ("app", "action", "url_name"))
+    ).delete()
+    Subscription.objects.exclude(
+        id__in=_first_ids(Subscription, ("user", "app"))
+    ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth_demo", "0009_thirdpartyapp_throttle"),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+    ]
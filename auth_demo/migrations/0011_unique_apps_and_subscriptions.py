@@ -0,0 +1,53 @@
+# Generated by Django 3.2 on 2026-10-18 14:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth_demo", "0010_remove_duplicate_apps_and_subscriptions"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="subscription",
+            name="user",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="subscriptions",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="thirdpartyapp",
+            name="app_name",
+            field=models.CharField(max_length=200, unique=True),
+        ),
+        migrations.AlterField(
+            model_name="thirdpartyappactionpermission",
+            name="app",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="allowed_actions",
+                to="auth_demo.thirdpartyapp",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="subscription",
+            constraint=models.UniqueConstraint(
+                fields=("user", "app"), name="unique_subscription"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="thirdpartyappactionpermission",
+            constraint=models.UniqueConstraint(
+                fields=("app", "action", "url_name"),
+                name="unique_app_action_permission",
+            ),
+        ),
+    ]
@@ -0,0 +1,117 @@
+# Generated by Django 3.2 on 2026-10-18 14:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_entitlements(apps, schema_editor):
+    """Grant the entitlements of every paid subscriber and member of staff."""
+    User = apps.get_model("auth_demo", "User")
+    Subscription = apps.get_model("auth_demo", "Subscription")
+    UserClosure = apps.get_model("auth_demo", "UserClosure")
+    AdvertEntitlement = apps.get_model("auth_demo", "AdvertEntitlement")
+    paid = User.objects.filter(paid_subscriber=True)
+
+    AdvertEntitlement.objects.bulk_create(
+        AdvertEntitlement(user_id=user_id)
+        for user_id in User.objects.filter(
+            models.Q(is_staff=True) | models.Q(paid_subscriber=True)
+        ).values_list("id", flat=True)
+    )
+    AdvertEntitlement.objects.bulk_create(
+        AdvertEntitlement(user_id=user_id, app_id=app_id)
+        for user_id, app_id in Subscription.objects.filter(user__in=paid).values_list(
+            "user_id", "app_id"
+        )
+    )
+    AdvertEntitlement.objects.bulk_create(
+        AdvertEntitlement(user_id=user_id, actor_id=actor_id)
+        for user_id, actor_id in UserClosure.objects.filter(
+            descendant__in=paid, depth__lte=settings.AUTH_DEMO_DELEGATION_DEPTH
+        ).values_list("descendant_id", "ancestor_id")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth_demo", "0011_unique_apps_and_subscriptions"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AdvertEntitlement",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "actor",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "app",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="auth_demo.thirdpartyapp",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="advertentitlement",
+            constraint=models.CheckConstraint(
+                check=models.Q(
+                    ("app__isnull", True), ("actor__isnull", True), _connector="OR"
+                ),
+                name="advert_entitlement_app_or_actor",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="advertentitlement",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("actor__isnull", True), ("app__isnull", True)),
+                fields=("user",),
+                name="unique_own_advert_entitlement",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="advertentitlement",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(app__isnull=False),
+                fields=("user", "app"),
+                name="unique_app_advert_entitlement",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="advertentitlement",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(actor__isnull=False),
+                fields=("user", "actor"),
+                name="unique_actor_advert_entitlement",
+            ),
+        ),
+        migrations.RunPython(populate_entitlements, migrations.RunPython.noop),
+    ]
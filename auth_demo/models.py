@@ -1,5 +1,8 @@
 """Auth app models."""
 
+import hashlib
+import secrets
+
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 
@@ -14,39 +17,170 @@ class User(AbstractUser):
 class Message(models.Model):
     """A message."""
 
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="messages")
+    # Indexed alongside `id` below, for paging through a user's messages.
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="messages", db_index=False
+    )
     message = models.CharField(max_length=200)
 
+    class Meta:
+        """Meta options."""
+
+        indexes = [
+            models.Index(fields=("user", "id"), name="message_user_id_idx"),
+        ]
+
 
 class Advertisement(models.Model):
     """An advertisement."""
 
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="adverts")
+    # Indexed alongside `id` below, for paging through a user's adverts.
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="adverts", db_index=False
+    )
     advertisement = models.CharField(max_length=200)
 
+    class Meta:
+        """Meta options."""
+
+        indexes = [
+            models.Index(fields=("user", "id"), name="advert_user_id_idx"),
+        ]
+
 
 class ThirdPartyApp(models.Model):
     """A third party app."""
 
-    app_name = models.CharField(max_length=200)
+    app_name = models.CharField(max_length=200, unique=True)
+    # Apps authenticate with an API key, only a digest of which is stored.
+    api_key_digest = models.CharField(
+        max_length=64, unique=True, null=True, blank=True, editable=False
+    )
+    # The app's rate limit, overriding `AUTH_DEMO_APP_THROTTLE_RATE` and
+    # `AUTH_DEMO_APP_THROTTLE_BURST` when set.
+    throttle_rate = models.PositiveIntegerField(
+        null=True, blank=True, help_text="Requests per minute."
+    )
+    throttle_burst = models.PositiveIntegerField(
+        null=True, blank=True, help_text="Requests that can be made at once."
+    )
+
+    @staticmethod
+    def digest_api_key(api_key):
+        """Return the digest stored for an API key."""
+        return hashlib.sha256(api_key.encode()).hexdigest()
+
+    def rotate_api_key(self):
+        """Give the app a new API key, replacing any old one, and return it."""
+        api_key = secrets.token_urlsafe(32)
+        self.api_key_digest = self.digest_api_key(api_key)
+        return api_key
 
 
 class ThirdPartyAppActionPermission(models.Model):
     """A permission for an endpoint that the third-party app can access."""
 
+    # Indexed by the unique constraint below, which starts with `app`.
     app = models.ForeignKey(
-        ThirdPartyApp, on_delete=models.CASCADE, related_name="allowed_actions"
+        ThirdPartyApp,
+        on_delete=models.CASCADE,
+        related_name="allowed_actions",
+        db_index=False,
     )
     action = models.CharField(max_length=200)
     url_name = models.CharField(max_length=200)
 
+    class Meta:
+        """Meta options."""
+
+        constraints = [
+            models.UniqueConstraint(
+                fields=("app", "action", "url_name"),
+                name="unique_app_action_permission",
+            ),
+        ]
+
 
 class Subscription(models.Model):
     """A user's subscription to an app."""
 
+    # Indexed by the unique constraint below, which starts with `user`.
     user = models.ForeignKey(
-        User, on_delete=models.CASCADE, related_name="subscriptions"
+        User, on_delete=models.CASCADE, related_name="subscriptions", db_index=False
     )
     app = models.ForeignKey(
         ThirdPartyApp, on_delete=models.CASCADE, related_name="subscriptions"
     )
+
+    class Meta:
+        """Meta options."""
+
+        constraints = [
+            models.UniqueConstraint(fields=("user", "app"), name="unique_subscription"),
+        ]
+
+
+class UserClosure(models.Model):
+    """
+    A link between a user and each user that can act on their behalf.
+
+    This is the transitive closure of `User.parents`, kept up to date by
+    `auth_demo.hierarchy`. `depth` is the number of parent links between the two.
+    """
+
+    ancestor = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    descendant = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    depth = models.PositiveSmallIntegerField()
+
+    class Meta:
+        """Meta options."""
+
+        constraints = [
+            models.UniqueConstraint(
+                fields=("ancestor", "descendant"), name="unique_user_closure"
+            ),
+        ]
+
+
+class AdvertEntitlement(models.Model):
+    """
+    Someone allowed to create adverts for a user.
+
+    With neither `app` nor `actor` set, the user can create their own adverts.
+    Otherwise the app the user is subscribed to, or the user that can act on their
+    behalf, can create adverts for them. Kept up to date by
+    `auth_demo.entitlements`.
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    app = models.ForeignKey(
+        ThirdPartyApp, on_delete=models.CASCADE, null=True, related_name="+"
+    )
+    actor = models.ForeignKey(
+        User, on_delete=models.CASCADE, null=True, related_name="+"
+    )
+
+    class Meta:
+        """Meta options."""
+
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(app__isnull=True) | models.Q(actor__isnull=True),
+                name="advert_entitlement_app_or_actor",
+            ),
+            models.UniqueConstraint(
+                fields=("user",),
+                condition=models.Q(app__isnull=True, actor__isnull=True),
+                name="unique_own_advert_entitlement",
+            ),
+            models.UniqueConstraint(
+                fields=("user", "app"),
+                condition=models.Q(app__isnull=False),
+                name="unique_app_advert_entitlement",
+            ),
+            models.UniqueConstraint(
+                fields=("user", "actor"),
+                condition=models.Q(actor__isnull=False),
+                name="unique_actor_advert_entitlement",
+            ),
+        ]
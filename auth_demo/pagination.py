@@ -0,0 +1,22 @@
+"""Custom DRF pagination classes."""
+
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    """
+    Keyset pagination ordered on the primary key, newest first.
+
+    Each page picks up from the last ID of the page before it, so fetching a deep
+    page costs the same as fetching the first. Clients can ask for smaller or
+    larger pages with `page_size`, up to `AUTH_DEMO_MAX_PAGE_SIZE`.
+    """
+
+    ordering = "-id"
+    page_size_query_param = "page_size"
+
+    def get_page_size(self, request):
+        """Return the requested page size, capped at the configured maximum."""
+        self.max_page_size = settings.AUTH_DEMO_MAX_PAGE_SIZE
+        return super().get_page_size(request)
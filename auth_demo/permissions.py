@@ -1,11 +1,20 @@
 """Custom DRF permission classes."""
 
-from django.contrib.auth import get_user_model
 from rest_framework import permissions
 
-from auth_demo.models import Subscription, ThirdPartyApp, ThirdPartyAppActionPermission
+from auth_demo.entitlements import can_create_adverts
+from auth_demo.hierarchy import get_delegation_depth, is_delegate
+from auth_demo.models import ThirdPartyApp
+from auth_demo.registry import app_registry
+from auth_demo.replicas import reading_from_replica
+from auth_demo.resolvers import resolve_user
+from auth_demo.subscribers import is_subscribed
 
-USER_MODEL = get_user_model()
+
+def _get_request_app(request):
+    """Return the third-party app making the request, or `None` if it's a user."""
+    # The authenticator has already checked the app's key and resolved it for us.
+    return request.auth if isinstance(request.auth, ThirdPartyApp) else None
 
 
 class AuthenticatedOrThirdPartyAppPermission(permissions.BasePermission):
@@ -15,88 +24,88 @@ class AuthenticatedOrThirdPartyAppPermission(permissions.BasePermission):
         """
         Check permissions.
 
-        If a `Referer` header is provided then check if it represents a valid
-        third-party app. If the `Referer` header is not provided then check if the
-        user is authenticated.
+        If a third-party app is making the request then check it's allowed to
+        perform the action. Otherwise check if the user is authenticated.
         """
-        if app := request.headers.get("X-External-App"):
-            try:
-                app = ThirdPartyApp.objects.get(app_name=app)
-            except ThirdPartyApp.DoesNotExist:
-                # A third-party app was provided but does not exist. Deny permission.
-                # NOTE: As this is implemented it can be abused for enumeration.
-                return False
-
-            return ThirdPartyAppActionPermission.objects.filter(
-                action=view.action, url_name=request.resolver_match.url_name
-            ).exists()
+        if (app := _get_request_app(request)) is not None:
+            return app_registry.allows(
+                app, view.action, request.resolver_match.url_name
+            )
 
         return request.user and request.user.is_authenticated
 
 
 def _check_user_in_parents(for_user, active_user):
     """Check if the authenticated user can act on behalf of given user."""
-    return active_user in for_user.parents.all()
+    if get_delegation_depth() == 1:
+        # The snapshot already has the user's parents.
+        return active_user.pk in for_user.parent_ids
 
+    return is_delegate(active_user, for_user)
 
-class HasCreatePermission(permissions.BasePermission):
-    """Check if a user or app has permission to create an object for the given user."""
+
+class TargetUserPermission(permissions.BasePermission):
+    """
+    Base class for permissions on the user an object is being created for.
+
+    Subclasses implement `has_user_permission`, which is also used by the bulk
+    create endpoint to check each distinct user in a batch. `for_user` is always a
+    `UserSnapshot`, and `request.user` is either a snapshot or a `User`, so only
+    the fields they share can be used.
+    """
 
     def has_permission(self, request, view):
-        """Check if a user has permission to create an object for the given user."""
+        """Look up the requested user and check permission to act for them."""
         if request.method in permissions.SAFE_METHODS:
             # We're only supposed to be checking creation or unsafe HTTP methods here.
             return True
 
-        requested_user = request.data.get("user")
-
-        try:
-            for_user = USER_MODEL.objects.get(username=requested_user)
-        except USER_MODEL.DoesNotExist:
-            # Choosing to return True here so that we progress to where
-            # validation fails.
+        if not isinstance(request.data, dict):
+            # A batch of objects, the view checks each of their users itself.
             return True
 
-        if app := request.headers.get("X-External-App"):
-            return Subscription.objects.filter(
-                app__app_name=app, user=for_user
-            ).exists()
+        with reading_from_replica(request):
+            if (for_user := resolve_user(request, request.data.get("user"))) is None:
+                # Choosing to return True here so that we progress to where
+                # validation fails.
+                return True
 
-        if request.user and request.user.username == requested_user:
-            return True
+            return self.has_user_permission(request, view, for_user)
 
-        return _check_user_in_parents(for_user, request.user)
+    def has_user_permission(self, request, view, for_user):
+        """Check if the request can create an object for `for_user`."""
+        raise NotImplementedError(".has_user_permission() must be overridden.")
 
 
-class RequiresPremiumSubscriptionPermission(permissions.BasePermission):
-    """Check if a user has a premium subscription."""
+class HasCreatePermission(TargetUserPermission):
+    """Check if a user or app has permission to create an object for the given user."""
 
-    def has_permission(self, request, view):
-        """Check if a user has a premium subscription or admins an account that does."""
-        if request.method in permissions.SAFE_METHODS:
-            # We're only supposed to be checking creation or unsafe HTTP methods here.
+    def has_user_permission(self, request, view, for_user):
+        """Check if a user has permission to create an object for the given user."""
+        if (app := _get_request_app(request)) is not None:
+            return is_subscribed(request, for_user, app)
+
+        if request.user and request.user.username == for_user.username:
             return True
 
-        requested_user = request.data.get("user")
+        return _check_user_in_parents(for_user, request.user)
 
-        try:
-            for_user = USER_MODEL.objects.get(username=requested_user)
-        except USER_MODEL.DoesNotExist:
-            # Choosing to return True here so that we progress to where
-            # validation fails.
-            return True
 
-        if app := request.headers.get("X-External-App"):
-            return (
-                for_user.paid_subscriber
-                and Subscription.objects.filter(
-                    app__app_name=app, user=for_user
-                ).exists()
-            )
+class RequiresPremiumSubscriptionPermission(TargetUserPermission):
+    """
+    Check if a user has a premium subscription.
 
-        if requested_user != request.user.username:
-            return for_user.paid_subscriber and _check_user_in_parents(
-                for_user, request.user
-            )
+    Whether the user is a paid subscriber, and subscribed to the app or a delegate
+    of the user making the request, is all precomputed as their advert
+    entitlements (see `auth_demo.entitlements`).
+    """
+
+    def has_user_permission(self, request, view, for_user):
+        """Check if a user has a premium subscription or admins an account that does."""
+        if (app := _get_request_app(request)) is not None:
+            return can_create_adverts(for_user, app=app)
+
+        if for_user.username != request.user.username:
+            return can_create_adverts(for_user, actor=request.user)
 
-        return request.user.is_staff or request.user.paid_subscriber
+        return can_create_adverts(for_user)
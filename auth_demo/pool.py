@@ -0,0 +1,190 @@
+"""
+A pool of database connections shared between a process's threads, or greenlets.
+
+Django keeps a connection per thread, and under gunicorn's gevent workers every
+request runs in a greenlet of its own, which gevent makes look like a thread. So
+each request would open and close a connection of its own, and a busy worker can
+have as many connections open as it has requests in flight. With a pool, a
+worker never has more than `size + max_overflow` connections open. Requests beyond
+that wait up to `timeout` seconds for a connection to come free.
+
+The pool only relies on `threading`, which gevent patches to switch greenlets
+while waiting, so it works the same way with and without gevent.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+
+from django.db.utils import OperationalError
+
+
+def ping(connection):
+    """Check a connection still works with a trivial query."""
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT 1")
+        cursor.fetchone()
+    finally:
+        cursor.close()
+
+
+class ConnectionPool:
+    """
+    A pool of connections opened by `connect`.
+
+    Up to `size` idle connections are kept for reuse, most recently used first,
+    and up to `max_overflow` more can be opened when they're all in use. Those are
+    closed when they're returned. Connections older than `recycle` seconds are
+    closed rather than reused, and ones that have been idle for longer than
+    `ping_after` seconds are checked with `ping` before being handed out.
+    """
+
+    def __init__(
+        self,
+        connect,
+        *,
+        size=10,
+        max_overflow=10,
+        timeout=30,
+        recycle=3600,
+        ping_after=30,
+    ):  # pylint: disable=too-many-arguments
+        """Create an empty pool."""
+        self.connect = connect
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+
+        self.slots = threading.BoundedSemaphore(size + max_overflow)
+        self.lock = threading.Lock()
+        # Idle connections, with when they were opened and when they were returned.
+        self.idle = deque()
+        # When each checked out connection was opened, by `id()`.
+        self.checked_out = {}
+        self.opened = 0
+        self.timeouts = 0
+
+    def _open(self):
+        """Open a new connection."""
+        connection = self.connect()
+        with self.lock:
+            self.checked_out[id(connection)] = time.monotonic()
+            self.opened += 1
+
+        return connection
+
+    @staticmethod
+    def _close(connection):
+        """Close a connection, ignoring any errors."""
+        try:
+            connection.close()
+        except Exception:  # pylint: disable=broad-except
+            pass
+
+    def checkout(self):
+        """Take a connection from the pool, opening one if there aren't any idle."""
+        # Released in `checkin`, once the connection's been returned.
+        # pylint: disable-next=consider-using-with
+        if not self.slots.acquire(timeout=self.timeout):
+            with self.lock:
+                self.timeouts += 1
+            raise OperationalError(
+                f"Timed out after {self.timeout}s waiting for a database connection."
+            )
+
+        try:
+            while True:
+                with self.lock:
+                    if not self.idle:
+                        break
+                    connection, opened, returned = self.idle.pop()
+
+                if time.monotonic() - opened >= self.recycle:
+                    self._close(connection)
+                    continue
+
+                if time.monotonic() - returned >= self.ping_after:
+                    try:
+                        ping(connection)
+                    except Exception:  # pylint: disable=broad-except
+                        self._close(connection)
+                        continue
+
+                with self.lock:
+                    self.checked_out[id(connection)] = opened
+                return connection
+
+            return self._open()
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def checkin(self, connection, reusable=True):
+        """Return a connection to the pool, closing it if it shouldn't be reused."""
+        try:
+            with self.lock:
+                opened = self.checked_out.pop(id(connection))
+                keep = (
+                    reusable
+                    and len(self.idle) < self.size
+                    and time.monotonic() - opened < self.recycle
+                )
+                if keep:
+                    self.idle.append((connection, opened, time.monotonic()))
+
+            if not keep:
+                self._close(connection)
+        finally:
+            self.slots.release()
+
+    def close(self):
+        """Close every idle connection."""
+        with self.lock:
+            idle, self.idle = self.idle, deque()
+
+        for connection, _, _ in idle:
+            self._close(connection)
+
+    def get_stats(self):
+        """Return the number of connections open, in use and idle."""
+        with self.lock:
+            return {
+                "size": self.size,
+                "max_overflow": self.max_overflow,
+                "in_use": len(self.checked_out),
+                "idle": len(self.idle),
+                "opened": self.opened,
+                "timeouts": self.timeouts,
+            }
+
+
+# A pool for each database, in each process.
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, create):
+    """Return this process's pool for a database, calling `create` to make one."""
+    # Connections can't be shared with a forked process, so it gets its own.
+    key = (alias, os.getpid())
+
+    with _pools_lock:
+        if (pool := _pools.get(key)) is None:
+            pool = _pools[key] = create()
+
+    return pool
+
+
+def get_stats():
+    """Return the stats for each of this process's pools, by database alias."""
+    pid = os.getpid()
+    with _pools_lock:
+        pools = {
+            alias: pool for (alias, pool_pid), pool in _pools.items() if pool_pid == pid
+        }
+
+    return {alias: pool.get_stats() for alias, pool in pools.items()}
@@ -0,0 +1,109 @@
+"""
+Django's PostgreSQL backend, with connections checked out from a pool.
+
+Configure it with `ENGINE = "auth_demo.postgresql_pool"` and a `POOL` dictionary
+alongside the rest of the database's settings, taking `SIZE`, `MAX_OVERFLOW`,
+`TIMEOUT`, `RECYCLE` and `PING_AFTER` (see `auth_demo.pool.ConnectionPool`).
+`CONN_MAX_AGE` should be left at 0, so connections go back to the pool at the
+end of every request rather than being held by threads that may never serve
+another one.
+
+Under gevent, psycopg2 is also told to wait for the server by yielding to other
+greenlets, rather than blocking the whole worker.
+"""
+
+import functools
+import weakref
+
+import psycopg2
+from django.db.backends.postgresql import base
+from psycopg2 import extensions
+
+from auth_demo.pool import ConnectionPool, get_pool
+
+
+def _gevent_wait_callback(connection):
+    """Wait for psycopg2's asynchronous connection, letting other greenlets run."""
+    # pylint: disable-next=import-outside-toplevel
+    from gevent.socket import wait_read, wait_write
+
+    while True:
+        state = connection.poll()
+        if state == extensions.POLL_OK:
+            break
+        if state == extensions.POLL_READ:
+            wait_read(connection.fileno())
+        elif state == extensions.POLL_WRITE:
+            wait_write(connection.fileno())
+        else:
+            raise psycopg2.OperationalError(f"Bad result from poll: {state!r}")
+
+
+def _make_green():
+    """Have psycopg2 cooperate with gevent, if gevent has patched the process."""
+    try:
+        # pylint: disable-next=import-outside-toplevel
+        from gevent import monkey
+    except ImportError:
+        return
+
+    if monkey.is_module_patched("socket"):
+        extensions.set_wait_callback(_gevent_wait_callback)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """A PostgreSQL connection that's borrowed from, and returned to, a pool."""
+
+    def create_pool(self, conn_params):
+        """Create the pool for this database."""
+        _make_green()
+        options = self.settings_dict.get("POOL", {})
+        return ConnectionPool(
+            functools.partial(super().get_new_connection, conn_params),
+            size=options.get("SIZE", 10),
+            max_overflow=options.get("MAX_OVERFLOW", 10),
+            timeout=options.get("TIMEOUT", 30),
+            recycle=options.get("RECYCLE", 3600),
+            ping_after=options.get("PING_AFTER", 30),
+        )
+
+    def get_new_connection(self, conn_params):
+        """Check a connection out of the pool."""
+        self._pool = get_pool(
+            self.alias, functools.partial(self.create_pool, conn_params)
+        )
+        connection = self._pool.checkout()
+        # If this wrapper goes away without closing the connection, say with the
+        # greenlet it belonged to, don't keep the pool's slot forever.
+        self._pool_finalizer = weakref.finalize(
+            self, self._pool.checkin, connection, False
+        )
+        return connection
+
+    def _close(self):
+        """Return the connection to the pool, rather than closing it."""
+        if self.connection is None:
+            return
+
+        self._pool_finalizer.detach()
+        with self.wrap_database_errors:
+            self._pool.checkin(self.connection, self._reset_connection())
+
+    def _reset_connection(self):
+        """Roll back anything left open on the connection, and check it's reusable."""
+        if self.connection.closed:
+            return False
+
+        status = self.connection.get_transaction_status()
+        if status == extensions.TRANSACTION_STATUS_IDLE:
+            return True
+
+        if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+
+        try:
+            self.connection.rollback()
+        except psycopg2.Error:
+            return False
+
+        return True
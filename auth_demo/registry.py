@@ -0,0 +1,97 @@
+"""Process-local registry of third-party apps."""
+
+import hmac
+
+from django.core.cache import cache
+
+from auth_demo.models import ThirdPartyApp, ThirdPartyAppActionPermission
+from auth_demo.versioning import bump_version, get_version
+
+REGISTRY_VERSION = "third-party-apps"
+
+
+class ThirdPartyAppRegistry:
+    """
+    An in-memory index of third-party apps, by `app_name` and by API key digest.
+
+    Alongside the apps, each app's allowed actions are precompiled into a frozenset
+    of `(action, url_name)` pairs so permission checks don't need to touch the
+    database.
+
+    The index is tied to a version stamp held in Django's cache. Changing an app
+    or one of its permissions bumps the stamp (see `auth_demo.signals`), and every
+    worker rebuilds its copy the next time it's used.
+    """
+
+    def __init__(self):
+        """Start with an empty registry."""
+        self._version = None
+        self._apps = {}
+        self._apps_by_key = {}
+        self._permissions = {}
+
+    @staticmethod
+    def _build():
+        """Load every app and its allowed actions from the database."""
+        apps = {app.app_name: app for app in ThirdPartyApp.objects.all()}
+        apps_by_key = {
+            app.api_key_digest: app for app in apps.values() if app.api_key_digest
+        }
+
+        permissions = {}
+        rows = ThirdPartyAppActionPermission.objects.values_list(
+            "app_id", "action", "url_name"
+        )
+        for app_id, action, url_name in rows:
+            permissions.setdefault(app_id, set()).add((action, url_name))
+
+        permissions = {
+            app_id: frozenset(pairs) for app_id, pairs in permissions.items()
+        }
+        return apps, apps_by_key, permissions
+
+    def _refresh(self):
+        """Rebuild the index if another process (or this one) has invalidated it."""
+        if (version := get_version(REGISTRY_VERSION)) == self._version:
+            return
+
+        # Share the built index between workers so only one of them has to load it.
+        key = f"auth_demo:third-party-apps:{version.token}"
+        if (index := cache.get(key)) is None:
+            index = self._build()
+            cache.set(key, index)
+
+        self._apps, self._apps_by_key, self._permissions = index
+        self._version = version
+
+    def get(self, app_name):
+        """Return the app registered under `app_name`, or `None`."""
+        self._refresh()
+        return self._apps.get(app_name)
+
+    def get_by_key(self, api_key):
+        """Return the app with the given API key, or `None`."""
+        self._refresh()
+        digest = ThirdPartyApp.digest_api_key(api_key)
+
+        # The dictionary lookup is on the digest, which tells an attacker nothing
+        # about the key. Compare the digests in constant time all the same.
+        if (app := self._apps_by_key.get(digest)) is not None and hmac.compare_digest(
+            app.api_key_digest, digest
+        ):
+            return app
+
+        return None
+
+    def allows(self, app, action, url_name):
+        """Check if `app` may perform `action` on the URL named `url_name`."""
+        self._refresh()
+        return (action, url_name) in self._permissions.get(app.pk, frozenset())
+
+    @staticmethod
+    def clear():
+        """Invalidate the registry in every process."""
+        bump_version(REGISTRY_VERSION)
+
+
+app_registry = ThirdPartyAppRegistry()
@@ -0,0 +1,42 @@
+"""Custom DRF renderers."""
+
+import orjson
+from rest_framework import renderers
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """
+    DRF's JSON renderer, encoding with orjson.
+
+    With DRF's default settings, orjson writes the same compact, unescaped UTF-8 as
+    the standard renderer, several times faster. Only floats in exponent notation
+    are spelt differently (`1e-5` rather than `1e-05`). Anything orjson can't
+    encode the same way, such as indented output or integers too big for 64 bits,
+    goes through the standard renderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Render `data` into JSON, returning a bytestring."""
+        if (
+            data is None
+            or self.ensure_ascii
+            or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            # Leave dates and times to DRF's encoder, which formats them its own way.
+            ret = orjson.dumps(
+                data,
+                default=self.encoder_class().default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME
+                | orjson.OPT_PASSTHROUGH_DATACLASS,
+            )
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Escape the same characters as DRF, so the output is valid JavaScript too.
+        return ret.replace("\u2028".encode(), b"\\u2028").replace(
+            "\u2029".encode(), b"\\u2029"
+        )
@@ -0,0 +1,110 @@
+"""
+Routing of read-heavy queries to read replicas.
+
+Queries only go to a replica inside `reading_from_replica`, which the list and
+export endpoints and the permission lookups enter. Everything else, including
+every write, stays on the primary. A caller that has just written something is
+pinned to the primary for `AUTH_DEMO_REPLICA_PIN_SECONDS`, so they read their
+own writes, however far behind the replicas are.
+"""
+
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from auth_demo.models import ThirdPartyApp
+
+KEY_PREFIX = "auth_demo:replica-pin:"
+
+# The replica the current request is reading from, if any.
+_replica = ContextVar("auth_demo_replica", default=None)
+
+
+def _get_caller(request):
+    """Return a key for the app or user making the request, or `None`."""
+    if isinstance(request.auth, ThirdPartyApp):
+        return f"app:{request.auth.pk}"
+
+    if request.user and request.user.is_authenticated:
+        return f"user:{request.user.pk}"
+
+    return None
+
+
+def pin(request):
+    """Keep the request's caller on the primary for a while."""
+    if settings.AUTH_DEMO_REPLICA_DATABASES and (caller := _get_caller(request)):
+        cache.set(KEY_PREFIX + caller, True, settings.AUTH_DEMO_REPLICA_PIN_SECONDS)
+        getattr(request, "_request", request).replica_pinned = True
+
+
+def is_pinned(request):
+    """Check if the request's caller has written something recently."""
+    http_request = getattr(request, "_request", request)
+
+    if not hasattr(http_request, "replica_pinned"):
+        caller = _get_caller(request)
+        http_request.replica_pinned = caller is not None and bool(
+            cache.get(KEY_PREFIX + caller)
+        )
+
+    return http_request.replica_pinned
+
+
+def is_recent(version):
+    """Check if a version was bumped too recently to trust the replicas with it."""
+    return time.time() - version.modified < settings.AUTH_DEMO_REPLICA_PIN_SECONDS
+
+
+@contextmanager
+def reading_from_replica(request):
+    """
+    Send the reads in the block to a replica, where it's safe to.
+
+    Reads stay on the primary if there aren't any replicas, if the caller is
+    pinned to it, or if we're in a transaction, which might have written
+    something the replicas can't see.
+    """
+    if (
+        not (replicas := settings.AUTH_DEMO_REPLICA_DATABASES)
+        or _replica.get() is not None
+        or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        or is_pinned(request)
+    ):
+        yield
+        return
+
+    token = _replica.set(random.choice(replicas))
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+class ReplicaRouter:
+    """A database router sending reads to a replica inside `reading_from_replica`."""
+
+    @staticmethod
+    def db_for_read(_model, **_hints):
+        """Read from the current replica, or leave it to the primary."""
+        return _replica.get()
+
+    @staticmethod
+    def db_for_write(_model, **_hints):
+        """Always write to the primary."""
+        return DEFAULT_DB_ALIAS
+
+    @staticmethod
+    def allow_relation(_obj1, _obj2, **_hints):
+        """Allow relations between objects read from any of the databases."""
+        return True
+
+    @staticmethod
+    def allow_migrate(db, _app_label, **_hints):
+        """Only migrate the primary, the replicas follow it."""
+        return db not in settings.AUTH_DEMO_REPLICA_DATABASES
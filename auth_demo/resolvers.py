@@ -0,0 +1,51 @@
+"""Request-scoped lookups of the users a request refers to."""
+
+from auth_demo.snapshots import load_snapshots_by_username
+
+
+def _resolved_users(request):
+    """Return the users already resolved for this request, keyed by username."""
+    # Keep them on the Django request so the DRF request and anything else wrapping
+    # it share the same users.
+    http_request = getattr(request, "_request", request)
+
+    if not hasattr(http_request, "resolved_users"):
+        http_request.resolved_users = {}
+
+    return http_request.resolved_users
+
+
+def normalise_username(value):
+    """
+    Return a username as the serialisers' `CharField` would read it, or `None`.
+
+    Permissions have to look up the same user that validation will, so a number
+    sent as a username is looked up as a string rather than skipped.
+    """
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        return None
+
+    return str(value).strip()
+
+
+def resolve_users(request, usernames):
+    """
+    Return snapshots of the users with the given usernames, keyed by username.
+
+    Any users that haven't been resolved for this request yet are loaded in a single
+    query. Usernames that don't exist are left out.
+    """
+    resolved = _resolved_users(request)
+    usernames = {normalise_username(name) for name in usernames} - {None}
+
+    if missing := usernames - resolved.keys():
+        # Remember the users that don't exist too, so we don't look for them again.
+        resolved.update(dict.fromkeys(missing))
+        resolved.update(load_snapshots_by_username(missing))
+
+    return {name: resolved[name] for name in usernames if resolved[name] is not None}
+
+
+def resolve_user(request, username):
+    """Return a snapshot of the user with the given username, or `None`."""
+    return resolve_users(request, [username]).get(normalise_username(username))
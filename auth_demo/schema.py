@@ -0,0 +1,37 @@
+"""OpenAPI schema extensions for the auth app."""
+
+from drf_spectacular import openapi
+from drf_spectacular.contrib.rest_framework_simplejwt import SimpleJWTScheme
+
+from auth_demo.authentication import DispatchingAuthentication
+
+
+class CachedJWTScheme(SimpleJWTScheme):
+    """Describe `CachedJWTAuthentication` the same way as simplejwt's own class."""
+
+    target_class = "auth_demo.authentication.CachedJWTAuthentication"
+
+
+class AutoSchema(openapi.AutoSchema):
+    """A schema that documents each backend a dispatching authenticator can use."""
+
+    def get_auth(self):
+        """Work out the endpoint's security from the underlying backends."""
+        view = self.view
+        get_authenticators = view.get_authenticators
+
+        def get_backends():
+            backends = []
+            for authenticator in get_authenticators():
+                if isinstance(authenticator, DispatchingAuthentication):
+                    backends.extend(authenticator.backends.values())
+                else:
+                    backends.append(authenticator)
+
+            return backends
+
+        view.get_authenticators = get_backends
+        try:
+            return super().get_auth()
+        finally:
+            del view.get_authenticators
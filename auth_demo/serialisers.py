@@ -2,7 +2,31 @@
 
 from rest_framework import serializers
 
+from auth_demo.instrumentation import measure
 from auth_demo.models import Advertisement, Message, User
+from auth_demo.resolvers import resolve_user
+
+
+class InstrumentedSerialiserMixin:
+    """Mixin to time validation and serialisation as part of a sampled request."""
+
+    def is_valid(self, raise_exception=False):
+        """Validate the data."""
+        with measure(self.context.get("request"), "serialisation"):
+            return super().is_valid(raise_exception=raise_exception)
+
+    @property
+    def data(self):
+        """Serialise the instance."""
+        with measure(self.context.get("request"), "serialisation"):
+            return super().data
+
+
+# pylint: disable-next=abstract-method
+class InstrumentedListSerialiser(
+    InstrumentedSerialiserMixin, serializers.ListSerializer
+):
+    """A list serialiser that times itself as part of a sampled request."""
 
 
 class UserSerialiser(serializers.ModelSerializer):
@@ -15,25 +39,76 @@ class UserSerialiser(serializers.ModelSerializer):
         fields = ("id", "username", "email")
 
 
+class UserField(serializers.CharField):
+    """A user, given by username in a request and nested in full in a response."""
+
+    def __init__(self, **kwargs):
+        """Build the nested representation once, rather than for every object."""
+        super().__init__(**kwargs)
+        self.representation = UserSerialiser()
+
+    def to_representation(self, value):
+        """Represent the user with the nested serialiser."""
+        return self.representation.to_representation(value)
+
+
 class UserRepresentationMixin(metaclass=serializers.SerializerMetaclass):
     """Mixin to reduce duplicated code modifying the user field on request/response."""
 
-    user = serializers.CharField()
-
-    def to_representation(self, instance):
-        """Change the representation of the user in a response."""
-        self.fields["user"] = UserSerialiser()
-        return super().to_representation(instance)
+    user = UserField()
+
+    # The nested user's fields, and the columns `.values()` reads them from.
+    user_values = {
+        field: "user_id" if field == "id" else f"user__{field}"
+        for field in UserSerialiser.Meta.fields
+    }
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """Load each object's user in the same query as the object."""
+        return queryset.select_related("user")
+
+    @classmethod
+    def get_values_fields(cls):
+        """Return the columns `represent_values` needs from `.values()`."""
+        return (
+            *(field for field in cls.Meta.fields if field != "user"),
+            *cls.user_values.values(),
+        )
+
+    @classmethod
+    def represent_values(cls, row):
+        """
+        Represent an object from its `.values()` row, for a read-only list.
+
+        This builds the same output as `to_representation`, for a fraction of the
+        cost, as every field besides the user is a plain column.
+        """
+        return {
+            field: {name: row[column] for name, column in cls.user_values.items()}
+            if field == "user"
+            else row[field]
+            for field in cls.Meta.fields
+        }
 
     def validate_user(self, value):
         """Validate the user."""
-        try:
-            return User.objects.get(username=value)
-        except User.DoesNotExist:
-            raise serializers.ValidationError("User does not exist.") from None
+        if request := self.context.get("request"):
+            # Share the user the permission checks have already looked up.
+            if (user := resolve_user(request, value)) is not None:
+                user = user.to_user()
+        else:
+            user = User.objects.filter(username=value).first()
+
+        if user is None:
+            raise serializers.ValidationError("User does not exist.")
+
+        return user
 
 
-class MessageSerialiser(UserRepresentationMixin, serializers.ModelSerializer):
+class MessageSerialiser(
+    InstrumentedSerialiserMixin, UserRepresentationMixin, serializers.ModelSerializer
+):
     """A serialiser for a message."""
 
     class Meta:
@@ -41,9 +116,12 @@ class MessageSerialiser(UserRepresentationMixin, serializers.ModelSerializer):
 
         model = Message
         fields = ("id", "user", "message")
+        list_serializer_class = InstrumentedListSerialiser
 
 
-class AdvertisementSerialiser(UserRepresentationMixin, serializers.ModelSerializer):
+class AdvertisementSerialiser(
+    InstrumentedSerialiserMixin, UserRepresentationMixin, serializers.ModelSerializer
+):
     """A serialiser for an advertisement."""
 
     class Meta:
@@ -51,3 +129,4 @@ class AdvertisementSerialiser(UserRepresentationMixin, serializers.ModelSerializ
 
         model = Advertisement
         fields = ("id", "user", "advertisement")
+        list_serializer_class = InstrumentedListSerialiser
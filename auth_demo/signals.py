@@ -0,0 +1,194 @@
+"""Signal receivers keeping the auth app's caches in sync."""
+
+# The closure and entitlement receivers stash state on the instance between pre and
+# post signals, which the snapshot receivers use too.
+# pylint: disable=protected-access
+
+
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+
+from auth_demo.entitlements import update_entitlements
+from auth_demo.hierarchy import ParentLink, update_closure
+from auth_demo.models import (
+    Advertisement,
+    Message,
+    Subscription,
+    ThirdPartyApp,
+    ThirdPartyAppActionPermission,
+    User,
+)
+from auth_demo.registry import app_registry
+from auth_demo.serialisers import UserSerialiser
+from auth_demo.snapshots import user_version_name
+from auth_demo.subscribers import subscriber_index
+from auth_demo.versioning import bump_table_versions, bump_version
+
+
+@receiver(post_save, sender=ThirdPartyApp)
+@receiver(post_delete, sender=ThirdPartyApp)
+@receiver(post_save, sender=ThirdPartyAppActionPermission)
+@receiver(post_delete, sender=ThirdPartyAppActionPermission)
+def invalidate_app_registry(**_kwargs):
+    """Invalidate the app registry when an app or one of its permissions changes."""
+    app_registry.clear()
+    # Invalidate again once the change is visible to other connections, in case
+    # another worker rebuilt the registry before the transaction committed.
+    transaction.on_commit(app_registry.clear)
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def update_subscriber_index(signal, instance, created=True, **_kwargs):
+    """Keep the subscriber index in sync with changes to subscriptions."""
+    if created:
+        user_id = instance.user_id
+    else:
+        # An existing subscription may have moved to another user, or app, so
+        # reload everything.
+        user_id = None
+        transaction.on_commit(subscriber_index.clear)
+
+    # Only apply the change once it's committed, so a rollback can't leave a
+    # subscription that doesn't exist in the index.
+    subscriber_index.changing(instance.app_id, user_id, signal is post_save)
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+@receiver(post_save, sender=Advertisement)
+@receiver(post_delete, sender=Advertisement)
+def bump_list_versions(sender, instance, **_kwargs):
+    """Bump the versions the list endpoints' ETags are built from."""
+
+    def bump():
+        bump_table_versions(sender, [instance.user_id])
+
+    bump()
+    # Bump again on commit, so a list read before then isn't taken as current.
+    transaction.on_commit(bump)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def bump_user_list_versions(instance, update_fields=None, **_kwargs):
+    """Bump the list versions of a user's rows, which include their details."""
+    if update_fields is not None and not set(UserSerialiser.Meta.fields) & set(
+        update_fields
+    ):
+        return
+
+    def bump():
+        for model in (Message, Advertisement):
+            bump_table_versions(model, [instance.pk])
+
+    bump()
+    transaction.on_commit(bump)
+
+
+def _bump_user_versions(user_ids):
+    """Invalidate anything cached about the given users, now and on commit."""
+
+    def bump():
+        for user_id in user_ids:
+            bump_version(user_version_name(user_id))
+
+    bump()
+    transaction.on_commit(bump)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def bump_user_version(instance, **_kwargs):
+    """Invalidate anything cached about a user, like their verified tokens."""
+    _bump_user_versions([instance.pk])
+
+
+def _update_entitlements(user_ids):
+    """Recalculate the given users' entitlements, and invalidate their caches."""
+    update_entitlements(user_ids)
+    _bump_user_versions(user_ids)
+
+
+@receiver(post_save, sender=User)
+def update_user_entitlements(instance, update_fields=None, **_kwargs):
+    """Recalculate a user's entitlements when they might have changed."""
+    # Logging in only updates `last_login`, for instance.
+    if update_fields is None or {"is_staff", "paid_subscriber"} & set(update_fields):
+        _update_entitlements([instance.pk])
+
+
+@receiver(pre_save, sender=Subscription)
+def remember_subscription_user(instance, **_kwargs):
+    """Note who an existing subscription belonged to, before it's changed."""
+    instance._entitlement_user_ids = set()
+    if instance.pk is not None:
+        instance._entitlement_user_ids.update(
+            Subscription.objects.filter(pk=instance.pk).values_list(
+                "user_id", flat=True
+            )
+        )
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def update_subscription_entitlements(instance, **_kwargs):
+    """Recalculate the entitlements of a subscription's user, and any old one."""
+    user_ids = getattr(instance, "_entitlement_user_ids", set())
+    _update_entitlements(user_ids | {instance.user_id})
+
+
+def _linked_user_ids(user):
+    """Return the IDs of every user directly linked to the given user."""
+    links = ParentLink.objects.filter(Q(from_user=user) | Q(to_user=user))
+    return {
+        user_id
+        for link in links.values_list("from_user_id", "to_user_id")
+        for user_id in link
+    }
+
+
+@receiver(m2m_changed, sender=ParentLink)
+def update_closure_for_parents(instance, action, pk_set, **_kwargs):
+    """Keep the user closure table in sync with changes to `User.parents`."""
+    if action == "pre_clear":
+        # The links are gone by the time we hear about `post_clear`.
+        instance._closure_linked_user_ids = _linked_user_ids(instance)
+    elif action == "post_clear":
+        _update_entitlements(
+            update_closure(instance._closure_linked_user_ids | {instance.pk})
+        )
+    elif action in ("post_add", "post_remove") and pk_set:
+        _update_entitlements(update_closure(pk_set | {instance.pk}))
+
+
+@receiver(m2m_changed, sender=ParentLink)
+def bump_linked_user_versions(instance, action, pk_set, **_kwargs):
+    """Invalidate the snapshots of users whose parents have changed."""
+    # Links go both ways, so both ends have new parents.
+    if action == "post_clear":
+        _bump_user_versions(instance._closure_linked_user_ids | {instance.pk})
+    elif action in ("post_add", "post_remove") and pk_set:
+        _bump_user_versions(pk_set | {instance.pk})
+
+
+@receiver(pre_delete, sender=User)
+def remember_linked_users(instance, **_kwargs):
+    """Note who a user is linked to before the links are deleted with them."""
+    instance._closure_linked_user_ids = _linked_user_ids(instance)
+
+
+@receiver(post_delete, sender=User)
+def update_closure_for_deleted_user(instance, **_kwargs):
+    """Rebuild the closure around a user once they've been deleted."""
+    if linked_user_ids := instance._closure_linked_user_ids - {instance.pk}:
+        _update_entitlements(update_closure(linked_user_ids))
+        _bump_user_versions(linked_user_ids)
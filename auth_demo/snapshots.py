@@ -0,0 +1,80 @@
+"""Compact, cacheable snapshots of users."""
+
+from collections import namedtuple
+
+from auth_demo.models import User
+
+# The user columns a snapshot is built from, in order.
+SNAPSHOT_FIELDS = (
+    "id",
+    "username",
+    "email",
+    "is_active",
+    "is_staff",
+    "paid_subscriber",
+)
+
+
+class UserSnapshot(namedtuple("UserSnapshot", (*SNAPSHOT_FIELDS, "parent_ids"))):
+    """
+    The parts of a user that authentication and permission checks need.
+
+    Snapshots are immutable and cheap to pickle, so they can be cached, and they
+    stand in for the user as `request.user`. `parent_ids` holds the IDs of the
+    user's direct parents, in order.
+    """
+
+    __slots__ = ()
+
+    is_authenticated = True
+    is_anonymous = False
+
+    @property
+    def pk(self):
+        """Return the user's primary key."""
+        return self.id
+
+    def __str__(self):
+        """Return the username."""
+        return self.username
+
+    def to_user(self):
+        """Return a `User` with the snapshot's fields, to point foreign keys at."""
+        user = User(**{field: getattr(self, field) for field in SNAPSHOT_FIELDS})
+        user._state.adding = False  # pylint: disable=protected-access
+        return user
+
+
+def user_version_name(user_id):
+    """Return the name of the version bumped whenever the given user changes."""
+    return f"user:{user_id}"
+
+
+def _load_snapshots(queryset):
+    """Load snapshots of the users in a queryset, parents and all, in one query."""
+    users = {}
+    parent_ids = {}
+    # One row for each of a user's parents, or a single row if they haven't got any.
+    for *fields, parent_id in queryset.values_list(*SNAPSHOT_FIELDS, "parents"):
+        users.setdefault(fields[0], fields)
+        if parent_id is not None:
+            parent_ids.setdefault(fields[0], []).append(parent_id)
+
+    return [
+        UserSnapshot(*fields, tuple(sorted(parent_ids.get(user_id, ()))))
+        for user_id, fields in users.items()
+    ]
+
+
+def load_snapshot(user_id):
+    """Load a snapshot of an active user, or return `None` if there isn't one."""
+    snapshots = _load_snapshots(User.objects.filter(pk=user_id, is_active=True))
+    return snapshots[0] if snapshots else None
+
+
+def load_snapshots_by_username(usernames):
+    """Load snapshots of the users with the given usernames, keyed by username."""
+    return {
+        snapshot.username: snapshot
+        for snapshot in _load_snapshots(User.objects.filter(username__in=usernames))
+    }
@@ -0,0 +1,58 @@
+"""
+The OpenAPI schema, pre-generated as a static file.
+
+Generating the schema introspects every view, which is too slow to do on every
+visit to the Swagger UI. `./manage.py generate_schema` writes it into the static
+files on deploy instead, so whitenoise can serve it compressed and with an ETag.
+The UI only falls back to the dynamic schema view when it hasn't been generated.
+"""
+
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from drf_spectacular.renderers import OpenApiYamlRenderer
+from drf_spectacular.settings import spectacular_settings
+from drf_spectacular.utils import extend_schema
+from drf_spectacular.views import SpectacularSwaggerView
+from whitenoise.compress import Compressor
+
+
+def generate_schema():
+    """Generate the schema, as the schema view serves it by default."""
+    generator = spectacular_settings.DEFAULT_GENERATOR_CLASS()
+    schema = generator.get_schema(
+        request=None, public=spectacular_settings.SERVE_PUBLIC
+    )
+    return OpenApiYamlRenderer().render(schema, renderer_context={})
+
+
+def write_schema():
+    """Write the schema into `STATIC_ROOT`, and return the files written."""
+    path = Path(settings.STATIC_ROOT) / settings.AUTH_DEMO_STATIC_SCHEMA
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(generate_schema())
+
+    # Don't leave an old compressed copy behind if a compressor isn't available.
+    for suffix in (".gz", ".br"):
+        path.with_name(path.name + suffix).unlink(missing_ok=True)
+
+    return [str(path), *Compressor(quiet=True).compress(str(path))]
+
+
+def get_schema_url():
+    """Return the URL of the pre-generated schema, or `None` if there isn't one."""
+    if not staticfiles_storage.exists(settings.AUTH_DEMO_STATIC_SCHEMA):
+        return None
+
+    return staticfiles_storage.url(settings.AUTH_DEMO_STATIC_SCHEMA)
+
+
+class SwaggerView(SpectacularSwaggerView):
+    """The Swagger UI, loading the pre-generated schema if there is one."""
+
+    @extend_schema(exclude=True)
+    def get(self, request, *args, **kwargs):
+        """Point the UI at the static schema, or the schema view without it."""
+        self.url = get_schema_url()
+        return super().get(request, *args, **kwargs)
@@ -0,0 +1,293 @@
+"""
+Process-local index of the users subscribed to each third-party app.
+
+Each app's subscribers are loaded the first time they're needed, in one query,
+and kept as either a set of user IDs or, when that would be smaller, a bitmap
+with one bit per possible ID. Checking a subscription is then a lookup in memory.
+
+Every app has a generation counter in Django's cache, bumped each time one of
+its subscriptions is committed. The process that made the change applies it to
+its own copy, when it held the previous generation, and every other process
+reloads the app the next time it's used. The index is capped at
+`AUTH_DEMO_SUBSCRIBER_INDEX_MAX_BYTES`, dropping the least recently used apps to
+stay under it.
+"""
+
+import random
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from auth_demo.models import Subscription
+from auth_demo.versioning import bump_version, get_version
+
+INDEX_VERSION = "subscribers"
+
+# Roughly what a set spends on each user ID: the int itself, plus its hash and
+# pointer in the set's table.
+_SET_BYTES_PER_ID = sys.getsizeof(1 << 30) + 16
+
+
+class _SubscriberSet(set):
+    """Subscribed user IDs, for apps with few subscribers among many users."""
+
+    format = "set"
+
+    @property
+    def nbytes(self):
+        """Return roughly how much memory the set is using."""
+        return sys.getsizeof(self) + len(self) * sys.getsizeof(1 << 30)
+
+
+class _SubscriberBitmap:
+    """Subscribed user IDs as a bitmap, for apps with lots of subscribers."""
+
+    format = "bitmap"
+
+    def __init__(self, user_ids):
+        """Set a bit for each user ID."""
+        self.bits = bytearray(max(user_ids, default=0) // 8 + 1)
+        self.count = 0
+        for user_id in user_ids:
+            self.add(user_id)
+
+    def __contains__(self, user_id):
+        """Check if a user's bit is set."""
+        index = user_id >> 3
+        return index < len(self.bits) and bool(self.bits[index] & 1 << (user_id & 7))
+
+    def __len__(self):
+        """Return the number of subscribers."""
+        return self.count
+
+    def add(self, user_id):
+        """Set a user's bit, growing the bitmap if needed."""
+        if user_id in self:
+            return
+
+        if (index := user_id >> 3) >= len(self.bits):
+            self.bits.extend(bytes(index + 1 - len(self.bits)))
+
+        self.bits[index] |= 1 << (user_id & 7)
+        self.count += 1
+
+    def discard(self, user_id):
+        """Clear a user's bit."""
+        if user_id in self:
+            self.bits[user_id >> 3] &= ~(1 << (user_id & 7))
+            self.count -= 1
+
+    @property
+    def nbytes(self):
+        """Return how much memory the bitmap is using."""
+        return sys.getsizeof(self.bits)
+
+
+def _build_subscribers(user_ids):
+    """Hold the user IDs in whichever of a set or a bitmap is smaller."""
+    if max(user_ids, default=0) // 8 < len(user_ids) * _SET_BYTES_PER_ID:
+        return _SubscriberBitmap(user_ids)
+
+    return _SubscriberSet(user_ids)
+
+
+class _QuerySubscribers:
+    """An app's subscribers, checked against the database."""
+
+    def __init__(self, app_id):
+        """Check subscriptions to the given app."""
+        self.app_id = app_id
+
+    def __contains__(self, user_id):
+        """Check if a user is subscribed."""
+        # Uncommitted changes are only visible on the primary.
+        return (
+            Subscription.objects.using(DEFAULT_DB_ALIAS)
+            .filter(app_id=self.app_id, user_id=user_id)
+            .exists()
+        )
+
+
+class _Change:
+    """A change to an app's subscriptions, applied to the index once committed."""
+
+    def __init__(self, index, app_id, user_id, subscribed):
+        """Hold the change until the transaction it was made in commits."""
+        self.index = index
+        self.app_id = app_id
+        self.user_id = user_id
+        self.subscribed = subscribed
+        self.applied = False
+
+    def __call__(self):
+        """Apply the change."""
+        self.applied = True
+        self.index.changed(self.app_id, self.user_id, self.subscribed)
+
+
+class SubscriberIndex:
+    """An in-memory index of each third-party app's subscribers."""
+
+    def __init__(self):
+        """Start with an empty index."""
+        self.lock = threading.Lock()
+        # App IDs mapped to the generation they were loaded at and their subscribers,
+        # least recently used first.
+        self.entries = OrderedDict()
+
+    @staticmethod
+    def _generation_key(app_id):
+        """Return the cache key for an app's generation."""
+        return f"auth_demo:subscribers:{get_version(INDEX_VERSION).token}:{app_id}"
+
+    def _get_generation(self, app_id):
+        """Return an app's current generation, starting it if there isn't one."""
+        key = self._generation_key(app_id)
+        if (generation := cache.get(key)) is None:
+            # Start somewhere random, so a counter that's been evicted from the
+            # cache doesn't come back at a generation someone has already seen.
+            cache.add(key, random.getrandbits(48), None)
+            generation = cache.get(key)
+
+        return generation
+
+    def _bump_generation(self, app_id):
+        """Move an app on to its next generation, and return it if it's known."""
+        try:
+            return cache.incr(self._generation_key(app_id))
+        except ValueError:
+            return None
+
+    def get(self, app_id):
+        """Return something to check an app's subscribers against with `in`."""
+        if self.is_changing(app_id):
+            # This connection has changes in flight, which it can see and nobody
+            # else can. Only the database has it right.
+            return _QuerySubscribers(app_id)
+
+        generation = self._get_generation(app_id)
+        with self.lock:
+            entry = self.entries.get(app_id)
+            if entry is not None and entry[0] == generation:
+                self.entries.move_to_end(app_id)
+                return entry[1]
+
+        # Always load from the primary, as a replica that's behind could leave the
+        # index out of date for as long as the app's generation stays the same.
+        user_ids = array(
+            "q",
+            Subscription.objects.using(DEFAULT_DB_ALIAS)
+            .filter(app_id=app_id)
+            .values_list("user_id", flat=True)
+            .iterator(chunk_size=10000),
+        )
+        subscribers = _build_subscribers(user_ids)
+
+        if subscribers.nbytes > settings.AUTH_DEMO_SUBSCRIBER_INDEX_MAX_BYTES:
+            return _QuerySubscribers(app_id)
+
+        with self.lock:
+            self.entries[app_id] = (generation, subscribers)
+            self.entries.move_to_end(app_id)
+            self._evict()
+
+        return subscribers
+
+    def _evict(self):
+        """Drop the least recently used apps until the index fits its budget."""
+        total = sum(subscribers.nbytes for _, subscribers in self.entries.values())
+        while total > settings.AUTH_DEMO_SUBSCRIBER_INDEX_MAX_BYTES:
+            _, (_, subscribers) = self.entries.popitem(last=False)
+            total -= subscribers.nbytes
+
+    def changing(self, app_id, user_id, subscribed):
+        """
+        Note a change to an app's subscriptions, to apply once it's committed.
+
+        The change waits in the connection's `on_commit` callbacks, so a rollback
+        discards it along with the rest of the transaction.
+        """
+        transaction.on_commit(_Change(self, app_id, user_id, subscribed))
+
+    @staticmethod
+    def is_changing(app_id):
+        """Check if this thread's transaction has changed an app's subscriptions."""
+        return any(
+            isinstance(func, _Change) and func.app_id == app_id and not func.applied
+            for _, func in connections[DEFAULT_DB_ALIAS].run_on_commit
+        )
+
+    def changed(self, app_id, user_id, subscribed):
+        """
+        Apply a committed change to an app's subscriptions.
+
+        Other processes see a new generation and reload the app. This one applies
+        the change to its own copy, as long as nobody else has changed the app
+        since it was loaded. Without a `user_id`, it reloads the app too.
+        """
+        generation = self._bump_generation(app_id)
+
+        with self.lock:
+            if (entry := self.entries.get(app_id)) is None:
+                return
+
+            if user_id is None or generation is None or entry[0] != generation - 1:
+                del self.entries[app_id]
+                return
+
+            subscribers = entry[1]
+            if subscribed:
+                subscribers.add(user_id)
+            else:
+                subscribers.discard(user_id)
+
+            self.entries[app_id] = (generation, subscribers)
+            self._evict()
+
+    def forget(self, app_id):
+        """Drop an app from this process's index."""
+        with self.lock:
+            self.entries.pop(app_id, None)
+
+    def get_stats(self):
+        """Return how much memory this process's index is using, per app."""
+        with self.lock:
+            apps = {
+                app_id: {
+                    "subscribers": len(subscribers),
+                    "format": subscribers.format,
+                    "bytes": subscribers.nbytes,
+                }
+                for app_id, (_, subscribers) in self.entries.items()
+            }
+
+        return {
+            "bytes": sum(app["bytes"] for app in apps.values()),
+            "max_bytes": settings.AUTH_DEMO_SUBSCRIBER_INDEX_MAX_BYTES,
+            "apps": apps,
+        }
+
+    def clear(self):
+        """Invalidate the index in every process."""
+        bump_version(INDEX_VERSION)
+        with self.lock:
+            self.entries.clear()
+
+
+subscriber_index = SubscriberIndex()
+
+
+def is_subscribed(request, user, app):
+    """Check if `user` is subscribed to `app`, the app making the request."""
+    # Keep the app's subscribers on the Django request, so checking a batch of
+    # users only looks them up once.
+    http_request = getattr(request, "_request", request)
+    if getattr(http_request, "subscribers", None) is None:
+        http_request.subscribers = subscriber_index.get(app.pk)
+
+    return user.pk in http_request.subscribers
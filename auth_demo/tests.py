@@ -1,8 +1,46 @@
 """Auth app tests."""
-
+# pylint: disable=too-many-lines
+
+import csv
+import gzip
+import io
+import json
+import shutil
+import sqlite3
+import tempfile
+import threading
+from asyncio import iscoroutinefunction
+from pathlib import Path
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.test import (
+    Client,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from rest_framework.test import APITestCase
-
+from django.utils import timezone
+from rest_framework import renderers
+from rest_framework.test import APIRequestFactory, APITestCase, force_authenticate
+from rest_framework_simplejwt.tokens import AccessToken
+
+from auth_demo import instrumentation, list_cache
+from auth_demo.asgi import ASGIHandler, _read_chunk
+from auth_demo.asynchronous import AsyncRouter
+from auth_demo.authentication import (
+    CachedJWTAuthentication,
+    ThirdPartyAppAuthentication,
+)
+from auth_demo.entitlements import can_create_adverts
 from auth_demo.factories import (
     AdvertisementFactory,
     MessageFactory,
@@ -11,6 +49,25 @@ from auth_demo.factories import (
     ThirdPartyAppFactory,
     UserFactory,
 )
+from auth_demo.hierarchy import is_delegate
+from auth_demo.models import (
+    AdvertEntitlement,
+    Advertisement,
+    Message,
+    Subscription,
+    ThirdPartyApp,
+    User,
+    UserClosure,
+)
+from auth_demo.pool import ConnectionPool
+from auth_demo.registry import ThirdPartyAppRegistry, app_registry
+from auth_demo.renderers import JSONRenderer
+from auth_demo.replicas import ReplicaRouter
+from auth_demo.snapshots import load_snapshot
+from auth_demo.subscribers import SubscriberIndex, _build_subscribers, subscriber_index
+from auth_demo.throttling import get_backend
+from auth_demo.views import MessageViewSet
+from linktreetest.asgi import application
 
 
 class MessagesTestCase(APITestCase):
@@ -94,7 +151,7 @@ class MessagesTestCase(APITestCase):
         response = self.client.get(url)
 
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(response.json()), 3)
+        self.assertEqual(len(response.json()["results"]), 3)
 
 
 class AdvertisementsTestCase(APITestCase):
@@ -207,7 +264,7 @@ class AdvertisementsTestCase(APITestCase):
         response = self.client.get(url)
 
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(response.json()), 5)
+        self.assertEqual(len(response.json()["results"]), 5)
 
 
 class ThirdPartyAppTestCase(APITestCase):
@@ -228,7 +285,7 @@ class ThirdPartyAppTestCase(APITestCase):
             url,
             {"user": user.username, "message": "What a cool message"},
             format="json",
-            HTTP_X_EXTERNAL_APP=app.app_name,
+            HTTP_X_EXTERNAL_APP_KEY=app.api_key,
         )
 
         self.assertEqual(response.status_code, 201)
@@ -247,7 +304,7 @@ class ThirdPartyAppTestCase(APITestCase):
             url,
             {"user": user.username, "message": "What a cool message"},
             format="json",
-            HTTP_X_EXTERNAL_APP=app.app_name,
+            HTTP_X_EXTERNAL_APP_KEY=app.api_key,
         )
 
         self.assertEqual(response.status_code, 403)
@@ -270,7 +327,7 @@ class ThirdPartyAppTestCase(APITestCase):
                 "advertisement": "Would you consider buying our thing",
             },
             format="json",
-            HTTP_X_EXTERNAL_APP=app.app_name,
+            HTTP_X_EXTERNAL_APP_KEY=app.api_key,
         )
 
         self.assertEqual(response.status_code, 201)
@@ -289,7 +346,7 @@ class ThirdPartyAppTestCase(APITestCase):
             url,
             {"user": user.username, "advertisement": "Do it, buy our thing"},
             format="json",
-            HTTP_X_EXTERNAL_APP=app.app_name,
+            HTTP_X_EXTERNAL_APP_KEY=app.api_key,
         )
 
         self.assertEqual(response.status_code, 403)
@@ -309,7 +366,7 @@ class ThirdPartyAppTestCase(APITestCase):
             url,
             {"user": user.username, "advertisement": "Do it, buy our thing"},
             format="json",
-            HTTP_X_EXTERNAL_APP=app.app_name,
+            HTTP_X_EXTERNAL_APP_KEY=app.api_key,
         )
 
         self.assertEqual(response.status_code, 403)
@@ -326,7 +383,25 @@ class ThirdPartyAppTestCase(APITestCase):
             url,
             {"user": user.username, "message": "What a cool message"},
             format="json",
-            HTTP_X_EXTERNAL_APP=app.app_name,
+            HTTP_X_EXTERNAL_APP_KEY=app.api_key,
+        )
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_an_app_cant_use_another_apps_permissions(self):
+        """Test an app can't create a message using another app's permission."""
+        user = UserFactory()
+
+        app = ThirdPartyAppFactory()
+        ThirdPartyAppActionPermissionFactory(action="create", url_name="message-list")
+        SubscriptionFactory(user=user, app=app)
+
+        url = reverse("message-list")
+        response = self.client.post(
+            url,
+            {"user": user.username, "message": "What a cool message"},
+            format="json",
+            HTTP_X_EXTERNAL_APP_KEY=app.api_key,
         )
 
         self.assertEqual(response.status_code, 403)
@@ -343,7 +418,1912 @@ class ThirdPartyAppTestCase(APITestCase):
             url,
             {"user": user.username, "advertisement": "What a cool message"},
             format="json",
-            HTTP_X_EXTERNAL_APP=app.app_name,
+            HTTP_X_EXTERNAL_APP_KEY=app.api_key,
+        )
+
+        self.assertEqual(response.status_code, 403)
+
+
+class ThirdPartyAppRegistryTestCase(TestCase):
+    """Tests for the in-process third-party app registry."""
+
+    def setUp(self):
+        """Start each test with an empty cache."""
+        cache.clear()
+
+    def test_registry_lookups_are_cached(self):
+        """Test apps and their permissions are only loaded from the database once."""
+        app = ThirdPartyAppFactory()
+        ThirdPartyAppActionPermissionFactory(
+            app=app, action="create", url_name="message-list"
+        )
+
+        self.assertEqual(app_registry.get(app.app_name), app)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(app_registry.get(app.app_name), app)
+            self.assertTrue(app_registry.allows(app, "create", "message-list"))
+            self.assertFalse(app_registry.allows(app, "list", "message-list"))
+            self.assertIsNone(app_registry.get("not-an-app"))
+
+    def test_registry_is_invalidated_when_an_app_changes(self):
+        """Test a new app is visible after the registry has been loaded."""
+        self.assertIsNone(app_registry.get("new-app"))
+
+        app = ThirdPartyAppFactory(app_name="new-app")
+
+        self.assertEqual(app_registry.get("new-app"), app)
+
+    def test_registry_is_invalidated_when_a_permission_changes(self):
+        """Test a new permission is visible after the registry has been loaded."""
+        app = ThirdPartyAppFactory()
+        self.assertFalse(app_registry.allows(app, "create", "message-list"))
+
+        ThirdPartyAppActionPermissionFactory(
+            app=app, action="create", url_name="message-list"
+        )
+
+        self.assertTrue(app_registry.allows(app, "create", "message-list"))
+
+    def test_registry_is_invalidated_in_other_processes(self):
+        """Test a registry in another worker picks up changes made in this one."""
+        other_registry = ThirdPartyAppRegistry()
+        app = ThirdPartyAppFactory()
+        self.assertFalse(other_registry.allows(app, "create", "message-list"))
+
+        ThirdPartyAppActionPermissionFactory(
+            app=app, action="create", url_name="message-list"
+        )
+
+        self.assertTrue(other_registry.allows(app, "create", "message-list"))
+
+
+class UserHierarchyTestCase(APITestCase):
+    """Tests for the user closure table backing delegated access."""
+
+    def test_closure_tracks_parents(self):
+        """Test adding and removing a parent updates who can act for a user."""
+        user1 = UserFactory()
+        user2 = UserFactory()
+
+        user1.parents.add(user2)
+        self.assertTrue(is_delegate(user2, user1))
+
+        user1.parents.remove(user2)
+        self.assertFalse(is_delegate(user2, user1))
+
+    def test_closure_tracks_cleared_parents(self):
+        """Test clearing a user's parents removes their delegates."""
+        user1 = UserFactory()
+        user2 = UserFactory()
+        user1.parents.add(user2)
+
+        user1.parents.clear()
+
+        self.assertFalse(UserClosure.objects.exists())
+
+    def test_delegation_check_is_a_single_query(self):
+        """Test checking delegated access is one query however many parents exist."""
+        user = UserFactory()
+        parents = UserFactory.create_batch(10)
+        user.parents.add(*parents)
+
+        with self.assertNumQueries(1):
+            self.assertTrue(is_delegate(parents[-1], user))
+
+    def test_siblings_cant_act_for_each_other(self):
+        """Test two children of the same parent can't create messages for each other."""
+        child1 = UserFactory()
+        child2 = UserFactory()
+        parent = UserFactory()
+        child1.parents.add(parent)
+        child2.parents.add(parent)
+
+        self.assertFalse(is_delegate(child2, child1))
+        self.client.force_login(child2)
+        response = self.client.post(
+            reverse("message-list"),
+            {"message": "Hello", "user": child1.username},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 403)
+
+        # Following the links any further would lead from one sibling to the other.
+        with override_settings(AUTH_DEMO_DELEGATION_DEPTH=2):
+            with self.assertRaises(ImproperlyConfigured):
+                is_delegate(child2, child1)
+            with self.assertRaises(ImproperlyConfigured):
+                call_command("rebuild_user_closure", stdout=io.StringIO())
+
+    def test_deleting_a_user_removes_their_delegation(self):
+        """Test deleting a parent removes their delegated access."""
+        user1 = UserFactory()
+        user2 = UserFactory()
+        user1.parents.add(user2)
+        self.assertTrue(is_delegate(user2, user1))
+
+        user2.delete()
+
+        self.assertFalse(UserClosure.objects.exists())
+
+    def test_grandparent_cant_create_message_by_default(self):
+        """Test only direct parents can act on behalf of an account by default."""
+        user1 = UserFactory()
+        user2 = UserFactory()
+        user3 = UserFactory()
+        user1.parents.add(user2)
+        user2.parents.add(user3)
+
+        self.client.force_login(user3)
+
+        url = reverse("message-list")
+        response = self.client.post(
+            url, {"message": "Hello", "user": user1.username}, format="json"
+        )
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_rebuild_matches_incremental_updates(self):
+        """Test rebuilding the closure table gives the same rows as the signals."""
+        users = UserFactory.create_batch(5)
+        for child, parent in zip(users, users[1:]):
+            child.parents.add(parent)
+        users[0].parents.add(users[3])
+        users[2].parents.remove(users[3])
+
+        def closure_rows():
+            return set(
+                UserClosure.objects.values_list("ancestor_id", "descendant_id", "depth")
+            )
+
+        incremental = closure_rows()
+        call_command("rebuild_user_closure", stdout=io.StringIO())
+
+        self.assertEqual(closure_rows(), incremental)
+
+    def test_a_single_link_matches_a_rebuild(self):
+        """Test the signals close a single new link in both directions."""
+        user1 = UserFactory()
+        user2 = UserFactory()
+        user1.parents.add(user2)
+
+        incremental = set(
+            UserClosure.objects.values_list("ancestor_id", "descendant_id", "depth")
+        )
+        call_command("rebuild_user_closure", stdout=io.StringIO())
+
+        self.assertEqual(
+            set(
+                UserClosure.objects.values_list("ancestor_id", "descendant_id", "depth")
+            ),
+            incremental,
+        )
+        self.assertTrue(is_delegate(user1, user2))
+        self.assertTrue(is_delegate(user2, user1))
+
+    def test_a_child_can_act_for_the_parent_it_was_linked_to(self):
+        """Test a user can create a message for a parent they've just added."""
+        user1 = UserFactory()
+        user2 = UserFactory()
+        user1.parents.add(user2)
+        self.client.force_login(user1)
+
+        response = self.client.post(
+            reverse("message-list"),
+            {"message": "Hello", "user": user2.username},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 201)
+
+
+class PaginationTestCase(APITestCase):
+    """Tests for paging through the list endpoints."""
+
+    def setUp(self):
+        """Log in as a user."""
+        self.client.force_login(UserFactory())
+
+    def test_list_pages_through_every_message(self):
+        """Test following the next links returns each message once, newest first."""
+        messages = MessageFactory.create_batch(5)
+
+        ids = []
+        url = reverse("message-list") + "?page_size=2"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.json()["results"]), 2)
+
+            ids.extend(message["id"] for message in response.json()["results"])
+            url = response.json()["next"]
+
+        self.assertEqual(
+            ids, sorted((message.id for message in messages), reverse=True)
+        )
+
+    @override_settings(AUTH_DEMO_MAX_PAGE_SIZE=3)
+    def test_page_size_is_capped(self):
+        """Test a client can't ask for a page bigger than the configured maximum."""
+        AdvertisementFactory.create_batch(5)
+
+        url = reverse("advertisement-list")
+        response = self.client.get(url, {"page_size": 100})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), 3)
+
+    def test_list_can_be_filtered_by_user(self):
+        """Test only the requested user's messages are listed."""
+        user = UserFactory()
+        MessageFactory.create_batch(2, user=user)
+        MessageFactory.create_batch(3)
+
+        url = reverse("message-list")
+        response = self.client.get(url, {"user": user.id})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {message["user"]["id"] for message in response.json()["results"]},
+            {user.id},
+        )
+        self.assertEqual(len(response.json()["results"]), 2)
+
+    def test_list_query_count_doesnt_grow_with_rows(self):
+        """Test listing many rows takes as many queries as listing one."""
+        url = reverse("message-list")
+        query_counts = []
+
+        for count in (1, 10):
+            MessageFactory.create_batch(count)
+
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()["results"]), Message.objects.count())
+            query_counts.append(len(queries))
+
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_list_rejects_an_invalid_user_filter(self):
+        """Test filtering by something that isn't a user ID is a bad request."""
+        url = reverse("message-list")
+        response = self.client.get(url, {"user": "not-an-id"})
+
+        self.assertEqual(response.status_code, 400)
+
+
+class BulkCreateTestCase(APITestCase):
+    """Tests for creating a batch of objects in one request."""
+
+    def test_user_can_bulk_create_messages(self):
+        """Test a user can create several messages at once."""
+        user = UserFactory()
+        self.client.force_login(user)
+
+        url = reverse("message-bulk-create")
+        response = self.client.post(
+            url,
+            [{"message": "Hello", "user": user.username}] * 3,
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result["status"] for result in response.json()], [201] * 3)
+        self.assertEqual(user.messages.count(), 3)
+
+    def test_bulk_created_objects_have_their_ids(self):
+        """Test each created object is returned with the ID it was saved with."""
+        user = UserFactory()
+        MessageFactory()
+        self.client.force_login(user)
+
+        response = self.client.post(
+            reverse("message-bulk-create"),
+            [{"message": str(number), "user": user.username} for number in range(3)],
+            format="json",
+        )
+
+        self.assertEqual(
+            [
+                (result["data"]["id"], result["data"]["message"])
+                for result in response.json()
+            ],
+            list(user.messages.order_by("id").values_list("id", "message")),
+        )
+
+    def test_bulk_created_ids_are_only_read_back_from_sqlite(self):
+        """Test a backend that might interleave writers doesn't get guessed IDs."""
+        user = UserFactory()
+        self.client.force_login(user)
+
+        with mock.patch.object(connection, "vendor", "mysql"):
+            response = self.client.post(
+                reverse("message-bulk-create"),
+                [{"message": "Hello", "user": user.username}] * 2,
+                format="json",
+            )
+
+        self.assertEqual(
+            [result["data"]["id"] for result in response.json()], [None] * 2
+        )
+        self.assertEqual(user.messages.count(), 2)
+
+    def test_bulk_create_checks_numeric_usernames(self):
+        """Test a username sent as a number is checked like any other."""
+        user = UserFactory(username="424242")
+        self.client.force_login(user)
+        UserFactory(username="525252")
+
+        response = self.client.post(
+            reverse("message-bulk-create"),
+            [
+                {"message": "Hello", "user": 424242},
+                {"message": "Hello", "user": 525252},
+            ],
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result["status"] for result in response.json()], [201, 403])
+        self.assertEqual(Message.objects.get().user, user)
+
+    def test_bulk_create_reports_each_item(self):
+        """Test bad items in a batch fail on their own."""
+        user1 = UserFactory()
+        user2 = UserFactory()
+        self.client.force_login(user1)
+
+        url = reverse("message-bulk-create")
+        response = self.client.post(
+            url,
+            [
+                {"message": "Hello", "user": user1.username},
+                {"message": "Hello", "user": "cow-says-moo"},
+                {"message": "Hello", "user": user2.username},
+                {"user": user1.username},
+            ],
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()
+        self.assertEqual([result["status"] for result in results], [201, 400, 403, 400])
+        self.assertEqual(results[0]["data"]["user"]["username"], user1.username)
+        self.assertIn("User does not exist.", results[1]["errors"]["user"])
+        self.assertEqual(user1.messages.count(), 1)
+        self.assertFalse(user2.messages.exists())
+
+    def test_bulk_create_query_count_doesnt_grow_with_items(self):
+        """Test users are resolved and permissions checked once per batch."""
+        user = UserFactory(paid_subscriber=True)
+        self.client.force_login(user)
+
+        url = reverse("advertisement-bulk-create")
+        query_counts = []
+        # The first batch warms the user's cached entitlements, so the other two
+        # start out the same.
+        for count in (1, 1, 10):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(
+                    url,
+                    [{"advertisement": "Buy it", "user": user.username}] * count,
+                    format="json",
+                )
+
+            self.assertEqual(response.status_code, 200)
+            query_counts.append(len(queries))
+
+        self.assertEqual(query_counts[1], query_counts[2])
+        self.assertEqual(user.adverts.count(), 12)
+
+    @override_settings(AUTH_DEMO_BULK_CREATE_MAX_ITEMS=2)
+    def test_bulk_create_rejects_large_batches(self):
+        """Test a batch can't be bigger than the configured maximum."""
+        user = UserFactory()
+        self.client.force_login(user)
+
+        url = reverse("message-bulk-create")
+        response = self.client.post(
+            url,
+            [{"message": "Hello", "user": user.username}] * 3,
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(user.messages.exists())
+
+    def test_an_app_can_bulk_create_messages_for_subscribers(self):
+        """Test an app can bulk create messages for its subscribers only."""
+        subscriber = UserFactory()
+        non_subscriber = UserFactory()
+
+        app = ThirdPartyAppFactory()
+        ThirdPartyAppActionPermissionFactory(
+            app=app, action="bulk_create", url_name="message-bulk-create"
+        )
+        SubscriptionFactory(user=subscriber, app=app)
+
+        url = reverse("message-bulk-create")
+        response = self.client.post(
+            url,
+            [
+                {"message": "Hello", "user": subscriber.username},
+                {"message": "Hello", "user": non_subscriber.username},
+            ],
+            format="json",
+            HTTP_X_EXTERNAL_APP_KEY=app.api_key,
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result["status"] for result in response.json()], [201, 403])
+
+
+class TargetUserResolutionTestCase(APITestCase):
+    """Tests for looking up the user an object is created for once per request."""
+
+    @staticmethod
+    def user_queries(queries):
+        """Return the captured queries that read from the user table."""
+        return [query for query in queries if 'FROM "auth_demo_user"' in query["sql"]]
+
+    def test_an_app_create_looks_up_the_user_once(self):
+        """Test the permissions and validation share a single user lookup."""
+        user = UserFactory(paid_subscriber=True)
+
+        app = ThirdPartyAppFactory()
+        ThirdPartyAppActionPermissionFactory(
+            app=app, action="create", url_name="advertisement-list"
+        )
+        SubscriptionFactory(user=user, app=app)
+
+        url = reverse("advertisement-list")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                url,
+                {"user": user.username, "advertisement": "Buy our thing"},
+                format="json",
+                HTTP_X_EXTERNAL_APP_KEY=app.api_key,
+            )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(self.user_queries(queries)), 1)
+
+    def test_a_user_create_looks_up_the_target_user_once(self):
+        """Test a user creating a message for another only looks them up once."""
+        user1 = UserFactory()
+        user2 = UserFactory()
+        user1.parents.add(user2)
+        self.client.force_login(user2)
+
+        url = reverse("message-list")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                url, {"message": "Hello", "user": user1.username}, format="json"
+            )
+
+        self.assertEqual(response.status_code, 201)
+        # One for the session's user and one for the user the message is for.
+        self.assertEqual(len(self.user_queries(queries)), 2)
+
+    def test_a_numeric_username_is_checked_like_any_other(self):
+        """Test a username sent as a number can't skip the permission checks."""
+        UserFactory(username="424242", paid_subscriber=True)
+        self.client.force_login(UserFactory())
+
+        response = self.client.post(
+            reverse("message-list"), {"user": 424242, "message": "x"}, format="json"
         )
+        self.assertEqual(response.status_code, 403)
 
+        response = self.client.post(
+            reverse("advertisement-list"),
+            {"user": 424242, "advertisement": "x"},
+            format="json",
+        )
         self.assertEqual(response.status_code, 403)
+        self.assertFalse(Message.objects.exists())
+        self.assertFalse(Advertisement.objects.exists())
+
+
+class ExportTestCase(APITestCase):
+    """Tests for streaming exports."""
+
+    def setUp(self):
+        """Log in as a user."""
+        self.client.force_login(UserFactory())
+
+    def test_messages_can_be_exported_as_ndjson(self):
+        """Test messages are streamed out as one JSON object per line."""
+        messages = MessageFactory.create_batch(3)
+
+        url = reverse("message-export")
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [
+            json.loads(line)
+            for line in b"".join(response.streaming_content).decode().splitlines()
+        ]
+        self.assertEqual(
+            rows,
+            [
+                {
+                    "id": message.id,
+                    "user_id": message.user.id,
+                    "username": message.user.username,
+                    "message": message.message,
+                }
+                for message in messages
+            ],
+        )
+
+    def test_adverts_can_be_exported_as_csv(self):
+        """Test adverts are streamed out as CSV with a header row."""
+        advert = AdvertisementFactory(advertisement='Buy "this", now')
+
+        url = reverse("advertisement-export")
+        response = self.client.get(url, {"export_format": "csv"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        rows = list(
+            csv.reader(io.StringIO(b"".join(response.streaming_content).decode()))
+        )
+        self.assertEqual(
+            rows,
+            [
+                ["id", "user_id", "username", "advertisement"],
+                [
+                    str(advert.id),
+                    str(advert.user.id),
+                    advert.user.username,
+                    advert.advertisement,
+                ],
+            ],
+        )
+
+    def test_export_can_be_filtered(self):
+        """Test an export can be narrowed down by user and ID range."""
+        user = UserFactory()
+        messages = MessageFactory.create_batch(4, user=user)
+        MessageFactory.create_batch(2)
+
+        url = reverse("message-export")
+        response = self.client.get(
+            url, {"user": user.id, "min_id": messages[1].id, "max_id": messages[2].id}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        ids = [
+            json.loads(line)["id"]
+            for line in b"".join(response.streaming_content).decode().splitlines()
+        ]
+        self.assertEqual(ids, [messages[1].id, messages[2].id])
+
+    def test_export_rejects_unknown_formats(self):
+        """Test asking for an unsupported format is a bad request."""
+        url = reverse("message-export")
+        response = self.client.get(url, {"export_format": "xml"})
+
+        self.assertEqual(response.status_code, 400)
+
+
+class ConditionalListTestCase(APITestCase):
+    """Tests for conditional GETs of the list endpoints."""
+
+    def setUp(self):
+        """Start with an empty cache and log in as a user."""
+        cache.clear()
+        self.client.force_login(UserFactory())
+
+    def test_unchanged_list_is_not_modified(self):
+        """Test a list is answered with a 304 if nothing has changed."""
+        MessageFactory.create_batch(3)
+
+        url = reverse("message-list")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("ETag", response)
+        self.assertIn("Last-Modified", response)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(
+            [query for query in queries if "auth_demo_message" in query["sql"]]
+        )
+
+    def test_list_is_modified_when_a_row_changes(self):
+        """Test saving or deleting a row gives the list a new ETag."""
+        message = MessageFactory()
+
+        url = reverse("message-list")
+        etag = self.client.get(url)["ETag"]
+
+        MessageFactory()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+        etag = response["ETag"]
+        message.delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_list_is_modified_when_a_user_is_renamed(self):
+        """Test a client holding an ETag sees a renamed user's new details."""
+        advert = AdvertisementFactory()
+
+        url = reverse("advertisement-list")
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        advert.user.username = "renamed"
+        advert.user.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"][0]["user"]["username"], "renamed")
+
+    def test_filtered_list_only_changes_with_its_user(self):
+        """Test a list filtered by user only changes when that user's rows do."""
+        advert = AdvertisementFactory()
+
+        url = reverse("advertisement-list")
+        response = self.client.get(url, {"user": advert.user.id})
+        etag = response["ETag"]
+
+        AdvertisementFactory()
+        response = self.client.get(
+            url, {"user": advert.user.id}, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 304)
+
+        AdvertisementFactory(user=advert.user)
+        response = self.client.get(
+            url, {"user": advert.user.id}, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_each_page_has_its_own_etag(self):
+        """Test the ETag covers the query string."""
+        MessageFactory.create_batch(3)
+
+        url = reverse("message-list")
+        first_page = self.client.get(url, {"page_size": 1})
+        second_page = self.client.get(first_page.json()["next"])
+
+        self.assertNotEqual(first_page["ETag"], second_page["ETag"])
+
+    def test_bulk_create_modifies_the_list(self):
+        """Test creating a batch gives the list a new ETag."""
+        user = UserFactory()
+        self.client.force_login(user)
+
+        url = reverse("message-list")
+        etag = self.client.get(url)["ETag"]
+
+        self.client.post(
+            reverse("message-bulk-create"),
+            [{"message": "Hello", "user": user.username}],
+            format="json",
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+
+
+class CachedListTestCase(APITestCase):
+    """Tests for the server-side cache of list pages."""
+
+    def setUp(self):
+        """Start with an empty cache and log in as a user."""
+        cache.clear()
+        self.client.force_login(UserFactory())
+
+    def test_repeated_list_is_served_from_the_cache(self):
+        """Test the second request for a page doesn't query its rows."""
+        MessageFactory.create_batch(3)
+
+        url = reverse("message-list")
+        first = self.client.get(url)
+        self.assertEqual(first["X-Cache"], "MISS")
+
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(url)
+
+        self.assertEqual(second["X-Cache"], "HIT")
+        self.assertEqual(second.json(), first.json())
+        self.assertFalse(
+            [query for query in queries if "auth_demo_message" in query["sql"]]
+        )
+        self.assertEqual(list_cache.get_stats(Message), {"hits": 1, "misses": 1})
+
+    def test_cache_is_invalidated_when_a_row_changes(self):
+        """Test a new object moves the list on to a fresh cache generation."""
+        MessageFactory()
+
+        url = reverse("message-list")
+        self.client.get(url)
+        MessageFactory()
+        response = self.client.get(url)
+
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(len(response.json()["results"]), 2)
+
+    def test_cache_is_invalidated_when_a_user_is_renamed(self):
+        """Test a change to a user's details isn't served from a cached page."""
+        message = MessageFactory()
+
+        url = reverse("message-list")
+        self.client.get(url)
+        message.user.username = "renamed"
+        message.user.save()
+        response = self.client.get(url)
+
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.json()["results"][0]["user"]["username"], "renamed")
+
+    def test_each_page_is_cached_separately(self):
+        """Test the cache key covers the query string."""
+        MessageFactory.create_batch(3)
+
+        url = reverse("message-list")
+        first_page = self.client.get(url, {"page_size": 1})
+        second_page = self.client.get(first_page.json()["next"])
+
+        self.assertEqual(second_page["X-Cache"], "MISS")
+        self.assertNotEqual(first_page.json(), second_page.json())
+
+    @override_settings(AUTH_DEMO_LIST_CACHE_TIMEOUT=0)
+    def test_cache_can_be_turned_off(self):
+        """Test a timeout of 0 turns the cache off."""
+        url = reverse("advertisement-list")
+        self.client.get(url)
+        response = self.client.get(url)
+
+        self.assertNotIn("X-Cache", response)
+
+
+@override_settings(AUTH_DEMO_LIST_CACHE_TIMEOUT=0)
+class ValuesListTestCase(APITestCase):
+    """Tests for building list pages from `.values()` rows."""
+
+    def setUp(self):
+        """Log in as a user, and give a couple of users some objects."""
+        cache.clear()
+        self.client.force_login(UserFactory())
+
+        self.users = [UserFactory(username="Zoë"), UserFactory(email="")]
+        for user in self.users:
+            MessageFactory.create_batch(2, user=user)
+            AdvertisementFactory.create_batch(2, user=user)
+        MessageFactory(user=self.users[0], message="Line\u2028separator, “quotes”")
+
+    def get_both(self, url, params=None):
+        """Get a list with and without the `.values()` path."""
+        with override_settings(AUTH_DEMO_VALUES_LISTS=False):
+            serialised = self.client.get(url, params)
+        with override_settings(AUTH_DEMO_VALUES_LISTS=True):
+            values = self.client.get(url, params)
+
+        return serialised, values
+
+    def test_output_is_byte_identical(self):
+        """Test the list responses are exactly what the serialisers produce."""
+        for url, params in (
+            (reverse("message-list"), None),
+            (reverse("message-list"), {"user": self.users[0].pk}),
+            (reverse("advertisement-list"), {"page_size": 2}),
+        ):
+            with self.subTest(url=url, params=params):
+                serialised, values = self.get_both(url, params)
+
+                self.assertEqual(values.status_code, 200)
+                self.assertEqual(values.content, serialised.content)
+
+    def test_later_pages_are_byte_identical(self):
+        """Test the cursor links from the `.values()` path lead to the same pages."""
+        url = reverse("message-list")
+        serialised, values = self.get_both(url, {"page_size": 2})
+        serialised, values = self.get_both(serialised.json()["next"])
+
+        self.assertEqual(values.content, serialised.content)
+
+    def test_rows_and_users_are_read_in_one_query(self):
+        """Test only the needed columns are read, users included, in one query."""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("message-list"))
+
+        [query] = [query for query in queries if "auth_demo_message" in query["sql"]]
+        self.assertIn("email", query["sql"])
+        self.assertNotIn("password", query["sql"])
+
+    def test_renderer_matches_drf(self):
+        """Test the orjson renderer writes the same bytes as DRF's renderer."""
+        data = {
+            "text": "Zoë\u2028\u2029",
+            "numbers": [1, 2.5, 2**70, None, True],
+            "keys": {1: "one"},
+            "when": timezone.now(),
+        }
+
+        for media_type in ("application/json", "application/json; indent=4"):
+            with self.subTest(media_type=media_type):
+                self.assertEqual(
+                    JSONRenderer().render(data, media_type),
+                    renderers.JSONRenderer().render(data, media_type),
+                )
+
+
+class AsyncViewTestCase(TransactionTestCase):
+    """Tests for the async request path."""
+
+    def setUp(self):
+        """Start with an empty cache."""
+        cache.clear()
+
+    @staticmethod
+    def get_views():
+        """Return the message views, keyed by URL name."""
+        router = AsyncRouter()
+        router.register("messages", MessageViewSet)
+        return {url.name: url.callback for url in router.urls}
+
+    def test_views_are_only_async_when_turned_on(self):
+        """Test list and create are coroutines under ASGI, and nothing else is."""
+        self.assertFalse(iscoroutinefunction(self.get_views()["message-list"]))
+
+        with override_settings(AUTH_DEMO_ASYNC_VIEWS=True):
+            views = self.get_views()
+
+        self.assertTrue(iscoroutinefunction(views["message-list"]))
+        self.assertFalse(iscoroutinefunction(views["message-export"]))
+
+    @override_settings(AUTH_DEMO_ASYNC_VIEWS=True)
+    def test_async_list_and_create(self):
+        """Test the async views behave the same as the sync ones."""
+        user = UserFactory()
+        MessageFactory(user=user)
+        view = self.get_views()["message-list"]
+        factory = APIRequestFactory()
+
+        request = factory.get("/api/messages/")
+        force_authenticate(request, user)
+        response = async_to_sync(view)(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.content)["results"]), 1)
+
+        request = factory.post(
+            "/api/messages/", {"user": user.username, "message": "Hi"}, format="json"
+        )
+        force_authenticate(request, user)
+        response = async_to_sync(view)(request)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Message.objects.count(), 2)
+
+    @staticmethod
+    def export_through_asgi():
+        """Export the messages through the ASGI application, as a logged in user."""
+        client = Client()
+        client.force_login(UserFactory())
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": reverse("message-export"),
+            "raw_path": reverse("message-export").encode(),
+            "query_string": b"",
+            "root_path": "",
+            "headers": [
+                (b"host", b"testserver"),
+                (b"cookie", f"sessionid={client.cookies['sessionid'].value}".encode()),
+            ],
+            "server": ("testserver", 80),
+            "client": ("127.0.0.1", 0),
+        }
+
+        async def export():
+            communicator = ApplicationCommunicator(application, scope)
+            await communicator.send_input({"type": "http.request", "body": b""})
+            start = await communicator.receive_output()
+            body = b""
+            while (message := await communicator.receive_output())["type"] == (
+                "http.response.body"
+            ):
+                body += message.get("body", b"")
+                if not message.get("more_body"):
+                    break
+            return start, body
+
+        return async_to_sync(export)()
+
+    @override_settings(AUTH_DEMO_EXPORT_CHUNK_SIZE=2)
+    def test_export_streams_through_the_asgi_application(self):
+        """Test an export reads from the database off the event loop under ASGI."""
+        messages = MessageFactory.create_batch(5)
+
+        start, body = self.export_through_asgi()
+
+        self.assertEqual(start["status"], 200)
+        self.assertEqual(
+            [json.loads(line)["id"] for line in body.decode().splitlines()],
+            [message.id for message in messages],
+        )
+
+    def test_export_is_read_a_chunk_at_a_time(self):
+        """Test an export takes a thread hop per chunk of content, not per row."""
+        MessageFactory.create_batch(50)
+
+        with mock.patch.object(ASGIHandler, "chunk_size", 1024), mock.patch(
+            "auth_demo.asgi._read_chunk", wraps=_read_chunk
+        ) as read_chunk:
+            _, body = self.export_through_asgi()
+
+        self.assertEqual(len(body.splitlines()), 50)
+        # One hop for each full chunk, one for what's left and one to find the end.
+        self.assertLessEqual(read_chunk.call_count, len(body) // 1024 + 2)
+        self.assertLess(read_chunk.call_count, 10)
+
+
+class BenchmarkTestCase(TestCase):
+    """Tests for the benchmark commands."""
+
+    def test_benchmarks_run_against_seeded_data(self):
+        """Test every scenario runs without errors against a small dataset."""
+        call_command(
+            "seed_benchmark_data",
+            users=10,
+            apps=2,
+            messages=20,
+            adverts=20,
+            stdout=io.StringIO(),
+        )
+
+        output = io.StringIO()
+        call_command("run_benchmarks", requests=2, warmup=0, stdout=output)
+        results = json.loads(output.getvalue())
+
+        self.assertEqual(results["dataset"]["messages"], 20)
+        self.assertEqual(len(results["scenarios"]), 12)
+        self.assertFalse([s for s in results["scenarios"] if s["errors"]])
+
+        # The objects created while benchmarking were rolled back.
+        self.assertEqual(Message.objects.count(), 20)
+
+    def test_benchmarks_need_seeded_data(self):
+        """Test the benchmarks refuse to run without any data."""
+        with self.assertRaises(CommandError):
+            call_command("run_benchmarks", stdout=io.StringIO())
+
+
+@override_settings(AUTH_DEMO_INSTRUMENTATION_SAMPLE_RATE=1)
+class InstrumentationTestCase(APITestCase):
+    """Tests for the request instrumentation."""
+
+    def setUp(self):
+        """Start with empty metrics."""
+        cache.clear()
+        instrumentation.clear_stats()
+
+    def test_sampled_requests_get_server_timing(self):
+        """Test a sampled request reports its queries and phases."""
+        self.client.force_login(user := UserFactory())
+        MessageFactory(user=user)
+
+        response = self.client.get(reverse("message-list"))
+
+        timings = dict(
+            timing.split(";", 1) for timing in response["Server-Timing"].split(", ")
+        )
+        self.assertEqual(
+            set(timings),
+            {
+                "db",
+                "authentication",
+                "permissions",
+                "serialisation",
+                "rendering",
+                "total",
+            },
+        )
+        self.assertRegex(timings["db"], r'^desc="[1-9]\d* queries";dur=')
+
+    @override_settings(AUTH_DEMO_INSTRUMENTATION_SAMPLE_RATE=0)
+    def test_unsampled_requests_arent_instrumented(self):
+        """Test a request outside the sample isn't instrumented."""
+        self.client.force_login(UserFactory())
+
+        response = self.client.get(reverse("message-list"))
+
+        self.assertNotIn("Server-Timing", response)
+        self.assertEqual(instrumentation.get_stats(), {})
+
+    def test_metrics_are_aggregated_per_view(self):
+        """Test the metrics endpoint reports histograms for each view."""
+        self.client.force_login(UserFactory(is_staff=True))
+        self.client.get(reverse("message-list"))
+        self.client.get(reverse("message-list"))
+
+        response = self.client.get(reverse("metrics"))
+
+        self.assertEqual(response.status_code, 200)
+        histograms = response.json()["views"]["GET message-list"]["histograms"]
+        self.assertEqual(histograms["total"]["count"], 2)
+        self.assertEqual(sum(histograms["queries"]["counts"]), 2)
+        self.assertIn("auth_demo.message", response.json()["list_cache"])
+
+    def test_metrics_are_staff_only(self):
+        """Test a regular user can't see the metrics."""
+        self.client.force_login(UserFactory())
+
+        response = self.client.get(reverse("metrics"))
+
+        self.assertEqual(response.status_code, 403)
+
+
+class CachedJWTAuthenticationTestCase(APITestCase):
+    """Tests for the cache of verified tokens."""
+
+    def setUp(self):
+        """Start with an empty cache, and a user with a token."""
+        cache.clear()
+        self.user = UserFactory(paid_subscriber=True)
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}"
+        )
+
+    def post_advert(self):
+        """Create an advert for the user, which needs them to be a paid subscriber."""
+        return self.client.post(
+            reverse("advertisement-list"),
+            {"user": self.user.username, "advertisement": "Buy our thing"},
+            format="json",
+        )
+
+    def test_repeated_token_skips_verification_and_user_lookup(self):
+        """Test a token we've seen before isn't verified or its user loaded again."""
+        self.assertEqual(self.post_advert().status_code, 201)
+
+        with mock.patch.object(AccessToken, "verify") as verify:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.post_advert()
+
+        self.assertEqual(response.status_code, 201)
+        verify.assert_not_called()
+        # Only the user the advert is for is looked up, by username.
+        user_queries = [q for q in queries if 'FROM "auth_demo_user"' in q["sql"]]
+        self.assertEqual(len(user_queries), 1)
+        self.assertIn('"username" IN', user_queries[0]["sql"])
+
+    def test_changing_the_user_invalidates_their_tokens(self):
+        """Test a change to the user is seen by requests with a cached token."""
+        self.post_advert()
+
+        self.user.paid_subscriber = False
+        self.user.save()
+
+        self.assertEqual(self.post_advert().status_code, 403)
+
+    def test_deactivated_user_is_rejected(self):
+        """Test a cached token stops working once its user is deactivated."""
+        self.post_advert()
+
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertEqual(self.post_advert().status_code, 401)
+
+
+class UserSnapshotTestCase(APITestCase):
+    """Tests for the user snapshots the permission checks work from."""
+
+    def setUp(self):
+        """Start with an empty cache."""
+        cache.clear()
+
+    def test_snapshot_is_loaded_with_its_parents_in_one_query(self):
+        """Test a snapshot reads only its own columns, and its parents' IDs."""
+        user = UserFactory()
+        parents = UserFactory.create_batch(2)
+        user.parents.add(*parents)
+
+        with CaptureQueriesContext(connection) as queries:
+            snapshot = load_snapshot(user.pk)
+
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn("password", queries[0]["sql"])
+        self.assertEqual(snapshot.username, user.username)
+        self.assertEqual(snapshot.parent_ids, tuple(parent.pk for parent in parents))
+        self.assertEqual(load_snapshot(parents[0].pk).parent_ids, (user.pk,))
+
+    def test_delegated_create_checks_the_snapshot_parents(self):
+        """Test a parent creating for a child doesn't load full users or the closure."""
+        parent = UserFactory()
+        child = UserFactory()
+        child.parents.add(parent)
+        self.client.force_login(parent)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse("message-list"),
+                {"user": child.username, "message": "Hi"},
+                format="json",
+            )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["user"]["email"], child.email)
+        lookups = [q["sql"] for q in queries if '"username" IN' in q["sql"]]
+        self.assertEqual(len(lookups), 1)
+        self.assertNotIn("password", lookups[0])
+        self.assertFalse([q for q in queries if "auth_demo_userclosure" in q["sql"]])
+
+    def test_changing_parents_invalidates_cached_tokens(self):
+        """Test a cached token's snapshot is reloaded when its user's parents change."""
+        user = UserFactory()
+        parent = UserFactory()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}"
+        )
+        self.client.get(reverse("message-list"))
+
+        with mock.patch(
+            "auth_demo.authentication.load_snapshot", wraps=load_snapshot
+        ) as load:
+            user.parents.add(parent)
+            self.client.get(reverse("message-list"))
+
+        load.assert_called_once_with(user.pk)
+
+
+class AdvertEntitlementTestCase(APITestCase):
+    """Tests for the denormalised advert entitlements."""
+
+    def setUp(self):
+        """Start with an empty cache, and a paid subscriber with an app and parent."""
+        cache.clear()
+        self.user = UserFactory(paid_subscriber=True)
+        self.parent = UserFactory()
+        self.user.parents.add(self.parent)
+        self.app = ThirdPartyAppFactory()
+        self.subscription = SubscriptionFactory(user=self.user, app=self.app)
+
+    def get_entitlements(self, user):
+        """Return the app and actor IDs of a user's entitlements."""
+        return set(
+            AdvertEntitlement.objects.filter(user=user).values_list(
+                "app_id", "actor_id"
+            )
+        )
+
+    def test_paid_subscribers_are_entitled(self):
+        """Test a paid subscriber, their apps and their parents can create adverts."""
+        self.assertEqual(
+            self.get_entitlements(self.user),
+            {(None, None), (self.app.pk, None), (None, self.parent.pk)},
+        )
+        # The parent isn't a paid subscriber, so nobody can create adverts for them.
+        self.assertEqual(self.get_entitlements(self.parent), set())
+
+    def test_staff_are_only_entitled_to_their_own_adverts(self):
+        """Test staff that aren't paid subscribers can only create their own adverts."""
+        user = UserFactory(is_staff=True)
+        user.parents.add(self.parent)
+
+        self.assertEqual(self.get_entitlements(user), {(None, None)})
+
+    def test_entitlements_follow_changes(self):
+        """Test entitlements, and cached checks of them, are kept up to date."""
+        self.assertTrue(can_create_adverts(self.user, app=self.app))
+        self.assertTrue(can_create_adverts(self.user, actor=self.parent))
+
+        self.subscription.delete()
+        self.user.parents.remove(self.parent)
+
+        self.assertFalse(can_create_adverts(self.user, app=self.app))
+        self.assertFalse(can_create_adverts(self.user, actor=self.parent))
+
+        self.user.paid_subscriber = False
+        self.user.save()
+
+        self.assertFalse(can_create_adverts(self.user))
+
+    def test_links_entitle_users_in_both_directions(self):
+        """Test whichever end of a link was added to, each can act for the other."""
+        child = UserFactory(paid_subscriber=True)
+        parent = UserFactory(paid_subscriber=True)
+        child.parents.add(parent)
+
+        self.assertTrue(can_create_adverts(child, actor=parent))
+        self.assertTrue(can_create_adverts(parent, actor=child))
+
+        call_command("rebuild_user_closure", stdout=io.StringIO())
+        call_command("rebuild_entitlements", stdout=io.StringIO())
+
+        self.assertIn((None, parent.pk), self.get_entitlements(child))
+        self.assertIn((None, child.pk), self.get_entitlements(parent))
+
+    def test_siblings_arent_entitled_to_each_others_adverts(self):
+        """Test the entitlements built from the closure only cover direct links."""
+        sibling = UserFactory(paid_subscriber=True)
+        sibling.parents.add(self.parent)
+
+        self.assertEqual(
+            self.get_entitlements(self.user),
+            {(None, None), (self.app.pk, None), (None, self.parent.pk)},
+        )
+        self.assertEqual(
+            self.get_entitlements(sibling), {(None, None), (None, self.parent.pk)}
+        )
+        self.assertFalse(can_create_adverts(sibling, actor=self.user))
+
+    def test_moving_a_subscription_updates_both_users(self):
+        """Test the old and new users of a changed subscription are both updated."""
+        other = UserFactory(paid_subscriber=True)
+        self.subscription.user = other
+        self.subscription.save()
+
+        self.assertNotIn((self.app.pk, None), self.get_entitlements(self.user))
+        self.assertIn((self.app.pk, None), self.get_entitlements(other))
+
+    def test_rebuild_command(self):
+        """Test the command rebuilds the table from scratch."""
+        expected = self.get_entitlements(self.user)
+        AdvertEntitlement.objects.all().delete()
+
+        output = io.StringIO()
+        call_command("rebuild_entitlements", stdout=output)
+
+        self.assertEqual(self.get_entitlements(self.user), expected)
+        self.assertIn("Rebuilt 3 entitlement rows.", output.getvalue())
+
+    def test_permission_is_a_single_lookup(self):
+        """Test checking an app can create an advert is one query, then cached."""
+        self.client.credentials(HTTP_X_EXTERNAL_APP_KEY=self.app.api_key)
+        ThirdPartyAppActionPermissionFactory(
+            app=self.app, action="create", url_name="advertisement-list"
+        )
+        app_registry.clear()
+        url = reverse("advertisement-list")
+        data = {"user": self.user.username, "advertisement": "Buy it"}
+
+        for expected_lookups in (1, 0):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(url, data, format="json")
+
+            self.assertEqual(response.status_code, 201)
+            tables = [query["sql"].split(" FROM ")[-1] for query in queries]
+            lookups = [table for table in tables if "advertentitlement" in table]
+            self.assertEqual(len(lookups), expected_lookups)
+            self.assertFalse([table for table in tables if "subscription" in table])
+            self.assertFalse([table for table in tables if "userclosure" in table])
+
+
+class DispatchingAuthenticationTestCase(APITestCase):
+    """Tests for picking an authentication backend from the request's headers."""
+
+    def setUp(self):
+        """Start with an empty cache and metrics."""
+        cache.clear()
+        instrumentation.clear_stats()
+
+    def test_session_request_only_runs_session_authentication(self):
+        """Test a session user doesn't go through the JWT and app backends."""
+        self.client.force_login(UserFactory())
+
+        with mock.patch.object(
+            CachedJWTAuthentication, "authenticate"
+        ) as jwt, mock.patch.object(ThirdPartyAppAuthentication, "authenticate") as app:
+            response = self.client.get(reverse("message-list"))
+
+        self.assertEqual(response.status_code, 200)
+        jwt.assert_not_called()
+        app.assert_not_called()
+
+    def test_unknown_app_doesnt_fall_through_to_other_backends(self):
+        """Test an app request is only authenticated as an app."""
+        self.client.force_login(user := UserFactory())
+
+        response = self.client.post(
+            reverse("message-list"),
+            {"user": user.username, "message": "Hi"},
+            format="json",
+            HTTP_X_EXTERNAL_APP="Not an app",
+        )
+
+        self.assertEqual(response.status_code, 401)
+
+    def test_unauthenticated_requests_are_asked_for_a_token(self):
+        """Test a request without credentials gets a 401 asking for a JWT."""
+        response = self.client.post(reverse("message-list"), {}, format="json")
+
+        self.assertEqual(response.status_code, 401)
+        self.assertTrue(response["WWW-Authenticate"].startswith("Bearer"))
+
+    @override_settings(AUTH_DEMO_INSTRUMENTATION_SAMPLE_RATE=1)
+    def test_backend_is_recorded_in_the_metrics(self):
+        """Test the chosen backend is reported with the request's timings."""
+        user = UserFactory()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}"
+        )
+
+        response = self.client.get(reverse("message-list"))
+
+        self.assertIn('authentication;desc="jwt"', response["Server-Timing"])
+        self.assertEqual(
+            instrumentation.get_stats()["GET message-list"]["authenticators"],
+            {"jwt": 1},
+        )
+
+
+class ThirdPartyAppKeyTestCase(APITestCase):
+    """Tests for third-party apps authenticating with API keys."""
+
+    def setUp(self):
+        """Start with an empty cache, and an app that can create messages."""
+        cache.clear()
+        self.user = UserFactory()
+        self.app = ThirdPartyAppFactory()
+        ThirdPartyAppActionPermissionFactory(
+            app=self.app, action="create", url_name="message-list"
+        )
+        SubscriptionFactory(user=self.user, app=self.app)
+
+    def post_message(self, **headers):
+        """Create a message for the user as the app."""
+        return self.client.post(
+            reverse("message-list"),
+            {"user": self.user.username, "message": "Hi"},
+            format="json",
+            **headers,
+        )
+
+    def test_app_is_authenticated_without_querying_apps(self):
+        """Test an app's key is checked against the in-memory registry."""
+        self.post_message(HTTP_X_EXTERNAL_APP_KEY=self.app.api_key)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_message(HTTP_X_EXTERNAL_APP_KEY=self.app.api_key)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse([q for q in queries if "auth_demo_thirdpartyapp" in q["sql"]])
+
+    def test_unknown_key_is_rejected(self):
+        """Test a key that doesn't belong to an app is rejected."""
+        response = self.post_message(HTTP_X_EXTERNAL_APP_KEY="not-a-key")
+
+        self.assertEqual(response.status_code, 401)
+
+    def test_app_name_is_rejected_by_default(self):
+        """Test an app can't authenticate with just its name."""
+        response = self.post_message(HTTP_X_EXTERNAL_APP=self.app.app_name)
+
+        self.assertEqual(response.status_code, 401)
+
+    @override_settings(AUTH_DEMO_APP_NAME_AUTHENTICATION=True)
+    def test_app_name_can_be_allowed(self):
+        """Test app names can be turned back on while apps move over to keys."""
+        response = self.post_message(HTTP_X_EXTERNAL_APP=self.app.app_name)
+
+        self.assertEqual(response.status_code, 201)
+
+    def test_rotating_a_key_replaces_the_old_one(self):
+        """Test the command gives the app a new key, and the old one stops working."""
+        output = io.StringIO()
+        call_command("rotate_app_key", self.app.app_name, stdout=output)
+        new_key = output.getvalue().strip()
+
+        old = self.post_message(HTTP_X_EXTERNAL_APP_KEY=self.app.api_key)
+        new = self.post_message(HTTP_X_EXTERNAL_APP_KEY=new_key)
+
+        self.assertEqual(old.status_code, 401)
+        self.assertEqual(new.status_code, 201)
+
+
+@override_settings(AUTH_DEMO_USER_THROTTLE_BURST=3, AUTH_DEMO_APP_THROTTLE_BURST=3)
+class ThrottleTestCase(APITestCase):
+    """Tests for the per-app and per-user rate limits."""
+
+    def setUp(self):
+        """Start with full buckets, and an app that can create messages."""
+        cache.clear()
+        get_backend().clear()
+        # IDs get reused between tests, so don't leave empty buckets behind.
+        self.addCleanup(get_backend().clear)
+        self.user = UserFactory(paid_subscriber=True)
+        self.app = ThirdPartyAppFactory()
+        ThirdPartyAppActionPermissionFactory(
+            app=self.app, action="create", url_name="message-list"
+        )
+        SubscriptionFactory(user=self.user, app=self.app)
+
+    def post_message(self):
+        """Create a message for the user as the app."""
+        return self.client.post(
+            reverse("message-list"),
+            {"user": self.user.username, "message": "Hi"},
+            format="json",
+            HTTP_X_EXTERNAL_APP_KEY=self.app.api_key,
+        )
+
+    def test_user_is_throttled_after_burst(self):
+        """Test a user gets a 429 with a Retry-After once their burst is used up."""
+        self.client.force_login(self.user)
+
+        statuses = [
+            self.client.get(reverse("message-list")).status_code for _ in range(3)
+        ]
+        response = self.client.get(reverse("message-list"))
+
+        self.assertEqual(statuses, [200] * 3)
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response["Retry-After"]), 1)
+
+    def test_users_have_separate_buckets(self):
+        """Test one user using up their burst doesn't throttle another."""
+        self.client.force_login(self.user)
+        for _ in range(4):
+            self.client.get(reverse("message-list"))
+
+        self.client.force_login(UserFactory())
+        response = self.client.get(reverse("message-list"))
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_app_limits_override_defaults(self):
+        """Test an app's own burst is used instead of the default."""
+        self.app.throttle_burst = 5
+        self.app.save()
+
+        statuses = [self.post_message().status_code for _ in range(6)]
+
+        self.assertEqual(statuses, [201] * 5 + [429])
+
+    def test_throttled_requests_skip_permissions(self):
+        """Test a throttled request is turned away before checking permissions."""
+        for _ in range(3):
+            self.post_message()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_message()
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(len(queries), 0)
+
+
+class ConstraintTestCase(TestCase):
+    """Tests for the uniqueness of apps, their permissions and subscriptions."""
+
+    def setUp(self):
+        """Start with an app with a permission and a subscriber."""
+        self.app = ThirdPartyAppFactory()
+        self.permission = ThirdPartyAppActionPermissionFactory(
+            app=self.app, action="create", url_name="message-list"
+        )
+        self.subscription = SubscriptionFactory(app=self.app)
+
+    def test_app_names_are_unique(self):
+        """Test two apps can't share a name."""
+        with self.assertRaises(IntegrityError):
+            ThirdPartyAppFactory(app_name=self.app.app_name)
+
+    def test_permissions_are_unique(self):
+        """Test an app can't be given the same permission twice."""
+        with self.assertRaises(IntegrityError):
+            ThirdPartyAppActionPermissionFactory(
+                app=self.app, action="create", url_name="message-list"
+            )
+
+    def test_subscriptions_are_unique(self):
+        """Test a user can't subscribe to the same app twice."""
+        with self.assertRaises(IntegrityError):
+            SubscriptionFactory(app=self.app, user=self.subscription.user)
+
+
+@skipUnless(connection.vendor == "postgresql", "Query plans are checked on Postgres.")
+class QueryPlanTestCase(TestCase):
+    """Tests that the permission layer's lookups are served by indexes."""
+
+    def setUp(self):
+        """Create some rows to look up, and rule out sequential scans if possible."""
+        self.user = UserFactory()
+        self.app = ThirdPartyAppFactory()
+        ThirdPartyAppActionPermissionFactory(
+            app=self.app, action="create", url_name="message-list"
+        )
+        SubscriptionFactory(user=self.user, app=self.app)
+
+        # The tables are far too small for the planner to pick an index on its own,
+        # so make sequential scans a last resort, used only when there's no index.
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def assertUsesIndex(
+        self, queryset, index_name=None
+    ):  # pylint: disable=invalid-name
+        """Check a queryset's plan uses an index, and not a sequential scan."""
+        plan = queryset.explain()
+
+        self.assertNotIn("Seq Scan", plan)
+        self.assertIn("Index", plan)
+        if index_name is not None:
+            self.assertIn(index_name, plan)
+
+    def test_user_lookup_uses_index(self):
+        """Test users are found by username through an index."""
+        self.assertUsesIndex(User.objects.filter(username__in=[self.user.username]))
+
+    def test_app_lookups_use_indexes(self):
+        """Test apps are found by name and by key through indexes."""
+        self.assertUsesIndex(ThirdPartyApp.objects.filter(app_name=self.app.app_name))
+        self.assertUsesIndex(
+            ThirdPartyApp.objects.filter(api_key_digest=self.app.api_key_digest)
+        )
+
+    def test_permission_lookup_uses_index(self):
+        """Test an app's permission is found through the unique constraint."""
+        self.assertUsesIndex(
+            self.app.allowed_actions.filter(action="create", url_name="message-list"),
+            "unique_app_action_permission",
+        )
+
+    def test_subscription_lookup_uses_index(self):
+        """Test the subscriptions prefetched for an app's request use an index."""
+        self.assertUsesIndex(
+            Subscription.objects.filter(app=self.app, user__in=[self.user.pk]),
+            "unique_subscription",
+        )
+
+    def test_delegate_lookup_uses_index(self):
+        """Test checking for a delegate uses the closure's unique constraint."""
+        self.assertUsesIndex(
+            UserClosure.objects.filter(
+                ancestor_id=self.user.pk, descendant_id=self.user.pk, depth__lte=1
+            ),
+            "unique_user_closure",
+        )
+
+
+class SubscriberIndexTestCase(TestCase):
+    """Tests for the in-memory index of app subscribers."""
+
+    def setUp(self):
+        """Start with an empty index, and an app with a subscriber."""
+        cache.clear()
+        self.user = UserFactory()
+        self.app = ThirdPartyAppFactory()
+        with self.captureOnCommitCallbacks(execute=True):
+            SubscriptionFactory(user=self.user, app=self.app)
+
+    def test_subscribers_are_checked_in_memory(self):
+        """Test an app's subscribers are loaded once, then checked without queries."""
+        other = UserFactory()
+        subscriber_index.get(self.app.pk)
+
+        with self.assertNumQueries(0):
+            subscribers = subscriber_index.get(self.app.pk)
+            self.assertIn(self.user.pk, subscribers)
+            self.assertNotIn(other.pk, subscribers)
+
+    def test_committed_changes_are_applied_in_place(self):
+        """Test this process applies its own changes without reloading the app."""
+        other = UserFactory()
+        subscriber_index.get(self.app.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            SubscriptionFactory(user=other, app=self.app)
+            self.user.subscriptions.all().delete()
+
+        with self.assertNumQueries(0):
+            subscribers = subscriber_index.get(self.app.pk)
+            self.assertIn(other.pk, subscribers)
+            self.assertNotIn(self.user.pk, subscribers)
+
+    def test_other_processes_reload_changed_apps(self):
+        """Test an index that didn't make a change reloads the app."""
+        elsewhere = SubscriberIndex()
+        other = UserFactory()
+        elsewhere.get(self.app.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            SubscriptionFactory(user=other, app=self.app)
+
+        with self.assertNumQueries(1):
+            self.assertIn(other.pk, elsewhere.get(self.app.pk))
+
+    def test_uncommitted_changes_are_checked_in_the_database(self):
+        """Test a change that hasn't been committed isn't put in the index."""
+        other = UserFactory()
+        SubscriptionFactory(user=other, app=self.app)
+
+        self.assertIn(other.pk, subscriber_index.get(self.app.pk))
+        self.assertNotIn(self.app.pk, subscriber_index.get_stats()["apps"])
+
+    def test_rolled_back_changes_are_forgotten(self):
+        """Test the index goes back to memory once a change is rolled back."""
+        subscriber_index.get(self.app.pk)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            SubscriptionFactory(user=UserFactory(), app=self.app)
+            self.assertTrue(subscriber_index.is_changing(self.app.pk))
+            raise IntegrityError
+
+        self.assertFalse(subscriber_index.is_changing(self.app.pk))
+        with self.assertNumQueries(0):
+            self.assertIn(self.user.pk, subscriber_index.get(self.app.pk))
+
+    @override_settings(AUTH_DEMO_SUBSCRIBER_INDEX_MAX_BYTES=0)
+    def test_apps_over_the_memory_cap_are_checked_in_the_database(self):
+        """Test an app too big for the index is checked with a query instead."""
+        subscribers = subscriber_index.get(self.app.pk)
+
+        with self.assertNumQueries(1):
+            self.assertIn(self.user.pk, subscribers)
+        self.assertEqual(subscriber_index.get_stats()["bytes"], 0)
+
+    def test_memory_use_is_reported(self):
+        """Test the index reports how each app is held, and its size."""
+        subscriber_index.get(self.app.pk)
+
+        stats = subscriber_index.get_stats()["apps"][self.app.pk]
+
+        self.assertEqual(stats["subscribers"], 1)
+        self.assertGreater(stats["bytes"], 0)
+
+    def test_subscribers_are_held_compactly(self):
+        """Test dense subscribers are held in a bitmap and sparse ones in a set."""
+        dense = _build_subscribers(range(1, 100001))
+        sparse = _build_subscribers([1, 10**9])
+
+        self.assertEqual(dense.format, "bitmap")
+        self.assertLess(dense.nbytes, 13000)
+        self.assertEqual(len(dense), 100000)
+        self.assertIn(100000, dense)
+        self.assertNotIn(100001, dense)
+        self.assertEqual(sparse.format, "set")
+        self.assertIn(10**9, sparse)
+
+    def test_app_requests_dont_query_subscriptions(self):
+        """Test an app creating a message checks the subscription in memory."""
+        ThirdPartyAppActionPermissionFactory(
+            app=self.app, action="create", url_name="message-list"
+        )
+        subscriber_index.get(self.app.pk)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse("message-list"),
+                {"user": self.user.username, "message": "Hi"},
+                content_type="application/json",
+                HTTP_X_EXTERNAL_APP_KEY=self.app.api_key,
+            )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse([q for q in queries if "auth_demo_subscription" in q["sql"]])
+
+
+@override_settings(AUTH_DEMO_REPLICA_DATABASES=["replica_0"])
+class ReplicaRoutingTestCase(TransactionTestCase):
+    """Tests for sending reads to read replicas."""
+
+    def setUp(self):
+        """Record where reads are routed, while still running them on the default."""
+        cache.clear()
+        self.reads = []
+        db_for_read = ReplicaRouter.db_for_read
+
+        def record_read(model, **hints):
+            self.reads.append((model, db_for_read(model, **hints)))
+
+        patcher = mock.patch.object(
+            ReplicaRouter, "db_for_read", staticmethod(record_read)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = UserFactory()
+        self.client.force_login(self.user)
+
+    def replica_reads(self):
+        """Return the models that were read from the replica."""
+        return {model for model, alias in self.reads if alias == "replica_0"}
+
+    @override_settings(AUTH_DEMO_REPLICA_PIN_SECONDS=0)
+    def test_lists_are_read_from_a_replica(self):
+        """Test a list that hasn't changed recently is read from a replica."""
+        MessageFactory(user=self.user)
+
+        response = self.client.get(reverse("message-list"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(Message, self.replica_reads())
+
+    def test_recently_changed_lists_are_read_from_the_primary(self):
+        """Test a list whose rows just changed isn't read from a replica."""
+        MessageFactory(user=self.user)
+
+        self.client.get(reverse("message-list"))
+
+        self.assertEqual(self.replica_reads(), set())
+
+    def test_exports_are_read_from_a_replica(self):
+        """Test an export's rows are read from a replica."""
+        response = self.client.get(reverse("message-export"))
+        b"".join(response.streaming_content)
+
+        self.assertIn(Message, self.replica_reads())
+
+    def test_writes_pin_the_caller_to_the_primary(self):
+        """Test a caller reads from the primary just after writing something."""
+        self.client.post(
+            reverse("message-list"),
+            {"user": self.user.username, "message": "Hi"},
+            format="json",
+        )
+        self.reads.clear()
+
+        response = self.client.get(reverse("message-export"))
+        b"".join(response.streaming_content)
+
+        self.assertEqual(self.replica_reads(), set())
+
+    def test_permission_lookups_are_read_from_a_replica(self):
+        """Test the user a message is created for is looked up on a replica."""
+        child = UserFactory()
+        child.parents.add(self.user)
+
+        response = self.client.post(
+            reverse("message-list"),
+            {"user": child.username, "message": "Hi"},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 201)
+        # The user's snapshot carries their parents, so there's no closure lookup.
+        self.assertIn(User, self.replica_reads())
+        self.assertEqual(Message.objects.filter(user=child).count(), 1)
+
+    @override_settings(AUTH_DEMO_REPLICA_DATABASES=[])
+    def test_reads_stay_on_the_primary_without_replicas(self):
+        """Test nothing is routed anywhere when there are no replicas."""
+        response = self.client.get(reverse("message-export"))
+        b"".join(response.streaming_content)
+
+        self.assertEqual({alias for _, alias in self.reads}, {None})
+
+
+class ConnectionPoolTestCase(SimpleTestCase):
+    """Tests for the database connection pool."""
+
+    @staticmethod
+    def create_pool(**kwargs):
+        """Create a pool of in-memory SQLite connections."""
+        return ConnectionPool(
+            lambda: sqlite3.connect(":memory:", check_same_thread=False), **kwargs
+        )
+
+    def test_connections_are_reused(self):
+        """Test a returned connection is handed out again."""
+        pool = self.create_pool()
+        connection_ = pool.checkout()
+        pool.checkin(connection_)
+
+        self.assertIs(pool.checkout(), connection_)
+        self.assertEqual(pool.get_stats()["opened"], 1)
+
+    def test_checkout_times_out_when_every_connection_is_in_use(self):
+        """Test no more than the size and overflow are ever open at once."""
+        pool = self.create_pool(size=1, max_overflow=1, timeout=0.01)
+        pool.checkout()
+        pool.checkout()
+
+        with self.assertRaises(OperationalError):
+            pool.checkout()
+        self.assertEqual(pool.get_stats()["timeouts"], 1)
+
+    def test_waiting_checkout_gets_a_returned_connection(self):
+        """Test a checkout waits for a connection to come free."""
+        pool = self.create_pool(size=1, max_overflow=0, timeout=5)
+        connection_ = pool.checkout()
+        waited_for = []
+
+        waiter = threading.Thread(target=lambda: waited_for.append(pool.checkout()))
+        waiter.start()
+        pool.checkin(connection_)
+        waiter.join()
+
+        self.assertEqual(waited_for, [connection_])
+
+    def test_overflow_connections_are_closed_when_returned(self):
+        """Test only `size` connections are kept idle."""
+        pool = self.create_pool(size=1, max_overflow=1)
+        first, second = pool.checkout(), pool.checkout()
+        pool.checkin(first)
+        pool.checkin(second)
+
+        self.assertEqual(pool.get_stats()["idle"], 1)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            second.execute("SELECT 1")
+
+    def test_unusable_connections_are_replaced(self):
+        """Test connections that are broken, or returned unusable, aren't reused."""
+        pool = self.create_pool(ping_after=0)
+        broken = pool.checkout()
+        pool.checkin(broken)
+        broken.close()
+        unusable = pool.checkout()
+        pool.checkin(unusable, reusable=False)
+
+        connection_ = pool.checkout()
+
+        self.assertIsNot(connection_, broken)
+        self.assertIsNot(connection_, unusable)
+        self.assertEqual(pool.get_stats()["opened"], 3)
+
+    def test_old_connections_are_recycled(self):
+        """Test connections past their lifetime are closed rather than reused."""
+        pool = self.create_pool(recycle=0)
+        connection_ = pool.checkout()
+        pool.checkin(connection_)
+
+        self.assertIsNot(pool.checkout(), connection_)
+
+
+class StaticSchemaTestCase(SimpleTestCase):
+    """Tests for the pre-generated OpenAPI schema."""
+
+    def setUp(self):
+        """Collect static files into a temporary directory."""
+        self.static_root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.static_root)
+
+        settings_override = override_settings(STATIC_ROOT=str(self.static_root))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_swagger_ui_falls_back_to_dynamic_schema(self):
+        """Test the Swagger UI loads the schema view if it hasn't been generated."""
+        response = self.client.get(reverse("swagger-ui"))
+
+        self.assertContains(response, f'"{reverse("schema")}"')
+
+    def test_generated_schema_matches_dynamic_schema(self):
+        """Test the generated schema is what the schema view serves."""
+        call_command("generate_schema", stdout=io.StringIO())
+
+        path = self.static_root / "schema" / "openapi.yaml"
+        self.assertEqual(path.read_bytes(), self.client.get(reverse("schema")).content)
+        self.assertTrue(path.with_name("openapi.yaml.gz").exists())
+        self.assertContains(
+            self.client.get(reverse("swagger-ui")), '"/static/schema/openapi.yaml"'
+        )
+
+    def test_generated_schema_is_served_compressed_with_etag(self):
+        """Test whitenoise serves the generated schema compressed and with an ETag."""
+        call_command("generate_schema", stdout=io.StringIO())
+        # Whitenoise finds its files when it starts, so it needs a new client.
+        client = Client()
+
+        response = client.get(
+            "/static/schema/openapi.yaml", HTTP_ACCEPT_ENCODING="gzip"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(
+            gzip.decompress(b"".join(response.streaming_content)),
+            (self.static_root / "schema" / "openapi.yaml").read_bytes(),
+        )
+
+        response = client.get(
+            "/static/schema/openapi.yaml", HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(response.status_code, 304)
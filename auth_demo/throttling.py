@@ -0,0 +1,190 @@
+"""
+Token bucket rate limiting for third-party apps and users.
+
+Each app or user has a bucket of up to `burst` tokens, refilled at `rate` tokens
+a minute, and every request takes one. Buckets live in a backend with an atomic
+`consume` operation: `LocalTokenBucketBackend` for a single process, or
+`RedisTokenBucketBackend` to share them between processes.
+"""
+
+import functools
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+from rest_framework.throttling import BaseThrottle
+
+from auth_demo.models import ThirdPartyApp
+
+
+class LocalTokenBucketBackend:
+    """Token buckets held in this process's memory."""
+
+    def __init__(self, _location=""):
+        """Start with no buckets."""
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    def consume(self, key, rate, burst):
+        """
+        Take a token from a bucket.
+
+        `rate` is in tokens per second. Returns whether there was a token to take,
+        and if not, how many seconds until there will be.
+        """
+        now = time.monotonic()
+
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+
+            if tokens >= 1:
+                self.buckets[key] = (tokens - 1, now)
+                return True, 0.0
+
+            self.buckets[key] = (tokens, now)
+            return False, (1 - tokens) / rate
+
+    def clear(self):
+        """Empty every bucket."""
+        with self.lock:
+            self.buckets = {}
+
+
+# Refill and take a token from a bucket, atomically. The bucket is a hash of its
+# tokens and when they were last updated, by the server's clock.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated")
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+
+local allowed = 0
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    wait = (1 - tokens) / rate
+end
+
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "updated", tostring(now))
+redis.call("EXPIRE", KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(wait)}
+"""
+
+
+class RedisTokenBucketBackend:
+    """Token buckets shared between processes in Redis, or anything that speaks it."""
+
+    key_prefix = "auth_demo:throttle:"
+
+    def __init__(self, location):
+        """Connect to the Redis server at the URL `location`."""
+        try:
+            # pylint: disable=import-outside-toplevel
+            import redis
+        except ImportError as exc:
+            raise ImproperlyConfigured(
+                "The redis package is needed for RedisTokenBucketBackend."
+            ) from exc
+
+        self.client = redis.Redis.from_url(location)
+        self.script = self.client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def consume(self, key, rate, burst):
+        """Take a token from a bucket, as with `LocalTokenBucketBackend.consume`."""
+        allowed, wait = self.script(keys=[self.key_prefix + key], args=[rate, burst])
+        return bool(allowed), float(wait)
+
+    def clear(self):
+        """Empty every bucket."""
+        keys = self.client.scan_iter(match=f"{self.key_prefix}*", count=1000)
+        for key in keys:
+            self.client.delete(key)
+
+
+@functools.lru_cache(maxsize=None)
+def _load_backend(path, location):
+    """Create a backend, once for each configuration."""
+    return import_string(path)(location)
+
+
+def get_backend():
+    """Return the configured token bucket backend."""
+    return _load_backend(
+        settings.AUTH_DEMO_THROTTLE_BACKEND, settings.AUTH_DEMO_THROTTLE_LOCATION
+    )
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Base class for token bucket throttles.
+
+    Subclasses pick out the bucket a request draws from and its limits. Everything
+    they need has already been loaded by authentication, so checking a throttle
+    doesn't touch the database.
+    """
+
+    def __init__(self):
+        """Start with nothing to wait for."""
+        self.wait_time = None
+
+    def get_bucket(self, request):
+        """Return the bucket's key, rate per minute and burst, or `None` to skip."""
+        raise NotImplementedError(".get_bucket() must be overridden.")
+
+    def allow_request(self, request, view):
+        """Take a token from the request's bucket, if it has one."""
+        if (bucket := self.get_bucket(request)) is None:
+            return True
+
+        key, rate, burst = bucket
+        if not rate or not burst:
+            return True
+
+        allowed, wait_time = get_backend().consume(key, rate / 60, burst)
+        self.wait_time = None if allowed else math.ceil(wait_time)
+        return allowed
+
+    def wait(self):
+        """Return how long to wait before trying again, in seconds."""
+        return self.wait_time
+
+
+class AppRateThrottle(TokenBucketThrottle):
+    """Limit the rate of requests from each third-party app."""
+
+    def get_bucket(self, request):
+        """Use the app's own limits, or the defaults if it doesn't have any."""
+        if not isinstance(app := request.auth, ThirdPartyApp):
+            return None
+
+        return (
+            f"app:{app.pk}",
+            app.throttle_rate or settings.AUTH_DEMO_APP_THROTTLE_RATE,
+            app.throttle_burst or settings.AUTH_DEMO_APP_THROTTLE_BURST,
+        )
+
+
+class UserRateThrottle(TokenBucketThrottle):
+    """Limit the rate of requests from each user."""
+
+    def get_bucket(self, request):
+        """Use the user limits, for authenticated users."""
+        if not (request.user and request.user.is_authenticated):
+            return None
+
+        return (
+            f"user:{request.user.pk}",
+            settings.AUTH_DEMO_USER_THROTTLE_RATE,
+            settings.AUTH_DEMO_USER_THROTTLE_BURST,
+        )
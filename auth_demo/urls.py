@@ -1,10 +1,14 @@
 """URLs for our auth app."""
 
-from rest_framework import routers
+from django.urls import path
 
-from auth_demo.views import AdvertisementViewSet, MessageViewSet
+from auth_demo.asynchronous import AsyncRouter
+from auth_demo.views import AdvertisementViewSet, MessageViewSet, MetricsView
 
-router = routers.SimpleRouter()
+router = AsyncRouter()
 router.register("advertisements", AdvertisementViewSet)
 router.register("messages", MessageViewSet)
-urlpatterns = router.urls
+urlpatterns = [
+    path("metrics/", MetricsView.as_view(), name="metrics"),
+    *router.urls,
+]
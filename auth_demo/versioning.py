@@ -0,0 +1,50 @@
+"""Shared version stamps used to invalidate caches across worker processes."""
+
+import time
+import uuid
+from collections import namedtuple
+
+from django.core.cache import cache
+
+VERSION_KEY_PREFIX = "auth_demo:version:"
+
+# A version's `token` changes every time it's bumped, `modified` is when that was.
+Version = namedtuple("Version", ("token", "modified"))
+
+
+def _new_version():
+    """Mint a new, unique version."""
+    return Version(uuid.uuid4().hex, time.time())
+
+
+def get_version(name):
+    """Return the current version for `name`, minting one if there isn't one."""
+    key = VERSION_KEY_PREFIX + name
+    if (version := cache.get(key)) is None:
+        # Another worker may be minting one at the same time, whichever lands first
+        # wins.
+        cache.add(key, _new_version(), None)
+        version = cache.get(key, _new_version())
+
+    return version
+
+
+def bump_version(name):
+    """Give `name` a new version, invalidating anything cached against it."""
+    version = _new_version()
+    cache.set(VERSION_KEY_PREFIX + name, version, None)
+    return version
+
+
+def table_version_name(model, user_id=None):
+    """Return the version name for a model's table, or one user's rows in it."""
+    name = f"table:{model._meta.label_lower}"
+    return name if user_id is None else f"{name}:user:{user_id}"
+
+
+def bump_table_versions(model, user_ids):
+    """Bump the versions for a model's table and the given users' rows in it."""
+    names = [table_version_name(model)]
+    names.extend(table_version_name(model, user_id) for user_id in set(user_ids))
+
+    cache.set_many({VERSION_KEY_PREFIX + name: _new_version() for name in names}, None)
@@ -1,19 +1,93 @@
 """Auth app views."""
 
-from drf_spectacular.utils import extend_schema, extend_schema_view, inline_serializer
-from rest_framework import fields, mixins, viewsets
+import hashlib
 
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import (
+    OpenApiParameter,
+    extend_schema,
+    extend_schema_view,
+    inline_serializer,
+)
+from rest_framework import exceptions, fields, mixins, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.permissions import SAFE_METHODS, IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from auth_demo import instrumentation, list_cache, pool
+from auth_demo.export import EXPORT_FORMATS
 from auth_demo.models import Advertisement, Message
 from auth_demo.permissions import (
     AuthenticatedOrThirdPartyAppPermission,
     HasCreatePermission,
     RequiresPremiumSubscriptionPermission,
+    TargetUserPermission,
 )
+from auth_demo.replicas import is_recent, pin, reading_from_replica
+from auth_demo.resolvers import resolve_users
 from auth_demo.serialisers import (
     AdvertisementSerialiser,
     MessageSerialiser,
     UserSerialiser,
 )
+from auth_demo.subscribers import subscriber_index
+from auth_demo.versioning import bump_table_versions, get_version, table_version_name
+
+
+class InstrumentedViewMixin:
+    """A mixin to record the queries and time spent in each part of a request."""
+
+    def dispatch(self, request, *args, **kwargs):
+        """Handle the request, recording its queries if it's being sampled."""
+        # Under ASGI the view runs on a different thread to the middleware, so
+        # the queries need recording from here.
+        with instrumentation.recording_queries(request):
+            return super().dispatch(request, *args, **kwargs)
+
+    def perform_authentication(self, request):
+        """Authenticate the request."""
+        with instrumentation.measure(request, "authentication"):
+            super().perform_authentication(request)
+
+    def check_permissions(self, request):
+        """Check the request's permissions."""
+        with instrumentation.measure(request, "permissions"):
+            super().check_permissions(request)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        """Render the response now, if the request is sampled, to time it."""
+        response = super().finalize_response(request, response, *args, **kwargs)
+
+        if instrumentation.get_metrics(request) is not None and callable(
+            getattr(response, "render", None)
+        ):
+            with instrumentation.measure(request, "rendering"):
+                response.render()
+
+        return response
+
+
+class ThrottleFirstMixin:
+    """
+    A mixin to check throttles before permissions.
+
+    DRF checks permissions first, which for the create endpoints means looking up
+    users and their subscriptions. A throttled client shouldn't cost us that.
+    """
+
+    def check_permissions(self, request):
+        """Check the request's throttles, then its permissions."""
+        super().check_throttles(request)
+        super().check_permissions(request)
+
+    def check_throttles(self, request):
+        """Do nothing, the throttles were checked along with the permissions."""
 
 
 class AuthenticationPermissionForCreateMixin:
@@ -21,41 +95,449 @@ class AuthenticationPermissionForCreateMixin:
 
     def get_permissions(self):
         """Instantiate and return the list of permissions that this view requires."""
-        if self.action == "create":
-            self.permission_classes = [
-                AuthenticatedOrThirdPartyAppPermission,
-                *self.permission_classes,
+        permissions = super().get_permissions()
+
+        if self.action in ("create", "bulk_create"):
+            permissions.insert(0, AuthenticatedOrThirdPartyAppPermission())
+
+        return permissions
+
+
+def _bulk_insert(model, instances):
+    """
+    Insert the given objects in bulk, setting each one's primary key.
+
+    Backends that can return the inserted rows, like PostgreSQL, set the keys
+    themselves. SQLite can't, but only lets one transaction write at a time, so
+    the newest rows are ours. Other backends leave the keys unset, as there's no
+    telling which rows are ours.
+    """
+    connection = connections[db := router.db_for_write(model)]
+    with transaction.atomic(using=db):
+        model.objects.using(db).bulk_create(instances)
+
+        if (
+            instances
+            and not connection.features.can_return_rows_from_bulk_insert
+            and connection.vendor == "sqlite"
+        ):
+            ids = list(
+                model.objects.using(db)
+                .order_by("-id")
+                .values_list("id", flat=True)[: len(instances)]
+            )
+            for instance, pk in zip(instances, reversed(ids)):
+                instance.pk = pk
+
+
+class BulkCreateMixin:
+    """
+    A mixin to create a batch of objects in one request.
+
+    Every user named in the batch is looked up in a single query, and the view's
+    permissions are checked once per distinct user. Valid, permitted objects are
+    inserted together with `bulk_create`. Each item gets its own result, so one bad
+    item doesn't fail the whole batch.
+    """
+
+    def check_user_permissions(self, request, for_user):
+        """Check if the request can create objects for `for_user`."""
+        return all(
+            permission.has_user_permission(request, self, for_user)
+            for permission in self.get_permissions()
+            if isinstance(permission, TargetUserPermission)
+        )
+
+    @action(detail=False, methods=["post"], url_path="bulk", url_name="bulk-create")
+    def bulk_create(self, request):
+        """Create a batch of objects."""
+        if not isinstance(items := request.data, list):
+            raise exceptions.ValidationError("Expected a list of items.")
+
+        if len(items) > (max_items := settings.AUTH_DEMO_BULK_CREATE_MAX_ITEMS):
+            raise exceptions.ValidationError(
+                f"A batch can't contain more than {max_items} items."
+            )
+
+        with reading_from_replica(request):
+            users = resolve_users(
+                request, [item.get("user") for item in items if isinstance(item, dict)]
+            )
+            allowed = {
+                user.pk: self.check_user_permissions(request, user)
+                for user in users.values()
+            }
+
+        serialiser_class = self.get_serializer_class()
+        context = self.get_serializer_context()
+        results = []
+        created = []
+
+        for item in items:
+            serialiser = serialiser_class(data=item, context=context)
+
+            if not serialiser.is_valid():
+                results.append(
+                    {"status": status.HTTP_400_BAD_REQUEST, "errors": serialiser.errors}
+                )
+            elif not allowed.get(serialiser.validated_data["user"].pk):
+                results.append(
+                    {
+                        "status": status.HTTP_403_FORBIDDEN,
+                        "errors": {
+                            "detail": exceptions.PermissionDenied.default_detail
+                        },
+                    }
+                )
+            else:
+                results.append({"status": status.HTTP_201_CREATED})
+                created.append(
+                    (
+                        results[-1],
+                        serialiser,
+                        serialiser_class.Meta.model(**serialiser.validated_data),
+                    )
+                )
+
+        instances = [instance for _, _, instance in created]
+        _bulk_insert(serialiser_class.Meta.model, instances)
+        # `bulk_create` doesn't send `post_save`, so bump the list versions here.
+        if created:
+            bump_table_versions(
+                serialiser_class.Meta.model,
+                [instance.user_id for instance in instances],
+            )
+        for result, serialiser, instance in created:
+            result["data"] = serialiser.to_representation(instance)
+
+        return Response(results)
+
+
+class EagerLoadingMixin:
+    """A mixin to load whatever related objects the serialiser is going to need."""
+
+    def get_queryset(self):
+        """Let the serialiser class prepare the queryset, if it knows how."""
+        queryset = super().get_queryset()
+
+        if setup := getattr(self.get_serializer_class(), "setup_eager_loading", None):
+            queryset = setup(queryset)
+
+        return queryset
+
+
+class ValuesListMixin:
+    """
+    A mixin to build list pages straight from `.values()` rows.
+
+    Serialisers that can represent an object from its row, with `represent_values`,
+    skip creating model instances and running each field's `to_representation`.
+    The row's columns, including the user's, are read in one query. The output is
+    the same as the serialiser's, so this can be turned off with
+    `AUTH_DEMO_VALUES_LISTS` without clients noticing.
+    """
+
+    def list(self, request, *args, **kwargs):
+        """List the objects from their rows, if the serialiser knows how."""
+        serialiser_class = self.get_serializer_class()
+        if not (
+            settings.AUTH_DEMO_VALUES_LISTS
+            and hasattr(serialiser_class, "represent_values")
+        ):
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset()).values(
+            *serialiser_class.get_values_fields()
+        )
+        page = self.paginate_queryset(queryset)
+
+        with instrumentation.measure(request, "serialisation"):
+            data = [
+                serialiser_class.represent_values(row)
+                for row in (queryset if page is None else page)
             ]
 
-        return super().get_permissions()
+        if page is None:
+            return Response(data)
+
+        return self.get_paginated_response(data)
+
+
+def _get_int_param(request, name):
+    """Return the named query parameter as an integer, or `None` if it's not given."""
+    if not (value := request.query_params.get(name)):
+        return None
+
+    try:
+        return int(value)
+    except ValueError:
+        raise exceptions.ValidationError(
+            {name: "A valid integer is required."}
+        ) from None
+
+
+class UserFilterMixin:
+    """A mixin to narrow a list down to one user's objects with `?user=<id>`."""
+
+    def get_queryset(self):
+        """Filter the queryset by the requested user, if there is one."""
+        queryset = super().get_queryset()
+
+        if (
+            self.action in ("list", "export")
+            and (user_id := _get_int_param(self.request, "user")) is not None
+        ):
+            queryset = queryset.filter(user_id=user_id)
+
+        return queryset
+
+
+class ListVersionMixin:
+    """A mixin to look up the version of the rows a list request covers."""
+
+    def get_list_version(self):
+        """Return the version of the table, or of the filtered user's rows in it."""
+        if not hasattr(self, "_list_version"):
+            self._list_version = get_version(
+                table_version_name(
+                    self.get_queryset().model, _get_int_param(self.request, "user")
+                )
+            )
+
+        return self._list_version
+
+
+class ReplicaReadsMixin(ListVersionMixin):
+    """
+    A mixin to serve lists and exports from a read replica.
+
+    A list whose rows changed within the last `AUTH_DEMO_REPLICA_PIN_SECONDS` is
+    read from the primary, so a replica that hasn't caught up yet can't have its
+    page cached, or given an ETag, as the latest version. Successful writes pin
+    their caller to the primary for the same window.
+    """
+
+    def list(self, request, *args, **kwargs):
+        """List the objects, from a replica if they haven't changed recently."""
+        if is_recent(self.get_list_version()):
+            return super().list(request, *args, **kwargs)
+
+        with reading_from_replica(request):
+            return super().list(request, *args, **kwargs)
+
+    def get_queryset(self):
+        """Read exports from a replica."""
+        queryset = super().get_queryset()
+
+        if self.action == "export":
+            # The rows are read as the response streams, after the view has
+            # returned, so pick the database now.
+            with reading_from_replica(self.request):
+                queryset = queryset.using(queryset.db)
+
+        return queryset
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        """Pin the caller to the primary after a successful write."""
+        if request.method not in SAFE_METHODS and status.is_success(
+            response.status_code
+        ):
+            pin(request)
+
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class ConditionalListMixin(ListVersionMixin):
+    """
+    A mixin to answer a repeated list request with `304 Not Modified`.
+
+    The list's ETag and Last-Modified come from the version of the table, or of the
+    filtered user's rows in it, which is bumped whenever one of its objects, or a
+    user listed with them, is saved or deleted. An unchanged list is answered
+    without querying or serialising a single row.
+    """
+
+    def list(self, request, *args, **kwargs):
+        """List the objects, unless the client's copy is still current."""
+        version = self.get_list_version()
+
+        # The page and its links depend on the URL, and its body on the renderer.
+        key = f"{version.token}:{request.accepted_media_type}:"
+        key += request.build_absolute_uri()
+        etag = quote_etag(hashlib.md5(key.encode()).hexdigest())
+        last_modified = int(version.modified)
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = super().list(request, *args, **kwargs)
+
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response["ETag"] = etag
+            response["Last-Modified"] = http_date(last_modified)
+            # Let clients keep a copy, but have them check it's current each time.
+            patch_cache_control(response, private=True, no_cache=True)
+
+        return response
+
+
+class CachedListMixin(ListVersionMixin):
+    """
+    A mixin to cache serialised list pages.
+
+    Pages are cached against the version of the rows they cover, so saving or
+    deleting an object moves the list on to a new generation of pages.
+    """
+
+    def list(self, request, *args, **kwargs):
+        """List the objects from the cache, if the page is there."""
+        if not settings.AUTH_DEMO_LIST_CACHE_TIMEOUT:
+            return super().list(request, *args, **kwargs)
+
+        model = self.get_queryset().model
+        version = self.get_list_version()
+        url = request.build_absolute_uri()
+
+        if (data := list_cache.get_page(model, version, url)) is not None:
+            response = Response(data)
+            response["X-Cache"] = "HIT"
+            return response
+
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            list_cache.set_page(version, url, response.data)
+
+        response["X-Cache"] = "MISS"
+        return response
+
+
+class ExportMixin:
+    """
+    A mixin to stream every object out as NDJSON or CSV.
+
+    Rows are read from a server-side cursor and encoded straight from
+    `values_list()` tuples rather than going through a serialiser, so memory use
+    stays flat however big the table gets.
+    """
+
+    # Maps each exported column to the field it's read from.
+    export_columns = {}
+
+    @action(detail=False, methods=["get"])
+    def export(self, request):
+        """Stream the objects out in the requested format."""
+        export_format = request.query_params.get("export_format", "ndjson")
+        if export_format not in EXPORT_FORMATS:
+            raise exceptions.ValidationError(
+                {"export_format": f"Must be one of: {', '.join(EXPORT_FORMATS)}."}
+            )
+
+        queryset = self.get_queryset()
+        if (min_id := _get_int_param(request, "min_id")) is not None:
+            queryset = queryset.filter(id__gte=min_id)
+        if (max_id := _get_int_param(request, "max_id")) is not None:
+            queryset = queryset.filter(id__lte=max_id)
+
+        rows = (
+            queryset.order_by("id")
+            .values_list(*self.export_columns.values())
+            .iterator(chunk_size=settings.AUTH_DEMO_EXPORT_CHUNK_SIZE)
+        )
+        content_type, encode = EXPORT_FORMATS[export_format]
+
+        response = StreamingHttpResponse(
+            encode(list(self.export_columns), rows), content_type=content_type
+        )
+        filename = f"{self.basename}s.{export_format}"
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+
+USER_FILTER_PARAMETER = OpenApiParameter(
+    "user", OpenApiTypes.INT, description="Only list objects belonging to this user."
+)
+EXPORT_PARAMETERS = [
+    OpenApiParameter(
+        "export_format", OpenApiTypes.STR, enum=["ndjson", "csv"], default="ndjson"
+    ),
+    OpenApiParameter(
+        "user", OpenApiTypes.INT, description="Only export this user's objects."
+    ),
+    OpenApiParameter("min_id", OpenApiTypes.INT, description="The first ID to export."),
+    OpenApiParameter("max_id", OpenApiTypes.INT, description="The last ID to export."),
+]
+EXPORT_RESPONSES = {
+    (200, "application/x-ndjson"): OpenApiTypes.STR,
+    (200, "text/csv"): OpenApiTypes.STR,
+}
+
+
+def _object_response(name, field_name):
+    """Describe an object as the list and create endpoints return it."""
+    return inline_serializer(
+        f"{name}ResponseSerialiser",
+        {
+            "id": fields.IntegerField(),
+            "user": UserSerialiser(),
+            field_name: fields.CharField(),
+        },
+    )
+
+
+def _bulk_create_responses(name, object_response):
+    """Describe the results of a bulk create, one for each object sent."""
+    return inline_serializer(
+        f"{name}BulkCreateResultSerialiser",
+        {
+            "status": fields.IntegerField(),
+            "data": object_response.__class__(required=False),
+            "errors": fields.DictField(required=False),
+        },
+        many=True,
+    )
+
+
+MESSAGE_RESPONSE = _object_response("Message", "message")
+ADVERTISEMENT_RESPONSE = _object_response("Advertisement", "advertisement")
 
 
 @extend_schema_view(
     list=extend_schema(
-        description="List all the messages.",
-        responses=inline_serializer(
-            "MessageResponseSerialiser",
-            {
-                "id": fields.IntegerField(),
-                "user": UserSerialiser(),
-                "message": fields.CharField(),
-            },
-        ),
+        description="List all the messages, newest first.",
+        parameters=[USER_FILTER_PARAMETER],
+        responses=MESSAGE_RESPONSE,
     ),
     create=extend_schema(
         description="Create a new message.",
-        responses=inline_serializer(
-            "MessageResponseSerialiser",
-            {
-                "id": fields.IntegerField(),
-                "user": UserSerialiser(),
-                "message": fields.CharField(),
-            },
+        responses=MESSAGE_RESPONSE,
+    ),
+    export=extend_schema(
+        description="Stream out the messages, oldest first.",
+        parameters=EXPORT_PARAMETERS,
+        responses=EXPORT_RESPONSES,
+    ),
+    bulk_create=extend_schema(
+        description=(
+            "Create a batch of messages, with a status and either the created "
+            "message or the errors for each one."
         ),
+        request=MessageSerialiser(many=True),
+        responses=_bulk_create_responses("Message", MESSAGE_RESPONSE),
     ),
 )
 class MessageViewSet(
+    InstrumentedViewMixin,
+    ThrottleFirstMixin,
     AuthenticationPermissionForCreateMixin,
+    BulkCreateMixin,
+    ReplicaReadsMixin,
+    ConditionalListMixin,
+    CachedListMixin,
+    EagerLoadingMixin,
+    ExportMixin,
+    UserFilterMixin,
+    ValuesListMixin,
     mixins.ListModelMixin,
     mixins.CreateModelMixin,
     viewsets.GenericViewSet,
@@ -64,6 +546,12 @@ class MessageViewSet(
 
     serializer_class = MessageSerialiser
     queryset = Message.objects.all()
+    export_columns = {
+        "id": "id",
+        "user_id": "user_id",
+        "username": "user__username",
+        "message": "message",
+    }
     permission_classes = [
         HasCreatePermission,
     ]
@@ -71,30 +559,40 @@ class MessageViewSet(
 
 @extend_schema_view(
     list=extend_schema(
-        description="List all the advertisements.",
-        responses=inline_serializer(
-            "AdvertisementResponseSerialiser",
-            {
-                "id": fields.IntegerField(),
-                "user": UserSerialiser(),
-                "advertisement": fields.CharField(),
-            },
-        ),
+        description="List all the advertisements, newest first.",
+        parameters=[USER_FILTER_PARAMETER],
+        responses=ADVERTISEMENT_RESPONSE,
     ),
     create=extend_schema(
         description="Create a new advertisement.",
-        responses=inline_serializer(
-            "AdvertisementResponseSerialiser",
-            {
-                "id": fields.IntegerField(),
-                "user": UserSerialiser(),
-                "advertisement": fields.CharField(),
-            },
+        responses=ADVERTISEMENT_RESPONSE,
+    ),
+    export=extend_schema(
+        description="Stream out the advertisements, oldest first.",
+        parameters=EXPORT_PARAMETERS,
+        responses=EXPORT_RESPONSES,
+    ),
+    bulk_create=extend_schema(
+        description=(
+            "Create a batch of advertisements, with a status and either the created "
+            "advertisement or the errors for each one."
         ),
+        request=AdvertisementSerialiser(many=True),
+        responses=_bulk_create_responses("Advertisement", ADVERTISEMENT_RESPONSE),
     ),
 )
 class AdvertisementViewSet(
+    InstrumentedViewMixin,
+    ThrottleFirstMixin,
     AuthenticationPermissionForCreateMixin,
+    BulkCreateMixin,
+    ReplicaReadsMixin,
+    ConditionalListMixin,
+    CachedListMixin,
+    EagerLoadingMixin,
+    ExportMixin,
+    UserFilterMixin,
+    ValuesListMixin,
     mixins.ListModelMixin,
     mixins.CreateModelMixin,
     viewsets.GenericViewSet,
@@ -103,6 +601,44 @@ class AdvertisementViewSet(
 
     serializer_class = AdvertisementSerialiser
     queryset = Advertisement.objects.all()
+    export_columns = {
+        "id": "id",
+        "user_id": "user_id",
+        "username": "user__username",
+        "advertisement": "advertisement",
+    }
     permission_classes = [
         RequiresPremiumSubscriptionPermission,
     ]
+
+
+@extend_schema(
+    description=(
+        "Histograms of query counts and time spent in each part of a request, for "
+        "each view, along with the list cache's hit rates. Staff only."
+    ),
+    responses=OpenApiTypes.OBJECT,
+)
+class MetricsView(APIView):
+    """
+    A view of the request metrics recorded across every worker.
+
+    The subscriber index and connection pools are reported for the process serving
+    the request only.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, _request):
+        """Return the metrics."""
+        return Response(
+            {
+                "views": instrumentation.get_stats(),
+                "list_cache": {
+                    model._meta.label_lower: list_cache.get_stats(model)
+                    for model in (Message, Advertisement)
+                },
+                "subscriber_index": subscriber_index.get_stats(),
+                "connection_pools": pool.get_stats(),
+            }
+        )
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+"""
+A small HTTP load generator for comparing the WSGI and ASGI deployments.
+
+Run the app with `entrypoint.sh run` (gunicorn + gevent) or `entrypoint.sh
+run-asgi` (gunicorn + uvicorn), then point this at it:
+
+    python benchmarks/http_load.py --url http://127.0.0.1:8000/api/messages/ \
+        --username admin --password admin --concurrency 32 --duration 30
+
+Results, including p50/p99 latency and requests per second, are printed as JSON so
+runs against each server can be compared. Only the standard library is used, so it
+can be run from anywhere, except that `--db-url` needs psycopg2 to count the
+connections open to the app's Postgres database while the test runs.
+"""
+
+import argparse
+import json
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+def get_token(url, username, password):
+    """Fetch a JWT access token for the given user."""
+    request = urllib.request.Request(
+        urllib.parse.urljoin(url, "/api/token/"),
+        data=json.dumps({"username": username, "password": password}).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)["access"]
+
+
+def build_request(args, token):
+    """Build the request each worker will send."""
+    headers = {"Accept": "application/json"}
+    data = None
+
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    if args.app_key:
+        headers["X-External-App-Key"] = args.app_key
+    if args.method == "POST":
+        headers["Content-Type"] = "application/json"
+        data = json.dumps({"user": args.username, "message": "Load test"}).encode()
+
+    return urllib.request.Request(
+        args.url, data=data, headers=headers, method=args.method
+    )
+
+
+def worker(request, deadline, latencies, errors, lock):
+    """Send requests one after another until the deadline."""
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+        except (urllib.error.URLError, OSError):
+            with lock:
+                errors.append(time.perf_counter() - start)
+            continue
+
+        with lock:
+            latencies.append(time.perf_counter() - start)
+
+
+def count_connections(db_url, stop, counts):
+    """Count the connections open to the database every so often, until stopped."""
+    # pylint: disable-next=import-outside-toplevel
+    import psycopg2
+
+    connection = psycopg2.connect(db_url)
+    connection.autocommit = True
+    try:
+        with connection.cursor() as cursor:
+            while not stop.is_set():
+                cursor.execute(
+                    "SELECT count(*) FROM pg_stat_activity "
+                    "WHERE datname = current_database() AND pid <> pg_backend_pid()"
+                )
+                counts.append(cursor.fetchone()[0])
+                stop.wait(0.5)
+    finally:
+        connection.close()
+
+
+def percentile_ms(values, percent):
+    """Return the given percentile of some sorted timings, in milliseconds."""
+    if not values:
+        return None
+
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index] * 1000
+
+
+def run(args):
+    """Run the load test and return its results."""
+    token = get_token(args.url, args.username, args.password) if args.password else None
+    request = build_request(args, token)
+    latencies, errors, lock = [], [], threading.Lock()
+
+    connections, stop = [], threading.Event()
+    if args.db_url:
+        counter = threading.Thread(
+            target=count_connections, args=(args.db_url, stop, connections)
+        )
+        counter.start()
+
+    deadline = time.perf_counter() + args.duration
+    threads = [
+        threading.Thread(
+            target=worker, args=(request, deadline, latencies, errors, lock)
+        )
+        for _ in range(args.concurrency)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    if args.db_url:
+        counter.join()
+
+    latencies.sort()
+    results = {
+        "url": args.url,
+        "method": args.method,
+        "concurrency": args.concurrency,
+        "duration": elapsed,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": len(latencies) / elapsed,
+        "latency_ms": {
+            "p50": percentile_ms(latencies, 50),
+            "p99": percentile_ms(latencies, 99),
+            "mean": statistics.mean(latencies) * 1000 if latencies else None,
+        },
+    }
+    if connections:
+        results["db_connections"] = {
+            "max": max(connections),
+            "mean": statistics.mean(connections),
+        }
+
+    return results
+
+
+def main():
+    """Parse the arguments and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000/api/messages/")
+    parser.add_argument("--method", choices=("GET", "POST"), default="GET")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", help="Authenticate with a JWT for this user.")
+    parser.add_argument(
+        "--app-key", help="Send requests as the third-party app with this API key."
+    )
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument(
+        "--db-url", help="Count the connections open to this Postgres database."
+    )
+
+    print(json.dumps(run(parser.parse_args()), indent=2))
+
+
+if __name__ == "__main__":
+    main()
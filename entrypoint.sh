@@ -8,10 +8,18 @@ export PORT
 
 case "$1" in
     run)
+        # Greenlets share a pool of database connections in each worker.
+        : "${DB_POOL_SIZE:=10}"
+        export DB_POOL_SIZE
         . ./app.sh deploy
         exec gunicorn -b 0.0.0.0:8000 --worker-class=gevent --timeout=90 linktreetest.wsgi:application
         ;;
 
+    run-asgi)
+        . ./app.sh deploy
+        exec gunicorn -b 0.0.0.0:8000 --worker-class=uvicorn.workers.UvicornWorker --timeout=90 linktreetest.asgi:application
+        ;;
+
     test)
         . ./app.sh test
         ;;
@@ -9,8 +9,9 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+from auth_demo.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "linktreetest.settings")
+os.environ.setdefault("AUTH_DEMO_ASYNC_VIEWS", "1")
 
 application = get_asgi_application()
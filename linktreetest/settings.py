@@ -46,8 +46,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "auth_demo.instrumentation.instrumentation_middleware",
     "django.middleware.security.SecurityMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    "auth_demo.middleware.AsyncWhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -84,6 +85,57 @@ DATABASES = {
     "default": dj_database_url.parse(os.environ.get("DB_URL")),
 }
 
+# Read replicas of the default database, as a comma separated list of URLs. Tests
+# run against the default database in their place.
+for index, url in enumerate(
+    filter(None, os.environ.get("DB_REPLICA_URLS", "").split(","))
+):
+    DATABASES[f"replica_{index}"] = {
+        **dj_database_url.parse(url),
+        "TEST": {"MIRROR": "default"},
+    }
+
+# Share a pool of connections to each PostgreSQL database between a worker's
+# greenlets, or threads, rather than opening one for every request. See
+# `auth_demo.postgresql_pool`.
+if DB_POOL_SIZE := int(os.environ.get("DB_POOL_SIZE", "0")):
+    for database in DATABASES.values():
+        if database["ENGINE"] in (
+            "django.db.backends.postgresql",
+            "django.db.backends.postgresql_psycopg2",
+        ):
+            database.update(
+                ENGINE="auth_demo.postgresql_pool",
+                # Hand connections back to the pool at the end of every request.
+                CONN_MAX_AGE=0,
+                POOL={
+                    "SIZE": DB_POOL_SIZE,
+                    "MAX_OVERFLOW": int(os.environ.get("DB_POOL_MAX_OVERFLOW", "10")),
+                    "TIMEOUT": float(os.environ.get("DB_POOL_TIMEOUT", "30")),
+                    "RECYCLE": float(os.environ.get("DB_POOL_RECYCLE", "3600")),
+                    "PING_AFTER": float(os.environ.get("DB_POOL_PING_AFTER", "30")),
+                },
+            )
+
+DATABASE_ROUTERS = ["auth_demo.replicas.ReplicaRouter"]
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# Point this at a shared cache in production so that every worker sees the same
+# cache versions and list pages, e.g. memcached with
+# CACHE_BACKEND=django.core.cache.backends.memcached.PyMemcacheCache, or Redis with
+# CACHE_BACKEND=django_redis.cache.RedisCache.
+
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get(
+            "CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": os.environ.get("CACHE_LOCATION", ""),
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -127,6 +179,7 @@ USE_TZ = True
 
 STATIC_URL = "/static/"
 STATIC_ROOT = "/static"
+STATICFILES_STORAGE = "whitenoise.storage.CompressedStaticFilesStorage"
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
@@ -135,12 +188,20 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
-        "auth_demo.authentication.ThirdPartyAppAuthentication",
-        "rest_framework.authentication.SessionAuthentication",
+        "auth_demo.authentication.DispatchingAuthentication",
     ),
-    "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
+    "DEFAULT_THROTTLE_CLASSES": (
+        "auth_demo.throttling.AppRateThrottle",
+        "auth_demo.throttling.UserRateThrottle",
+    ),
+    "DEFAULT_RENDERER_CLASSES": (
+        "auth_demo.renderers.JSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ),
+    "DEFAULT_SCHEMA_CLASS": "auth_demo.schema.AutoSchema",
     "DEFAULT_PERMISSION_CLASSES": ("rest_framework.permissions.IsAuthenticated",),
+    "DEFAULT_PAGINATION_CLASS": "auth_demo.pagination.IdCursorPagination",
+    "PAGE_SIZE": 50,
 }
 
 SPECTACULAR_SETTINGS = {
@@ -148,3 +209,78 @@ SPECTACULAR_SETTINGS = {
     "VERSION": "0.1.0",
     "SERVE_INCLUDE_SCHEMA": True,
 }
+
+
+# Auth demo
+
+# How many parent links away a user can be from an account and still act on its
+# behalf: 1 for its direct parents, or 0 to turn delegation off. `User.parents`
+# doesn't record which end of a link is the parent, so anything further would let
+# siblings act for each other and is rejected. Run
+# `./manage.py rebuild_user_closure` and then `./manage.py rebuild_entitlements`
+# after changing this.
+AUTH_DEMO_DELEGATION_DEPTH = 1
+
+# The largest page a client can ask for from the list endpoints.
+AUTH_DEMO_MAX_PAGE_SIZE = 500
+
+# The most objects that can be created in one request to a bulk endpoint.
+AUTH_DEMO_BULK_CREATE_MAX_ITEMS = 100
+
+# How many rows to fetch from the database at a time when streaming an export.
+AUTH_DEMO_EXPORT_CHUNK_SIZE = 2000
+
+# How long to cache serialised list pages for, in seconds. 0 turns the cache off.
+AUTH_DEMO_LIST_CACHE_TIMEOUT = 300
+
+# Where `./manage.py generate_schema` writes the OpenAPI schema, under STATIC_ROOT.
+AUTH_DEMO_STATIC_SCHEMA = "schema/openapi.yaml"
+
+# How long to cache each user's advert entitlements for, in seconds. They're
+# invalidated whenever they change, so this only bounds how long an entitlement
+# read inside a transaction that's rolled back can outlive it.
+AUTH_DEMO_ENTITLEMENT_CACHE_TIMEOUT = 300
+
+# Build list pages straight from `.values()` rows, rather than model instances and
+# serialisers. The output is the same either way.
+AUTH_DEMO_VALUES_LISTS = True
+
+# Serve the list and create endpoints through coroutine views. This is turned on by
+# `linktreetest.asgi`, and should be left off under WSGI.
+AUTH_DEMO_ASYNC_VIEWS = os.environ.get("AUTH_DEMO_ASYNC_VIEWS") == "1"
+
+# The fraction of requests to record query counts and timings for, between 0 and 1.
+AUTH_DEMO_INSTRUMENTATION_SAMPLE_RATE = 0.01
+
+# Accept the name of a third-party app in the `X-External-App` header in place of
+# its API key. This is insecure, and only meant for moving existing apps over.
+AUTH_DEMO_APP_NAME_AUTHENTICATION = False
+
+# Where the rate limits' token buckets are kept. The default keeps them in each
+# process; use `auth_demo.throttling.RedisTokenBucketBackend` with a Redis URL to
+# share them between processes.
+AUTH_DEMO_THROTTLE_BACKEND = os.environ.get(
+    "THROTTLE_BACKEND", "auth_demo.throttling.LocalTokenBucketBackend"
+)
+AUTH_DEMO_THROTTLE_LOCATION = os.environ.get("THROTTLE_LOCATION", "")
+
+# The default rate limit for each third-party app, in requests per minute, and how
+# many requests it can make at once. Apps can have their own limits.
+AUTH_DEMO_APP_THROTTLE_RATE = 600
+AUTH_DEMO_APP_THROTTLE_BURST = 100
+
+# The rate limit for each user.
+AUTH_DEMO_USER_THROTTLE_RATE = 300
+AUTH_DEMO_USER_THROTTLE_BURST = 60
+
+# The most memory each process's index of app subscribers can use, in bytes. Apps
+# that don't fit have their subscriptions checked against the database.
+AUTH_DEMO_SUBSCRIBER_INDEX_MAX_BYTES = 64 * 1024 * 1024
+
+# The databases that list and export requests, and permission lookups, can read
+# from.
+AUTH_DEMO_REPLICA_DATABASES = [alias for alias in DATABASES if alias != "default"]
+
+# How long, in seconds, to keep reading from the primary after a caller writes
+# something, or after a list's rows change. This should cover the replicas' lag.
+AUTH_DEMO_REPLICA_PIN_SECONDS = 5